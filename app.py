@@ -3,6 +3,7 @@ import threading
 import webbrowser
 from dash import Dash, dcc, html, Input, Output
 
+import metrics
 import write
 import read
 import realtime
@@ -54,6 +55,7 @@ def create_app():
     write.register_callbacks(app)
     read.register_callbacks(app)
     realtime.register_callbacks(app)
+    metrics.register_routes(app)
 
     app.validation_layout = html.Div([
         dcc.Location(id="url"),
@@ -67,9 +69,13 @@ def create_app():
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--debug", action="store_true")
+    parser.add_argument("--fake-preview", action="store_true",
+                        help="feed the B1/B2 live preview from simulated boards instead of COM ports")
     args = parser.parse_args()
 
     app = create_app()
+    if args.fake_preview:
+        realtime.start_fake_preview()
 
     def open_browser():
         webbrowser.open("http://127.0.0.1:8050")
@@ -0,0 +1,79 @@
+// live_stream.js
+// Server-push updates for the Live Data page (realtime.py, /live/stream).
+// The rt-tick / rt-plot-tick intervals are served disabled: readings are
+// appended with Plotly.extendTraces and status text is set with
+// dash_clientside.set_props.  Only while the stream is down (or the browser has
+// no EventSource) are the intervals turned on, and the graphs are rebuilt from
+// the server so nothing is lost or duplicated.
+(function () {
+    var source = null;
+    var refreshAt = 0;
+
+    function setProps(id, props) {
+        window.dash_clientside.set_props(id, props);
+    }
+
+    function graphDiv(col) {
+        // pattern-matching ids are rendered as JSON with sorted keys
+        var el = document.getElementById(JSON.stringify({index: col, type: "rt-graph"}));
+        return el && (el.classList.contains("js-plotly-plot") ? el : el.querySelector(".js-plotly-plot"));
+    }
+
+    function requestRebuild() {
+        var now = Date.now();
+        if (now - refreshAt < 2000) return;
+        refreshAt = now;
+        setProps("rt-plot-refresh", {data: now});
+    }
+
+    function onReading(e) {
+        var r = JSON.parse(e.data);
+        Object.keys(r.values).forEach(function (col) {
+            var gd = graphDiv(col);
+            var meta = gd && gd.layout && gd.layout.meta;
+            if (!meta) { requestRebuild(); return; }
+            Plotly.extendTraces(gd, {x: [[r.t - meta.t0]], y: [[r.values[col]]]}, [0], meta.max_points);
+        });
+    }
+
+    function onStatus(e) {
+        var s = JSON.parse(e.data);
+        setProps("rt-progress-fill", {style: s.style});
+        setProps("rt-board-status", {children: s.text});
+    }
+
+    function setPolling(on) {
+        setProps("rt-tick", {disabled: !on});
+        setProps("rt-plot-tick", {disabled: !on});
+    }
+
+    function open() {
+        if (!window.EventSource) { setPolling(true); return false; }
+        source = new EventSource("/live/stream");
+        source.addEventListener("reading", onReading);
+        source.addEventListener("status", onStatus);
+        source.onopen = function () {
+            setPolling(false);
+            requestRebuild();
+        };
+        source.onerror = function () {
+            setPolling(true);
+            setProps("rt-plot-cursor", {data: null});
+        };
+        return true;
+    }
+
+    function close() {
+        source.close();
+        source = null;
+    }
+
+    // the page is swapped in and out by the router; follow it
+    var polling = false;
+    setInterval(function () {
+        if (!window.dash_clientside || !window.dash_clientside.set_props) return;
+        var onLivePage = !!document.getElementById("rt-graphs");
+        if (onLivePage && !source && !polling) polling = !open();
+        else if (!onLivePage) { if (source) close(); polling = false; }
+    }, 1000);
+})();
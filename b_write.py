@@ -1,338 +1,336 @@
 #b_write.py
-import os, re, time, csv, threading, json
+import time, queue, threading
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple
 
-import serial
+import boardstate
+import catalog
+import colstore
+import firebase_sink
+import ingest
+import merge
+import metrics
+import partition
+from block_parser import clean_line, is_new_data, parse_block, parse_pair
+from csv_sink import CsvSink
 
 
-class _FirebaseGate:
-    def __init__(self):
-        self.ready = False
-        self.disabled_reason = None
-        self._seq_cache: Dict[str, int] = {}  # "<stage>/<sub>/<test>/<B?>/readings" -> next int
-        self._errors = 0
-        self._max_errors = 3
-
-    def disable(self, reason: str):
-        self.ready = False
-        self.disabled_reason = reason
-
-    def init(self):
-        if self.ready or self.disabled_reason:
-            return
-        try:
-            import firebase_admin 
-            from firebase_admin import credentials 
-            if getattr(firebase_admin, "_apps", None):
-                self.ready = True
-                return
-
-            db_url = os.getenv("DATABASE_URL") or os.getenv("databaseURL")
-            if not db_url:
-                self.disable("DATABASE_URL missing")
-                return
-
-            key_env = os.getenv("FIREBASE_KEY")
-            if key_env:
-                svc = json.loads(key_env)
-                if isinstance(svc.get("private_key"), str):
-                    svc["private_key"] = svc["private_key"].replace("\\n", "\n")
-                cred = credentials.Certificate(svc)
-            else:
-                path = (
-                    os.getenv("FIREBASE_CREDENTIALS_PATH")
-                    or os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
-                    or "serviceAccountKey.json"
-                )
-                cred = credentials.Certificate(path)
-
-            firebase_admin.initialize_app(cred, {"databaseURL": db_url})
-            self.ready = True
-        except Exception as e:
-            self.disable(f"init error: {e}")
-
-    def _with_db(self, fn) -> bool:
-        """Run a db op, returning True on success; on repeated failures go offline."""
-        if not self.ready or self.disabled_reason:
-            return False
-        try:
-            from firebase_admin import db 
-            fn(db)
-            return True
-        except Exception as e:
-            self._errors += 1
-            if self._errors >= self._max_errors:
-                self.disable(f"write error: {e}")
-            return False
-
-    def _seq_path(self, stage:str, sub:str, test_id:str, board:str)->str:
-        return f"{stage}/{sub}/{test_id}/{board}/readings"
-
-    def load_seq_if_needed(self, stage: str, substance: str, test_id: str, boards: List[str]):
-        if not self.ready or self.disabled_reason:
-            for b in boards:
-                self._seq_cache[self._seq_path(stage, substance, test_id, b)] = 1
-            return
-
-        def _op(db):
-            base = f"{stage}/{substance}/{test_id}"
-            for b in boards:
-                path = f"{base}/{b}/readings"
-                snap = db.reference(path).get()
-                if isinstance(snap, dict) and snap:
-                    try:
-                        mx = max(int(k) for k in snap.keys() if str(k).isdigit())
-                    except ValueError:
-                        mx = 0
-                else:
-                    mx = 0
-                self._seq_cache[path] = mx + 1
-
-        self._with_db(_op)
-
-    def put_reading(self, stage: str, substance: str, test_id: str,
-                    board_id: str, ts_epoch: float, readings: Dict[str, float]):
-
-        path = self._seq_path(stage, substance, test_id, board_id)
-        n = self._seq_cache.get(path, 1)
-        ts_label = datetime.fromtimestamp(ts_epoch).strftime("%H-%M-%S %d-%m-%Y")
-
-        def _op(db):
-            db.reference(f"{path}/{n}").set({"timestamp": ts_label, "readings": readings})
-
-        ok = self._with_db(_op)
-        
-        if ok or not self.ready or self.disabled_reason:
-            self._seq_cache[path] = n + 1
-
-_FB = _FirebaseGate()
+_FB = firebase_sink.SINK   # one connection and sequence allocator, shared with lb_write/realtime
 
 
 PREFIX_MAP = {"Testing": "T", "Experiment": "E", "Deployment": "D", "Baseline": "B"}
 BAUD_ARDUINO_DEFAULT = 9600
+PREAMBLE_MAX_LINES = 32    # reading lines kept from before "New Data" (Board1 prints 12)
+
+# per-board status and latest block, plus "Firebase"/"Columnar" status, and in BOARDS.run
+# the capture parameters, first read, output paths and writer counts; see boardstate
+WRITER_STATS = ("rows", "stale_rows_avoided", "duplicate_blocks_avoided", "queue_dropped")
+BOARDS = boardstate.BoardStates()
 
-STATE = {
-    "active": False,
-    "first_read_epoch": None,
-    "duration_sec": 0,
-    "stage": None,
-    "substance": None,
-    "test_id": None,
-    "flowrate": None,
-    "interval": 1.0,
-    "cumulative_csv": None,
-    "folder": None,
-    "per_board_status": {},  
-}
-
-_THREADS: Dict[str, "BSerialReader"] = {}
-_LATEST_BLOCKS: Dict[str, Dict[str, Tuple[float, Optional[str]]]] = {}
-
-PAIR_RE = re.compile(r"^\s*([A-Za-z0-9µμ°/%\-\s\(\)\.\[\]]+?)\s*:\s*([\-+]?[0-9]*\.?[0-9]+)\s*([A-Za-z°%/\.]+)?\s*$")
-NEW_DATA_RE = re.compile(r"^\s*new\s*data\s*$", re.IGNORECASE)
-
-def _clean_ascii(s: str) -> str:
-    return re.sub(r"[^\x20-\x7E\n\r\t]", "", s)
+_READERS: Dict[str, "BSerialReader"] = {}
+BLOCK_QUEUE_SIZE = 256
+OVERLOAD_WAIT_S = 0.5       # a reader waits this long on a full queue before a block is dropped
+_EOS = ("", None)           # end of stream: the writer drains up to here, then closes
+DRAIN_TIMEOUT_S = 10.0      # stop_capture: longest wait for the writer to empty the queue
+_BLOCK_QUEUE: "queue.Queue[Tuple[str, Dict[str, Tuple[float, Optional[str]]]]]" = queue.Queue(maxsize=BLOCK_QUEUE_SIZE)
+metrics.gauge("enose_b_writer_queue_depth", "Blocks waiting for the B CSV writer.", _BLOCK_QUEUE.qsize)
 
 def _fmt(v):
     if isinstance(v, float):
         return round(v, 3)
     return v
 
-def _make_paths(stage: str, substance: str):
-    folder = os.path.join("Baseline","baseline") if stage=="Baseline" else os.path.join(stage, substance)
-    os.makedirs(folder, exist_ok=True)
-    cumulative_csv = os.path.join(folder, f"{('baseline' if stage=='Baseline' else substance)}_B_Readings.csv")
+def _make_paths(stage: str, substance: str, test_id: Optional[str], ts_epoch: Optional[float] = None):
+    folder = partition.ensure_test_dir(stage, substance, test_id)
+    cumulative_csv = partition.path_for(stage, substance, test_id, "B", ts_epoch)
     return {"folder": folder, "cumulative_csv": cumulative_csv}
 
-def _parse_line(line: str):
-    m = PAIR_RE.match(line)
-    if not m: return None
-    label, val, unit = m.group(1).strip(), m.group(2), m.group(3)
-    try:
-        f = float(val)
-    except ValueError:
-        return None
-    unit = (unit or "").strip() or None
-    if unit == "C": unit = "°C"
-    return label, f, unit
-
-class BSerialReader(threading.Thread):
-    daemon = True
+class BSerialReader:
+    """Block framer for one Arduino; lines arrive from the shared ingest engine."""
     def __init__(self, board_id: str, port: str, interval_s: float):
-        super().__init__(name=f"{board_id}-B-reader")
         self.board_id = board_id
         self.port = port
         self.interval_s = interval_s
-        self.stop_flag = threading.Event()
-        self.ser: Optional[serial.Serial] = None
+        self.key = f"B:{board_id}"
+        self._buffer: List[str] = []
+        self._in_block = False
+        self._block_t = 0.0
+        self.decimator = ingest.Decimator(interval_s)
+        self.counters = metrics.board(self.key)
 
-    def stop(self): self.stop_flag.set()
+    def start(self):
+        ingest.ENGINE.add(self.key, self.port, BAUD_ARDUINO_DEFAULT, self.feed_line,
+                          self._on_status, self._on_close)
 
-    def run(self):
-        STATE["per_board_status"][self.board_id] = "starting"
-        try:
-            self.ser = serial.Serial(self.port, BAUD_ARDUINO_DEFAULT, timeout=1)
-            time.sleep(1.0)
-            STATE["per_board_status"][self.board_id] = "listening"
-        except Exception as e:
-            STATE["per_board_status"][self.board_id] = f"error open: {e}"
-            return
-
-        buffer: List[str] = []
-        in_block = False
-
-        while not self.stop_flag.is_set():
-            try:
-                raw = self.ser.readline().decode(errors="ignore")
-            except Exception:
-                time.sleep(0.25); continue
+    def stop(self): ingest.ENGINE.remove(self.key)
 
-            line = _clean_ascii(raw).strip()
-            if not line: continue
+    def join(self, timeout: Optional[float] = None): ingest.ENGINE.wait_closed(self.key, timeout or 2.0)
 
-            if NEW_DATA_RE.match(line):
-                if buffer:
-                    self._emit_block(buffer); buffer = []
-                    time.sleep(self.interval_s)
-                in_block = True; continue
+    def _on_status(self, status: str):
+        BOARDS.publish(self.board_id, status=status)
 
-            if in_block:
-                if line.startswith("*"):
-                    self._emit_block(buffer); buffer = []
-                    in_block = False; time.sleep(self.interval_s); continue
-                buffer.append(line)
+    def _on_close(self):
+        if self._in_block: self._end_block()
 
+    def feed_line(self, raw: bytes, arrived: float):
+        line = clean_line(raw)
+        if not line:
+            # the firmware closes a block with empty lines; outside one they end a stale preamble
+            if self._in_block: self._end_block()
+            else: self._buffer = []
+            return
+        self.counters.lines_parsed += 1
+
+        if is_new_data(line):
+            if self._in_block: self._end_block()
+            self._in_block = True; self._block_t = arrived; return
+
+        if self._in_block:
+            if line[0] == "*": self._end_block(); return
+            self._buffer.append(line)
+        elif len(self._buffer) < PREAMBLE_MAX_LINES and parse_pair(line):
+            # Board1 prints its BME688 readings just before "New Data (synchronized)"
+            self._buffer.append(line)
+
+    def _end_block(self):
+        if self._buffer: self._offer_block(self._buffer); self._buffer = []
+        self._in_block = False
+
+    def _offer_block(self, lines: List[str]):
+        readings = parse_block(lines)
+        self.counters.parse_failures += sum(1 for ln in lines if ":" in ln) - len(readings)
+        # parsed first: a block with no readings must not take the decimation slot of the next one
+        if readings and self.decimator.offer(self._block_t):
+            self._emit_block(readings, self._block_t)
+
+    def _emit_block(self, readings: List[Tuple[str, float, Optional[str]]], captured_at: float):
+        parsed: Dict[str, Tuple[float, Optional[str]]] = {label: (val, unit) for label, val, unit in readings}
+        self.counters.blocks_emitted += 1
+        BOARDS.publish(self.board_id, status="capturing", block=dict(parsed), block_t=captured_at)
+        parsed["_captured_at_"] = (captured_at, None)
+        _push_block(self.board_id, parsed)
+        if merge.LIVE.active:
+            merge.LIVE.push(self.board_id, captured_at, {_colname(self.board_id, k, u): v
+                                                         for k, (v, u) in parsed.items() if k != "_captured_at_"})
+
+        BOARDS.first_read(captured_at)
+
+def _colname(board_id: str, label: str, unit: Optional[str]) -> str:
+    return f"{board_id} - {label}{f' ({unit})' if unit else ''}"
+
+_EMPTY: Dict[str, Tuple[float, Optional[str]]] = {}
+
+def _assemble_row(col_index: List[Tuple[str, str, Optional[str]]],
+                  blocks: Dict[str, Dict[str, Tuple[float, Optional[str]]]]) -> List[Optional[float]]:
+    """Data cells for one row by direct lookup; a cell is blank if the board or label is missing or its unit changed."""
+    out: List[Optional[float]] = []
+    for b, label, unit in col_index:
+        hit = blocks.get(b, _EMPTY).get(label)
+        out.append(_fmt(hit[0]) if hit is not None and hit[1] == unit else None)
+    return out
+
+def _push_block(board_id: str, parsed: Dict[str, Tuple[float, Optional[str]]]):
+    """
+    Hand a block to the writer.  A full queue first waits up to OVERLOAD_WAIT_S
+    for the writer; only if it is still full is the writer overloaded, and the
+    oldest unwritten block is dropped and reported.  With backpressure (a
+    replay) the reader waits as long as the writer is running instead.
+    """
+    while True:
         try:
-            if self.ser: self.ser.close()
-        except Exception:
+            _BLOCK_QUEUE.put((board_id, parsed), timeout=OVERLOAD_WAIT_S); return
+        except queue.Full:
+            w = _WRITER_THREAD
+            if not (BOARDS.run.backpressure and w is not None and w.is_alive()): break
+    while True:
+        try:
+            lost, _blk = _BLOCK_QUEUE.get_nowait()
+            _overloaded(lost)
+        except queue.Empty:
+            pass
+        try:
+            _BLOCK_QUEUE.put_nowait((board_id, parsed)); return
+        except queue.Full:
             pass
 
-    def _emit_block(self, lines: List[str]):
-        parsed: Dict[str, Tuple[float, Optional[str]]] = {}
-        for ln in lines:
-            tup = _parse_line(ln)
-            if tup:
-                label, val, unit = tup
-                parsed[label] = (val, unit)
-        if not parsed: return
-        parsed["_captured_at_"] = (time.time(), None)
-        _LATEST_BLOCKS[self.board_id] = parsed
-
-        if STATE["first_read_epoch"] is None:
-            STATE["first_read_epoch"] = parsed["_captured_at_"][0]
-        STATE["per_board_status"][self.board_id] = "capturing"
+def _overloaded(lost: str):
+    BOARDS.count(queue_dropped=1)
+    metrics.board(f"B:{lost}").blocks_dropped += 1
+    dropped = BOARDS.run.writer_stats.get("queue_dropped", 0)
+    BOARDS.publish("Writer", status=f"overloaded, {dropped} blocks dropped")
+    if dropped == 1 or dropped % 100 == 0:
+        print(f"[B] writer queue full for {OVERLOAD_WAIT_S} s: dropped a {lost} block ({dropped} so far)")
 
 # === CSV writer thread (cumulative only) ===
 class BCumulativeWriter(threading.Thread):
+    """
+    Wakes only when a reader pushes a block. One row is written per fresh
+    block-set (every enabled board reported once, or a board reported again
+    before the others did), stamped with the newest capture time in the set.
+    Boards without a fresh block are left blank instead of repeating their
+    previous reading.
+    """
     daemon = True
     def __init__(self):
         super().__init__(name="B-Cumulative-Writer")
-        self.stop_flag = threading.Event()
+        self.ended = False
         self.header: Optional[List[str]] = None
-
-    def stop(self): self.stop_flag.set()
+        self.col_index: List[Tuple[str, str, Optional[str]]] = []
+        self.enabled: List[str] = []
+        self._pending: Dict[str, Dict[str, Tuple[float, Optional[str]]]] = {}
+        self._last_row_epoch: Optional[float] = None
+        self.units: Dict[str, Optional[str]] = {}
+        self.sink: Optional[CsvSink] = None
+        self.cols: Optional[colstore.ColumnSink] = None
+
+    def finish(self, timeout: float):
+        """Called once the readers are closed: write every block still queued, then close."""
+        try: _BLOCK_QUEUE.put(_EOS, timeout=timeout)
+        except queue.Full: print("[B] writer did not take the end of stream; queued blocks are lost")
+        self.join(timeout)
+
+    def _next_block(self, timeout: float):
+        """The next block, None on timeout; sets ``ended`` at the end of stream."""
+        try: item = _BLOCK_QUEUE.get(timeout=timeout)
+        except queue.Empty: return None
+        if item is _EOS:
+            self.ended = True; return None
+        return item
+
+    def _open_sinks(self, csv_path: str):
+        """(Re)open the CSV and columnar outputs on ``csv_path``: at start and on day rollover."""
+        if self.sink: self.sink.close()
+        if self.cols: self.cols.close(); self.cols = None
+        BOARDS.publish_run(cumulative_csv=csv_path)
+        self.sink = CsvSink(csv_path, self.header)
+        if colstore.ENABLED:
+            self.cols = colstore.open_sink(csv_path, self.header[1:], self.units)
 
     def run(self):
-        paths = _make_paths(STATE["stage"], STATE["substance"])
-        STATE["folder"] = paths["folder"]
-        STATE["cumulative_csv"] = paths["cumulative_csv"]
+        run = BOARDS.run
+        paths = _make_paths(run.stage, run.substance, run.test_id, time.time())
+        BOARDS.publish_run(folder=paths["folder"])
 
-        enabled = [b for b in STATE["per_board_status"].keys() if b in ("B1","B2")]
+        self.enabled = enabled = [b for b in BOARDS.view if b in ("B1","B2")]
 
         # Wait briefly for first blocks so header includes all sensors.
         t0 = time.time()
-        while not self.stop_flag.is_set():
-            if all(b in _LATEST_BLOCKS for b in enabled) or (time.time()-t0>15):
+        held = None     # a board's second block, read before the others reported
+        while not self.ended:
+            if all(b in self._pending for b in enabled) or (time.time()-t0>15):
                 break
-            time.sleep(0.1)
-        if self.stop_flag.is_set(): return
-
-        # Build header
-        cols = ["Timestamp","Flowrate (L/min)"]
-        seen = {}
+            item = self._next_block(0.1)
+            if item and item[0] in self._pending:
+                held = item; break
+            if item: self._pending[item[0]] = item[1]
+        if not self._pending: return
+
+        # Build header and the column -> (board, label, unit) index used to fill rows
+        seen: Dict[str, Tuple[str, str, Optional[str]]] = {}
         for b in enabled:
-            blk = _LATEST_BLOCKS.get(b,{})
+            blk = self._pending.get(b,{})
             for k,(_v,unit) in blk.items():
                 if k == "_captured_at_": continue
-                colname = f"{b} - {k}{f' ({unit})' if unit else ''}"
-                seen[colname]=None
-        cols.extend(sorted(seen.keys(), key=str.lower))
-        self.header = cols
-
-        need_header = (not os.path.exists(STATE["cumulative_csv"])) or os.path.getsize(STATE["cumulative_csv"])==0
-        if need_header:
-            os.makedirs(os.path.dirname(STATE["cumulative_csv"]), exist_ok=True)
-            with open(STATE["cumulative_csv"],"a",newline="",encoding="utf-8") as fh:
-                csv.writer(fh).writerow(self.header)
-
-        
+                seen[_colname(b, k, unit)] = (b, k, unit)
+        data_cols = sorted(seen.keys(), key=str.lower)
+        self.header = ["Timestamp","Flowrate (L/min)"] + data_cols
+        self.col_index = [seen[c] for c in data_cols]
+        self.units = {c: u for c, (_b, _l, u) in zip(data_cols, self.col_index)}
+        self._open_sinks(paths["cumulative_csv"])
+
+        # offline or not, readings are numbered and queued; the uploader sends them once connected
         _FB.init()
-        if _FB.ready:
-            STATE["per_board_status"]["Firebase"] = "online"
-            _FB.load_seq_if_needed(STATE["stage"], STATE["substance"], STATE["test_id"] or "", enabled)
-        else:
-            STATE["per_board_status"]["Firebase"] = f"offline ({_FB.disabled_reason})"
-
-    
-        while not self.stop_flag.is_set():
-            fresh = [(_LATEST_BLOCKS[b]["_captured_at_"][0], b) for b in enabled if b in _LATEST_BLOCKS]
-            if not fresh:
-                time.sleep(0.05); continue
-
-            ts_epoch = max(t for t,_ in fresh)
-            ts_human = datetime.fromtimestamp(ts_epoch).strftime("%Y-%m-%d %H:%M:%S")
-            row = [ts_human, _fmt(STATE["flowrate"])]
-
-    
-            fb_payloads: List[Tuple[str, Dict[str,float]]] = []
-            for b in enabled:
-                blk = _LATEST_BLOCKS.get(b,{})
-                rds = {}
-                for k,(v,unit) in blk.items():
-                    if k == "_captured_at_": continue
-                    rds[f"{k}{f' ({unit})' if unit else ''}"] = _fmt(v)
-                if rds: fb_payloads.append((b, rds))
-
-            
-            for c in self.header[2:]:
-                try: b,_ = c.split(" - ",1)
-                except ValueError: row.append(None); continue
-                src = _LATEST_BLOCKS.get(b,{})
-                val=None
-                for k,(v,unit) in src.items():
-                    if k == "_captured_at_": continue
-                    if f"{b} - {k}{f' ({unit})' if unit else ''}" == c:
-                        val=v; break
-                row.append(_fmt(val) if val is not None else None)
-
-            # write CSV
+        seq_file = firebase_sink.seq_file_for(partition.seq_base(run.stage, run.substance, run.test_id, "B"))
+        _FB.load_seq(run.stage, run.substance, run.test_id or "",
+                     {b: seq_file for b in enabled})
+        _publish_fb()
+
+        try:
+            if held or all(b in self._pending for b in enabled): self._flush()
+            if held: self._pending[held[0]] = held[1]
+
+            while not self.ended:
+                item = self._next_block(0.25)
+                if item:
+                    board_id, blk = item
+                    if board_id in self._pending: self._flush()
+                    self._pending[board_id] = blk
+                    if all(b in self._pending for b in enabled): self._flush()
+                else:
+                    self.sink.maybe_flush()
+                    if self.cols: self.cols.maybe_flush()
+            if self._pending: self._flush()
+        finally:
+            self.sink.close()
+            if self.cols: self.cols.close()
+            catalog.CATALOG.flush()
+
+    def _extend_header(self, blocks: Dict[str, Dict[str, Tuple[float, Optional[str]]]]):
+        """Sensors first seen after the header was built become new columns (a new CSV segment)."""
+        known = set(self.col_index)
+        added: Dict[str, Tuple[str, str, Optional[str]]] = {}
+        for b, blk in blocks.items():
+            for k, (_v, unit) in blk.items():
+                if k != "_captured_at_" and (b, k, unit) not in known:
+                    added[_colname(b, k, unit)] = (b, k, unit)
+        if not added: return
+        names = sorted(added, key=str.lower)
+        self.header += names
+        self.col_index += [added[c] for c in names]
+        self.units.update({c: added[c][2] for c in names})
+        self.sink.add_columns(names)
+        if self.cols: self.cols.add_columns(names, self.units)
+
+    def _flush(self):
+        fresh, self._pending = self._pending, {}
+        run = BOARDS.run
+        ts_epoch = max(blk["_captured_at_"][0] for blk in fresh.values())
+        ts_human = datetime.fromtimestamp(ts_epoch).strftime("%Y-%m-%d %H:%M:%S")
+        row = [ts_human, _fmt(run.flowrate)]
+
+        fb_payloads: List[Tuple[str, Dict[str,float]]] = []
+        for b in self.enabled:
+            blk = fresh.get(b,{})
+            rds = {}
+            for k,(v,unit) in blk.items():
+                if k == "_captured_at_": continue
+                rds[f"{k}{f' ({unit})' if unit else ''}"] = _fmt(v)
+            if rds: fb_payloads.append((b, rds))
+
+        self._extend_header(fresh)
+        row.extend(_assemble_row(self.col_index, fresh))
+
+        csv_path = partition.path_for(run.stage, run.substance, run.test_id, "B", ts_epoch)
+        if csv_path != run.cumulative_csv:
+            self._open_sinks(csv_path)
+        self.sink.write(row)
+        catalog.CATALOG.note_row(csv_path, run.stage, run.substance, run.test_id, "B", ts_epoch, run.flowrate)
+        if self.cols:
             try:
-                with open(STATE["cumulative_csv"],"a",newline="",encoding="utf-8") as fh:
-                    csv.writer(fh).writerow(row)
-            except PermissionError:
-                stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                alt = os.path.splitext(STATE["cumulative_csv"])[0] + f"_pending_{stamp}.csv"
-                with open(alt,"a",newline="",encoding="utf-8") as fh:
-                    cw = csv.writer(fh)
-                    if need_header and os.path.getsize(alt)==0: cw.writerow(self.header)
-                    cw.writerow(row)
-
-        
-            if STATE["test_id"] and _FB.ready:
-                for board_id, readings in fb_payloads:
-                    _FB.put_reading(STATE["stage"], STATE["substance"], STATE["test_id"],
-                                    board_id, ts_epoch, readings)
-                if _FB.disabled_reason:
-                    STATE["per_board_status"]["Firebase"] = f"offline ({_FB.disabled_reason})"
-
-        
-            if STATE["first_read_epoch"] is not None and STATE["duration_sec"]>0:
-                if time.time()-STATE["first_read_epoch"] >= STATE["duration_sec"]:
-                    break
-
-            time.sleep(STATE["interval"])
+                self.cols.write(ts_epoch, dict(zip(self.header[1:], row[1:])))
+            except OSError as e:
+                BOARDS.publish("Columnar", status=f"disabled ({e})")
+                self.cols = None
+
+        # what the old fixed-interval loop would have written on top of this row
+        for b in fresh: metrics.board(f"B:{b}").rows_written += 1
+        stale = 0
+        if self._last_row_epoch is not None and run.interval > 0:
+            stale = max(0, int((ts_epoch - self._last_row_epoch) // run.interval) - 1)
+        BOARDS.count(rows=1, stale_rows_avoided=stale,
+                     duplicate_blocks_avoided=sum(1 for b in self.enabled if b not in fresh))
+        self._last_row_epoch = ts_epoch
+
+        if run.test_id:
+            for board_id, readings in fb_payloads:
+                _FB.put_reading(run.stage, run.substance, run.test_id, board_id, ts_epoch, readings)
+            _publish_fb()
+
+def _publish_fb():
+    """The "Firebase" record follows the sink as it goes offline and reconnects."""
+    st = "online" if _FB.ready else f"offline ({_FB.disabled_reason})"
+    rec = BOARDS.get("Firebase")
+    if rec is None or rec.status != st: BOARDS.publish("Firebase", status=st)
 
 # ===== Public API =====
 _WRITER_THREAD: Optional[BCumulativeWriter] = None
@@ -340,65 +338,71 @@ _AUTO_THREAD: Optional[threading.Thread] = None
 
 def start_capture(stage: str, substance: Optional[str], test_id: str,
                   flowrate: float, duration_sec: int, interval: float,
-                  ports: Dict[str, Optional[str]]):
+                  ports: Dict[str, Optional[str]], backpressure: bool = False):
     stop_capture()
     sub_name = "baseline" if stage=="Baseline" else (substance or "").title()
-    STATE.update({
-        "active": True,
-        "first_read_epoch": None,
-        "duration_sec": duration_sec,
-        "stage": stage,
-        "substance": sub_name,
-        "test_id": test_id,
-        "flowrate": float(flowrate),
-        "interval": float(interval),
-        "cumulative_csv": None,
-        "folder": None,
-        "per_board_status": {k:"idle" for k in ("B1","B2") if ports.get(k)},
-    })
-    _LATEST_BLOCKS.clear()
+    BOARDS.reset({k: "idle" for k in ("B1","B2") if ports.get(k)}, WRITER_STATS,
+                 active=True, stage=stage, substance=sub_name, test_id=test_id, flowrate=float(flowrate),
+                 interval=float(interval), duration_sec=int(duration_sec or 0), backpressure=backpressure)
+    merge.LIVE.start("B", stage, sub_name, test_id, float(flowrate))
+    while not _BLOCK_QUEUE.empty():
+        try: _BLOCK_QUEUE.get_nowait()
+        except queue.Empty: break
 
     for b,p in ports.items():
         if p:
-            r = BSerialReader(b,p,interval); _THREADS[b]=r; r.start()
+            r = BSerialReader(b,p,interval); _READERS[b]=r; r.start()
 
     global _WRITER_THREAD
     _WRITER_THREAD = BCumulativeWriter(); _WRITER_THREAD.start()
 
     def _auto_watch():
-        while STATE["first_read_epoch"] is None and STATE["active"]: time.sleep(0.1)
-        if not STATE["active"] or STATE["first_read_epoch"] is None: return
-        while STATE["active"]:
-            if STATE["duration_sec"]>0 and (time.time()-STATE["first_read_epoch"]>=STATE["duration_sec"]): break
-            time.sleep(0.25)
-        if STATE["active"]: stop_capture()
+        while BOARDS.run.first_read_epoch is None and BOARDS.run.active: time.sleep(0.1)
+        run = BOARDS.run
+        if not run.active or run.first_read_epoch is None: return
+        while run.active:
+            if run.duration_sec>0 and (time.time()-run.first_read_epoch>=run.duration_sec): break
+            time.sleep(0.25); run = BOARDS.run
+        if run.active: stop_capture()
     global _AUTO_THREAD
     _AUTO_THREAD = threading.Thread(target=_auto_watch, daemon=True); _AUTO_THREAD.start()
 
 def stop_capture():
-    for r in list(_THREADS.values()):
+    for r in list(_READERS.values()):
         r.stop()
-    for r in list(_THREADS.values()):
+    for r in list(_READERS.values()):
         r.join(timeout=2.0)
-    _THREADS.clear()
+    _READERS.clear()
 
     global _WRITER_THREAD
     if _WRITER_THREAD:
-        _WRITER_THREAD.stop(); _WRITER_THREAD.join(timeout=2.0); _WRITER_THREAD=None
-    STATE["active"]=False
+        _WRITER_THREAD.finish(timeout=DRAIN_TIMEOUT_S); _WRITER_THREAD=None
+    merge.LIVE.stop("B")
+    BOARDS.publish_run(active=False)
 
 def snapshot():
+    view, run = BOARDS.view, BOARDS.run     # consistent board and run records, no lock
     pct=0
-    if STATE["first_read_epoch"] is not None and STATE["duration_sec"]>0:
-        elapsed=time.time()-STATE["first_read_epoch"]
-        pct=int(max(0,min(100,(elapsed/STATE["duration_sec"])*100)))
+    if run.first_read_epoch is not None and run.duration_sec>0:
+        elapsed=time.time()-run.first_read_epoch
+        pct=int(max(0,min(100,(elapsed/run.duration_sec)*100)))
     lines=[]
-    for b,st in STATE["per_board_status"].items(): lines.append(f"{b}: {st}")
-    if "Firebase" in STATE["per_board_status"]:
-        lines.append(f"Firebase: {STATE['per_board_status']['Firebase']}")
-    if STATE.get("cumulative_csv"): lines.append(f"Cumulative (B): {STATE['cumulative_csv']}")
-    if STATE.get("test_id"): lines.append(f"Firebase test_id: {STATE['test_id']}")
+    for b,rec in view.items(): lines.append(f"{b}: {rec.status}")
+    if "Firebase" in view:
+        lines.append(f"Firebase: {view['Firebase'].status}")
+    if run.cumulative_csv: lines.append(f"Cumulative (B): {run.cumulative_csv}")
+    ws = run.writer_stats
+    if ws.get("rows"):
+        lines.append(f"Rows (B): {ws['rows']} written; avoided {ws['stale_rows_avoided']} stale rows, "
+                     f"{ws['duplicate_blocks_avoided']} repeated blocks")
+    if run.test_id: lines.append(f"Firebase test_id: {run.test_id}")
+    if _FB.ready or _FB.uploader.depth:
+        up = _FB.uploader
+        lines.append(f"Firebase uploads: {up.status}, {up.depth} queued")
     if pct>=100: lines.append("Test complete.")
-    return {"first_read_epoch": STATE["first_read_epoch"], "pct": pct,
-            "paths":{"cumulative_csv": STATE.get("cumulative_csv"), "folder": STATE.get("folder")},
-            "status_lines": lines}
+    return {"first_read_epoch": run.first_read_epoch, "pct": pct,
+            "paths":{"cumulative_csv": run.cumulative_csv, "folder": run.folder},
+            "status_lines": lines,
+            "boards": metrics.boards("B"),
+            "writer": {**ws, "queue_depth": _BLOCK_QUEUE.qsize()},
+            "firebase": metrics.firebase()}
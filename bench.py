@@ -0,0 +1,459 @@
+#bench.py
+"""
+Benchmarks for the capture/read pipeline.
+
+    python bench.py                             # run everything
+    python bench.py parsers capture             # only the named benchmarks
+    python bench.py --json out.json             # also write machine-readable results
+    python bench.py --compare out.json          # show the change against an earlier run
+
+``capture`` and ``ingest`` drive b_write/lb_write end to end (simulated boards on
+ptys, Linux) against an in-memory Firebase backend; ``callbacks`` times the
+Read and Live page callbacks through the Dash endpoint.  Both write their CSVs
+in a temporary directory.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import re
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import b_write
+import block_parser
+import catalog
+import csv_sink
+import firebase_sink
+import lb_write
+import read
+
+# ----- synthetic input -----
+_B_BLOCK = [
+    "New Data",
+    "TGS2600: 400", "TGS2602: 431", "TGS2603: 698", "MQ2:     72",
+    "GM102B (NO2):    210 ppm", "GM302B (C2H5CH): 294 ppm", "GM502B (VOC):    73 ppm", "GM702B (CO):     118 ppm",
+    "tVOC:  3 ppb", "CO2eq: 400 ppm",
+    "hcho:        11.80 ppb", "humidity:    24.61 %", "temperature: 24.42 °C",
+    "Reading Formaldehyde...",
+    "*",
+]
+_LB_BLOCK = ["New Data", "NO: 0.12 ppm", "CO: 1.03 ppm", "NO2: 0.05 ppm", "NH3: 2.10 ppm", "O2: 20.90 %"]
+
+
+def _lines(block: List[str], n_blocks: int) -> List[bytes]:
+    raw = [(ln + "\r").encode("utf-8") for ln in block]
+    return raw * n_blocks
+
+
+def _rate(n: int, fn: Callable[[], None], repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter(); fn(); best = min(best, time.perf_counter() - t0)
+    return n / best if best > 0 else float("inf")
+
+
+# ----- parsers as they were before block_parser (kept here for comparison) -----
+_OLD_PAIR_RE = re.compile(r"^\s*([A-Za-z0-9µμ°/%\-\s\(\)\.\[\]]+?)\s*:\s*([\-+]?[0-9]*\.?[0-9]+)\s*([A-Za-z°%/\.]+)?\s*$")
+_OLD_NEW_DATA_RE = re.compile(r"^\s*new\s*data\s*$", re.IGNORECASE)
+
+def _old_clean_ascii(s: str) -> str:
+    return re.sub(r"[^\x20-\x7E\n\r\t]", "", s)
+
+def _old_b_parse(lines: List[bytes]):
+    out = []
+    for raw in lines:
+        line = _old_clean_ascii(raw.decode(errors="ignore")).strip()
+        if not line or _OLD_NEW_DATA_RE.match(line) or line.startswith("*"): continue
+        m = _OLD_PAIR_RE.match(line)
+        if not m: continue
+        unit = (m.group(3) or "").strip() or None
+        out.append((m.group(1).strip(), float(m.group(2)), "°C" if unit == "C" else unit))
+    return out
+
+def _old_preview_parse(lines: List[bytes]):
+    out = []
+    for raw in lines:
+        line = re.sub(r"[^\x00-\x7F°]", "", raw.decode("utf-8", errors="ignore").strip())
+        if not line or line == "New Data": continue
+        parts = [p.strip() for p in line.split(":", maxsplit=1)]
+        if len(parts) != 2: continue
+        key, val = parts
+        m = re.search(r"([\d\.]+)\s*(ppm|ppb|%)", val, re.IGNORECASE)
+        if m:
+            out.append((key, float(m.group(1)), m.group(2).lower())); continue
+        if re.match(r"^(TGS|MQ)", key, re.IGNORECASE):
+            try: out.append((key, float(re.sub(r"[^\d\.]+", "", val)), "raw"))
+            except Exception: pass
+            continue
+        out.append((key, val, None))
+    return out
+
+def _new_parse(lines: List[bytes]):
+    out = []
+    for raw in lines:
+        line = block_parser.clean_line(raw)
+        if not line or block_parser.is_new_data(line) or line.startswith("*"): continue
+        tup = block_parser.parse_pair(line)
+        if tup: out.append(tup)
+    return out
+
+
+def bench_parsers(n_blocks: int = 20000) -> Dict[str, float]:
+    """Lines/second for each parser over the same B + LB line stream."""
+    lines = _lines(_B_BLOCK, n_blocks) + _lines(_LB_BLOCK, n_blocks)
+    blob = b"\n".join(lines)
+    n = len(lines)
+    return {
+        "old b_write/lb_write (PAIR_RE)": _rate(n, lambda: _old_b_parse(lines)),
+        "old realtime preview": _rate(n, lambda: _old_preview_parse(lines)),
+        "block_parser per line": _rate(n, lambda: _new_parse(lines)),
+        "block_parser.parse_block(bytes)": _rate(n, lambda: block_parser.parse_block(blob)),
+    }
+
+
+# ----- B row assembly -----
+def _synthetic_blocks(n_sensors: int):
+    blocks = {}
+    for b in ("B1", "B2"):
+        blk = {f"Sensor{i:02d}": (float(i) + 0.123456, "ppm" if i % 3 else None) for i in range(n_sensors)}
+        blk["_captured_at_"] = (time.time(), None)
+        blocks[b] = blk
+    return blocks
+
+def _old_assemble_row(header: List[str], blocks):
+    row = []
+    for c in header[2:]:
+        try: b,_ = c.split(" - ",1)
+        except ValueError: row.append(None); continue
+        src = blocks.get(b,{})
+        val=None
+        for k,(v,unit) in src.items():
+            if k == "_captured_at_": continue
+            if f"{b} - {k}{f' ({unit})' if unit else ''}" == c:
+                val=v; break
+        row.append(b_write._fmt(val) if val is not None else None)
+    return row
+
+def bench_row_assembly(n_sensors: int = 24, n_rows: int = 2000) -> Dict[str, float]:
+    """Microseconds per row for BCumulativeWriter row fill, B1+B2 with 2*n_sensors columns."""
+    blocks = _synthetic_blocks(n_sensors)
+    seen = {b_write._colname(b, k, u): (b, k, u)
+            for b, blk in blocks.items() for k, (_v, u) in blk.items() if k != "_captured_at_"}
+    cols = sorted(seen, key=str.lower)
+    header = ["Timestamp", "Flowrate (L/min)"] + cols
+    index = [seen[c] for c in cols]
+    assert _old_assemble_row(header, blocks) == b_write._assemble_row(index, blocks)
+
+    def _per_row_us(fn):
+        return 1e6 / _rate(n_rows, lambda: [fn() for _ in range(n_rows)])
+    return {
+        f"old header scan ({len(cols)} cols)": _per_row_us(lambda: _old_assemble_row(header, blocks)),
+        f"column index ({len(cols)} cols)": _per_row_us(lambda: b_write._assemble_row(index, blocks)),
+    }
+
+
+# ----- unit-stripping float conversion (read._to_float_safe) -----
+def _old_to_float_safe(series):
+    def _num(x):
+        if pd.isna(x):
+            return None
+        if isinstance(x, (int, float)):
+            return x
+        s = re.sub(r"[^0-9\.\-]+", "", str(x))
+        try:
+            return float(s) if s not in ("", "-", ".", "-.") else None
+        except Exception:
+            return None
+    return series.apply(_num)
+
+def _synthetic_session(n_rows: int) -> pd.DataFrame:
+    """Columns shaped like Experiment/*/E*.csv: unit-suffixed cells and plain numbers."""
+    rng = np.random.default_rng(0)
+    def _with_unit(lo, hi, unit):
+        return pd.Series(np.round(rng.uniform(lo, hi, n_rows), 2)).astype(str) + f" {unit}"
+    return pd.DataFrame({
+        "B1 - Temperature": _with_unit(20, 40, "°C"),
+        "B1 - Pressure": _with_unit(95000, 96000, "Pa"),
+        "B1 - Gas Resistance": _with_unit(100, 102400, "kOhm"),
+        "B1 - TGS2600 (raw)": pd.Series(rng.integers(300, 700, n_rows)).astype(str),
+    })
+
+def bench_float_parse(n_rows: int = 1_000_000) -> Dict[str, float]:
+    """Cells/second converting a million-row synthetic session, all four columns."""
+    df = _synthetic_session(n_rows)
+    for c in df.columns:
+        assert np.allclose(_old_to_float_safe(df[c].head(1000)).astype(float), read._to_float_safe(df[c].head(1000)))
+    n = n_rows * len(df.columns)
+    return {
+        "old series.apply + re.sub": _rate(n, lambda: [_old_to_float_safe(df[c]) for c in df.columns], repeat=1),
+        "str.extract + to_numeric": _rate(n, lambda: [read._to_float_safe(df[c]) for c in df.columns]),
+    }
+
+
+# ----- end to end: serial arrival -> CSV row -----
+@contextlib.contextmanager
+def _in_tempdir():
+    """
+    Captures write relative to the working directory (and sessions.db); keep
+    them out of the repo, and their readings off the network.
+    """
+    cwd, cat = os.getcwd(), catalog.CATALOG
+    saved = cat.path, cat._ready
+    with tempfile.TemporaryDirectory(prefix="enose-bench-") as d, firebase_sink.offline():
+        os.chdir(d)
+        cat.flush(); cat.path, cat._ready = os.path.join(d, "sessions.db"), False
+        try: yield d
+        finally:
+            cat.flush(); cat.path, cat._ready = saved
+            os.chdir(cwd)
+
+
+class _RowClock:
+    """
+    Arrival-to-flushed-row latency.  Both writers call catalog.CATALOG.note_row
+    with the row's arrival epoch right after the CSV write, so wrapping it
+    times every row (a B row is timed from its newest block).  CsvSink
+    normally buffers FLUSH_ROWS rows / FLUSH_S seconds, which would leave
+    the row in memory at that point; sinks opened inside the clock flush
+    every row, so the time is to the row being in the file.
+    """
+    def __init__(self):
+        self.latency: Dict[str, List[float]] = {"B": [], "LB": []}
+        self.rows = 0
+        self._flush_rows = csv_sink.FLUSH_ROWS
+
+    def __enter__(self):
+        csv_sink.FLUSH_ROWS = 1
+        cat = catalog.CATALOG
+        note = cat.note_row
+        def timed(path, stage, substance, test_id, kind, ts_epoch, flowrate=None):
+            self.latency["B" if kind == "B" else "LB"].append(time.time() - ts_epoch)
+            self.rows += 1
+            note(path, stage, substance, test_id, kind, ts_epoch, flowrate)
+        cat.note_row = timed
+        return self
+
+    def __exit__(self, *_exc):
+        del catalog.CATALOG.note_row
+        csv_sink.FLUSH_ROWS = self._flush_rows
+
+
+def _ms_percentiles(xs: List[float], label: str) -> Dict[str, float]:
+    if not xs: return {}
+    p50, p99 = np.percentile(np.asarray(xs) * 1000.0, [50, 99])
+    return {f"{label} p50 arrival-to-flushed-row (ms)": float(p50),
+            f"{label} p99 arrival-to-flushed-row (ms)": float(p99)}
+
+
+def _start(sim, test_id: str, interval: float = 0.0):
+    b_ports, lb_ports = sim.ports("B"), sim.ports("LB")
+    b_write.start_capture("Testing", "Bench", test_id, 1.0, 0, interval, b_ports)
+    lb_write.start_capture("Testing", "Bench", test_id, 1.0, interval, lb_ports)
+    readers = {**b_write._READERS, **lb_write._READERS}
+    time.sleep(0.5)        # ports open on the engine thread
+    return readers
+
+
+def _stop():
+    b_write.stop_capture(); lb_write.stop_capture()
+
+
+def bench_capture(hz: float = 20.0, seconds: float = 5.0) -> Dict[str, float]:
+    """
+    2 B + 2 LB simulated boards at ``hz``: rates and serial-arrival-to-flushed-
+    CSV-row latency (see _RowClock).  An LB block ends only when the next one
+    starts, so its latency includes one board period.
+    """
+    import simulator
+    with _in_tempdir():
+        sim = simulator.Simulator(2, 2, None, hz)
+        lines_per_block = {bid: sb.block(0).count(b"\n") for bid, sb in sim.boards.items()}
+        try:
+            with _RowClock() as clock:
+                readers = _start(sim, "capture")
+                sim.start(); time.sleep(seconds); sim.stop()
+                time.sleep(0.5)
+                blocks = sum(r.decimator.kept for r in readers.values())
+        finally:
+            _stop(); sim.close()
+        st = sim.stats()
+        lines = sum(n * lines_per_block[bid] for bid, n in st["sent"].items())
+        return {"lines/s parsed": lines / seconds, "blocks/s emitted": blocks / seconds,
+                "rows/s written": clock.rows / seconds, "overruns": float(st["overruns"]),
+                **_ms_percentiles(clock.latency["B"], "B"), **_ms_percentiles(clock.latency["LB"], "LB")}
+
+
+def bench_ingest(n_blocks: int = 5000) -> Dict[str, float]:
+    """Readers + writers at full speed: lines fed straight into feed_line, no serial in between."""
+    import simulator
+    with _in_tempdir():
+        sim = simulator.Simulator(2, 2)
+        feeds = {bid: sb.block(0).split(b"\n")[:-1] for bid, sb in sim.boards.items()}
+        try:
+            with _RowClock() as clock:
+                readers = _start(sim, "ingest")
+                t0 = time.perf_counter()
+                for _ in range(n_blocks):
+                    for bid, lines in feeds.items():
+                        feed, now = readers[bid].feed_line, time.time()
+                        for raw in lines: feed(raw, now)
+                fed = time.perf_counter() - t0
+                while not (b_write._BLOCK_QUEUE.empty() and lb_write._ROW_QUEUE.empty()): time.sleep(0.01)
+                elapsed = time.perf_counter() - t0
+                blocks = sum(r.decimator.kept for r in readers.values())
+                dropped = b_write.BOARDS.run.writer_stats.get("queue_dropped", 0)
+        finally:
+            _stop(); sim.close()
+        lines = n_blocks * sum(len(v) for v in feeds.values())
+        return {"lines/s parsed": lines / fed, "blocks/s emitted": blocks / fed,
+                "rows/s written": clock.rows / elapsed, "B queue drops": float(dropped),
+                **_ms_percentiles(clock.latency["B"], "B"), **_ms_percentiles(clock.latency["LB"], "LB")}
+
+
+# ----- Dash callbacks on synthetic sessions -----
+def _write_session(n_rows: int):
+    """B and LB CSVs of ``n_rows`` one-second rows, with columns of every kind plot_all draws."""
+    rng = np.random.default_rng(0)
+    ts = pd.Series(pd.date_range("2026-01-01", periods=n_rows, freq="s").strftime("%Y-%m-%d %H:%M:%S"))
+    walk = lambda lo, hi: np.round(lo + (hi - lo) * (0.5 + 0.5 * np.sin(np.cumsum(rng.normal(0, 0.01, n_rows)))), 3)
+    b = {"Timestamp": ts, "Flowrate (L/min)": 1.0}
+    for bid in ("B1", "B2"):
+        b.update({f"{bid} - TGS2600 - V": walk(0.5, 4.5), f"{bid} - TGS2600 (ppm)": walk(1, 50),
+                  f"{bid} - MQ2 - raw": walk(50, 900), f"{bid} - temperature (°C)": walk(20, 30),
+                  f"{bid} - humidity (%)": walk(20, 60)})
+    lb = {"Timestamp": ts, "Flowrate (L/min)": 1.0,
+          "LB1 - SO2 (ppm)": walk(0, 1), "LB1 - NO2 (ppm)": walk(0, 1)}
+    os.makedirs("Testing/Bench", exist_ok=True)
+    b_csv, lb_csv = f"Testing/Bench/Bench_B_{n_rows}.csv", f"Testing/Bench/Bench_LB1_{n_rows}.csv"
+    pd.DataFrame(b).to_csv(b_csv, index=False); pd.DataFrame(lb).to_csv(lb_csv, index=False)
+    return b_csv, lb_csv
+
+
+def _dash_call(client, app, key: str, values: Dict[str, object], changed: str):
+    """
+    POST one callback to /_dash-update-component, as the browser does; returns (seconds, response json).
+    Pattern-matching (ALL) ids resolve to the concrete ids listed in ``values["<type>"]``."""
+    spec = app.callback_map[key]
+    def _ref(cid, prop, with_value=True):
+        if isinstance(cid, dict):      # e.g. {"type": "rt-graph", "index": ALL}
+            return [{"id": c, "property": prop, **({"value": c} if prop == "id" and with_value else {})}
+                    for c in values.get(cid["type"], [])]
+        ref = {"id": cid, "property": prop}
+        if with_value: ref["value"] = values.get(f"{cid}.{prop}")
+        return ref
+    def _ids(items):
+        return [_ref(json.loads(it["id"]) if it["id"].startswith("{") else it["id"], it["property"]) for it in items]
+    outputs = [_ref(o.component_id, o.component_property, with_value=False) for o in spec["output"]]
+    body = {"output": key, "outputs": outputs, "inputs": _ids(spec["inputs"]), "state": _ids(spec["state"]),
+            "changedPropIds": [changed]}
+    t0 = time.perf_counter()
+    resp = client.post("/_dash-update-component", json=body)
+    dt = time.perf_counter() - t0
+    if resp.status_code not in (200, 204):
+        raise RuntimeError(f"{key[:40]}: HTTP {resp.status_code}: {resp.get_data(as_text=True)[:200]}")
+    return dt, (resp.get_json() if resp.status_code == 200 else None)
+
+
+def bench_callbacks(sizes=(1_000, 100_000, 1_000_000)) -> Dict[str, float]:
+    """Milliseconds per read.plot_all and realtime._update_graphs call, through the Dash endpoint."""
+    import app as dash_app
+    import realtime
+    from ringbuf import RingBuffer
+    out: Dict[str, float] = {}
+    with _in_tempdir():
+        app = dash_app.create_app()
+        client = app.server.test_client()
+        plot_key = next(k for k in app.callback_map if "b1-graph.figure" in k)
+        live_key = next(k for k in app.callback_map if "rt-graphs.children" in k)
+        saved = dict(realtime._LIVE_DATA)
+        try:
+            for first, n in enumerate((100,) + tuple(sizes)):    # the 100-row pass warms plotly/Dash up, untimed
+                res = out if first else {}
+                b_csv, lb_csv = _write_session(n)
+                files = {"b_csvs": [b_csv], "lb_csvs": [lb_csv], "t_lo": None, "t_hi": None}
+                v = {"r-flow.value": 1.0, "r-stage.value": "Testing", "r-substance.value": "Bench",
+                     "r-file-paths.data": files, "r-plot-width.data": 1200, "env-sensor-select.value": ["temp", "hum"]}
+                res[f"plot_all {n:,} rows, cold (ms)"] = 1000 * _dash_call(client, app, plot_key, v, "r-file-paths.data")[0]
+                res[f"plot_all {n:,} rows, cached (ms)"] = 1000 * _dash_call(client, app, plot_key, v, "r-flow.value")[0]
+                t = pd.Timestamp("2026-01-01")
+                v["b1-graph.relayoutData"] = {"xaxis.range[0]": str(t + pd.Timedelta(seconds=n // 4)),
+                                              "xaxis.range[1]": str(t + pd.Timedelta(seconds=n // 2))}
+                res[f"plot_all {n:,} rows, zoom (ms)"] = 1000 * _dash_call(client, app, plot_key, v, "b1-graph.relayoutData")[0]
+
+                for bid in ("B1", "B2"):
+                    buf = realtime._LIVE_DATA[bid] = RingBuffer(capacity=max(n, 1))
+                    for i in range(n):
+                        buf.append(1.7e9 + i, {f"{bid} - TGS2600 - V": 1.0 + (i % 100) / 100,
+                                               f"{bid} - TGS2600 (ppm)": 5.0 + (i % 50), f"{bid} - MQ2 (raw)": float(i % 900)})
+                lv = {"rt-plot-tick.n_intervals": 1, "rt-plot-refresh.data": None, "rt-plot-cursor.data": None,
+                      "rt-graph": []}
+                dt, resp = _dash_call(client, app, live_key, lv, "rt-plot-tick.n_intervals")
+                res[f"_update_graphs {n:,} rows, rebuild (ms)"] = 1000 * dt
+                cursor = resp["response"]["rt-plot-cursor"]["data"]
+                for bid in ("B1", "B2"):
+                    buf = realtime._LIVE_DATA[bid]
+                    buf.append(1.7e9 + n, {c: 1.0 for c in buf.columns()})
+                lv.update({"rt-plot-cursor.data": cursor, "rt-plot-tick.n_intervals": 2,
+                           "rt-graph": [{"type": "rt-graph", "index": c} for _b, c in cursor["series"]]})
+                res[f"_update_graphs {n:,} rows, extend (ms)"] = 1000 * _dash_call(client, app, live_key, lv,
+                                                                                  "rt-plot-tick.n_intervals")[0]
+        finally:
+            realtime._LIVE_DATA.clear(); realtime._LIVE_DATA.update(saved)
+    return out
+
+
+BENCHMARKS = {
+    "parsers": (bench_parsers, "lines/s"),
+    "row_assembly": (bench_row_assembly, "us/row"),
+    "float_parse": (bench_float_parse, "cells/s"),
+    "capture": (bench_capture, None),         # units are in the labels
+    "ingest": (bench_ingest, None),
+    "callbacks": (bench_callbacks, None),
+}
+
+
+def _meta() -> Dict[str, str]:
+    rev = None
+    with contextlib.suppress(OSError):
+        head = open(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".git", "HEAD")).read().strip()
+        ref = head[5:] if head.startswith("ref: ") else None
+        rev = open(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".git", ref)).read().strip() if ref else head
+    return {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "platform": platform.platform(), "pandas": pd.__version__, "commit": rev}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("names", nargs="*", help=f"any of: {', '.join(BENCHMARKS)}")
+    parser.add_argument("--json", metavar="PATH", help="write results here as JSON")
+    parser.add_argument("--compare", metavar="PATH", help="earlier --json output to compare against")
+    args = parser.parse_args()
+    unknown = [n for n in args.names if n not in BENCHMARKS]
+    if unknown: parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+    baseline: Dict[str, dict] = {}
+    if args.compare:
+        with open(args.compare) as f: baseline = json.load(f).get("results", {})
+
+    results: Dict[str, dict] = {}
+    for name in args.names or BENCHMARKS:
+        fn, unit = BENCHMARKS[name]
+        print(f"== {name} ==")
+        values = fn()
+        results[name] = {"unit": unit, "values": values}
+        before: Optional[dict] = baseline.get(name, {}).get("values")
+        for label, value in values.items():
+            change = ""
+            if before and before.get(label):
+                change = f"  ({100.0 * (value - before[label]) / before[label]:+.1f}%)"
+            print(f"  {label:<40} {value:>14,.{1 if unit else 2}f} {unit or ''}{change}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"meta": _meta(), "results": results}, f, indent=2)
+        print(f"results written to {args.json}")
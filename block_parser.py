@@ -0,0 +1,102 @@
+#block_parser.py
+"""
+Shared parser for the board serial protocol used by the B, LB and preview paths.
+What the firmware prints around the readings:
+
+    Board1                        Board2          Libelium sketches
+    ==== BME688 BSEC2 ... ====    New Data        ***************************************
+    Raw Temperature: 25.00 C      TGS2610: 512    SO2: 0.12 ppm
+    ...                           ...             ...
+    New Data (synchronized)       <empty line>    (next rule line)
+    TGS2600: 400
+    ...
+    <empty line>
+
+with ``<label>: <number> [unit]`` on every reading line.  A B block opens at
+"New Data" and closes at the empty line (or at a legacy "*" line, or the next
+"New Data"); Board1's BME688 section, printed before its "New Data", belongs
+to the block that follows it.  An LB block opens at the rule line (or "New
+Data") and runs to the next one.
+
+Lines are cleaned with one ``bytes.translate`` and split with ``str.partition``
+against precomputed character tables; no regex runs on the hot path.
+Accepts what the old ``PAIR_RE`` accepted plus a trailing parenthesised note,
+as in ``IAQ Index: 25.00 (Accuracy: 3)``.
+"""
+import re
+from typing import Iterable, List, Optional, Tuple, Union
+
+Reading = Tuple[str, float, Optional[str]]
+
+NEW_DATA_RE = re.compile(r"^\s*new\s*data\s*(\([^)]*\))?\s*$", re.IGNORECASE)
+BAT_RE  = re.compile(r"Battery\s+Level\s*:\s*(\d+)\s*%\s*\|\s*Battery\s*\(Volts\)\s*:\s*([\-+]?[0-9]*\.?\d+)")
+
+# bytes outside printable ASCII (+ \t \n \r) are dropped, same as the old _clean_ascii
+_DROP = bytes(b for b in range(256) if not (0x20 <= b <= 0x7E or b in (9, 10, 13)))
+_LABEL_CHARS = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789µμ°/%-()[]. \t")
+_UNIT_STR = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz°%/."
+_UNIT_CHARS = frozenset(_UNIT_STR)
+_UNIT_TAIL = _UNIT_STR + " \t"
+_DIGITS = frozenset("0123456789")
+_NUM_CHARS = frozenset("0123456789.")
+_SUBSCRIPT = re.compile(rb"\xe2\x82([\x80-\x89])")      # UTF-8 subscript digits, as in Board1's "CO₂ Equivalent"
+UNIT_CANON = {"C": "°C", "k": "kΩ"}                       # what is left of "°C" and "kΩ" once cleaned
+
+
+def _subscript_digit(m: "re.Match[bytes]") -> bytes:
+    return bytes((m.group(1)[0] - 0x50,))
+
+
+def clean_line(raw: Union[bytes, str]) -> str:
+    if isinstance(raw, str):
+        raw = raw.encode("utf-8", errors="ignore")
+    if b"\xe2\x82" in raw: raw = _SUBSCRIPT.sub(_subscript_digit, raw)
+    return raw.translate(None, _DROP).decode("ascii").strip()
+
+
+def is_new_data(line: str) -> bool:
+    return line[:1] in ("n", "N") and NEW_DATA_RE.match(line) is not None
+
+
+def is_rule(line: str) -> bool:
+    """The row of asterisks the Libelium sketches print before each reading."""
+    return line[:3] == "***" and not line.strip("*")
+
+
+def _is_number(tok: str) -> bool:
+    body = tok[1:] if tok[:1] in ("-", "+") else tok
+    if not body or body[-1] not in _DIGITS or not _NUM_CHARS.issuperset(body):
+        return False
+    return body.count(".") <= 1
+
+
+def parse_pair(line: str) -> Optional[Reading]:
+    """'<label>: <number> [unit]' -> (label, value, unit or None)."""
+    label, sep, rest = line.partition(":")
+    if not sep: return None
+    label = label.strip()
+    if not label or not _LABEL_CHARS.issuperset(label): return None
+    rest = rest.strip()
+    if rest[-1:] == ")": rest = rest.partition("(")[0].rstrip()
+    if not rest: return None
+
+    # the unit is the tail of unit characters; whatever precedes it must be the number
+    num = rest.rstrip(_UNIT_TAIL)
+    unit = rest[len(num):].strip()
+    if not _is_number(num): return None
+    if unit and not _UNIT_CHARS.issuperset(unit): return None
+    return label, float(num), (UNIT_CANON.get(unit, unit) or None)
+
+
+def parse_block(block: Union[bytes, Iterable[str]]) -> List[Reading]:
+    """Raw bytes (or already-cleaned lines) of one block -> typed readings, in order."""
+    if isinstance(block, (bytes, bytearray)):
+        if b"\xe2\x82" in block: block = _SUBSCRIPT.sub(_subscript_digit, bytes(block))
+        lines = block.translate(None, _DROP).decode("ascii").split("\n")
+    else:
+        lines = block
+    out: List[Reading] = []
+    for ln in lines:
+        tup = parse_pair(ln)
+        if tup: out.append(tup)
+    return out
@@ -0,0 +1,104 @@
+#boardstate.py
+"""
+Per-board capture state as immutable records, published by reference swap.
+
+Reader threads never edit shared state in place: ``publish(board, **changes)``
+builds a new BoardRecord from the board's current one and installs a new
+read-only mapping of all boards in ``view`` with a single assignment.  The
+Dash callbacks (750 ms tick) take ``view`` once and read everything from it:
+no lock on that side, and a record's block, its capture time and its status
+always come from the same update.  Publishers (the board readers and the B
+writer) serialise among themselves on a small lock the UI never takes.
+
+The capture as a whole (its parameters, first reading, output paths, writer
+counts) is a RunRecord in ``run``, published the same way: the duration
+watcher, the writers and snapshot() read the parameters from one record while
+start/stop install new ones.
+"""
+import threading, time
+from types import MappingProxyType
+from typing import Mapping, NamedTuple, Optional, Tuple
+
+Block = Mapping[str, Tuple[float, Optional[str]]]     # label -> (value, unit)
+_NO_BLOCK: Block = MappingProxyType({})
+_NO_STATS: Mapping[str, int] = MappingProxyType({})
+
+
+class BoardRecord(NamedTuple):
+    board_id: str
+    status: str = "idle"
+    block: Block = _NO_BLOCK            # latest parsed block, read-only
+    block_t: Optional[float] = None     # its arrival epoch
+    battery: Optional[Tuple[Optional[float], Optional[float]]] = None   # LB: (percent, volts)
+    path: Optional[str] = None          # CSV the board is written to
+    updated: float = 0.0
+
+
+class RunRecord(NamedTuple):
+    active: bool = False
+    stage: Optional[str] = None
+    substance: Optional[str] = None             # as written: title case, or "baseline"
+    test_id: Optional[str] = None
+    flowrate: Optional[float] = None
+    interval: float = 1.0
+    duration_sec: int = 0                       # 0: until stopped
+    backpressure: bool = False                  # readers wait for the writer instead of dropping (replays)
+    first_read_epoch: Optional[float] = None    # capture time of the first block
+    cumulative_csv: Optional[str] = None        # B: CSV the writer is appending to
+    folder: Optional[str] = None                # test folder
+    writer_stats: Mapping[str, int] = _NO_STATS   # read-only counts, bumped with count()
+
+
+class BoardStates:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.view: Mapping[str, BoardRecord] = MappingProxyType({})
+        self.run = RunRecord()
+
+    def publish(self, board_id: str, **changes) -> BoardRecord:
+        """
+        New record for ``board_id`` with ``changes`` applied.  A ``block`` dict
+        is wrapped read-only, not copied: the caller must not touch it again.
+        """
+        block = changes.get("block")
+        if block is not None and not isinstance(block, MappingProxyType):
+            changes["block"] = MappingProxyType(block)
+        with self._lock:
+            cur = self.view.get(board_id) or BoardRecord(board_id)
+            rec = cur._replace(updated=time.time(), **changes)
+            boards = dict(self.view)
+            boards[board_id] = rec
+            self.view = MappingProxyType(boards)
+        return rec
+
+    def get(self, board_id: str) -> Optional[BoardRecord]:
+        return self.view.get(board_id)
+
+    def publish_run(self, **changes) -> RunRecord:
+        with self._lock:
+            self.run = rec = self.run._replace(**changes)
+        return rec
+
+    def first_read(self, t: float):
+        """Record the first block's capture time; later calls keep the first."""
+        if self.run.first_read_epoch is not None: return
+        with self._lock:
+            if self.run.first_read_epoch is None: self.run = self.run._replace(first_read_epoch=t)
+
+    def count(self, **deltas: int):
+        """Add ``deltas`` to the run's writer_stats (readers and writer may both count)."""
+        with self._lock:
+            stats = dict(self.run.writer_stats)
+            for k, d in deltas.items(): stats[k] = stats.get(k, 0) + d
+            self.run = self.run._replace(writer_stats=MappingProxyType(stats))
+
+    def reset(self, statuses: Mapping[str, str], stats: Tuple[str, ...] = (), **params) -> RunRecord:
+        """
+        Start of a capture: only these boards, with these statuses, and a new
+        run with parameters ``params`` and ``stats`` at 0.
+        """
+        now = time.time()
+        with self._lock:
+            self.view = MappingProxyType({b: BoardRecord(b, st, updated=now) for b, st in statuses.items()})
+            self.run = rec = RunRecord(writer_stats=MappingProxyType(dict.fromkeys(stats, 0)), **params)
+        return rec
@@ -0,0 +1,298 @@
+#capture.py
+"""
+Record raw serial bytes and replay them through the normal readers.
+
+Recording: with SERIAL_RECORD_DIR set, the ingest engine writes every chunk it
+reads from a port, with its arrival time, to ``<dir>/<key>_<stamp>.cap``:
+
+    b"ENOSECAP1\\n", one JSON line {"key", "port", "baud", "started"},
+    then per chunk  <float64 arrival epoch><uint32 length><raw bytes>  (little-endian)
+
+Replay: any reader accepts ``replay:<file>[?speed=N][&clock=original]`` as its
+port.  The engine opens a ReplayPort instead of a serial port and drains the
+file's chunks on its own thread, split into lines and handed to the reader
+exactly as live data:
+    speed=1 (default)  original pacing      speed=N  N times faster
+    speed=max          as fast as possible
+    clock=shift (default)  arrival times keep their spacing, starting now
+    clock=original         the recorded epochs, to re-derive a session offline
+
+    python capture.py info B1_20261017_101500.cap
+    python capture.py replay --stage Testing --substance Ethanol --test-id T1 --speed max \\
+        B1=B1_20261017_101500.cap LB1=LB1_20261017_101500.cap
+"""
+import argparse, io, json, os, queue, re, struct, threading, time
+from datetime import datetime
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+MAGIC = b"ENOSECAP1\n"
+SCHEME = "replay:"
+RECORD_DIR = os.getenv("SERIAL_RECORD_DIR")
+
+_REC = struct.Struct("<dI")
+_UNSAFE_RE = re.compile(r"[^\w.-]+")
+
+LineHandler = Callable[[bytes, float], None]
+
+
+# ===== recording =====
+class Recorder:
+    def __init__(self, path: str, meta: dict):
+        d = os.path.dirname(path)
+        if d: os.makedirs(d, exist_ok=True)
+        self.path = path
+        self.chunks = 0
+        self.bytes = 0
+        self._fh: BinaryIO = open(path, "wb")
+        self._fh.write(MAGIC + json.dumps(meta).encode() + b"\n")
+
+    def write(self, arrived: float, chunk: bytes):
+        self._fh.write(_REC.pack(arrived, len(chunk)))
+        self._fh.write(chunk)
+        self.chunks += 1; self.bytes += len(chunk)
+
+    def close(self):
+        try:
+            self._fh.flush(); os.fsync(self._fh.fileno()); self._fh.close()
+        except (OSError, ValueError):
+            pass
+
+
+def recorder_for(key: str, port: str, baud: int, d: Optional[str] = RECORD_DIR) -> Optional[Recorder]:
+    """A Recorder for a newly opened port, or None when recording is off."""
+    if not d: return None
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    path = os.path.join(d, f"{_UNSAFE_RE.sub('_', key)}_{stamp}.cap")
+    try:
+        return Recorder(path, {"key": key, "port": port, "baud": baud, "started": time.time()})
+    except OSError as e:
+        print(f"[capture] not recording {key}: {e}")
+        return None
+
+
+def read_capture(path: str) -> Tuple[dict, Iterator[Tuple[float, bytes]]]:
+    """(meta, iterator of (arrival epoch, chunk)); a torn last record is ignored."""
+    fh = open(path, "rb")
+    if fh.readline() != MAGIC:
+        fh.close()
+        raise ValueError(f"{path}: not a capture file")
+    meta = json.loads(fh.readline())
+
+    def records():
+        with fh:
+            while True:
+                head = fh.read(_REC.size)
+                if len(head) < _REC.size: return
+                t, n = _REC.unpack(head)
+                chunk = fh.read(n)
+                if len(chunk) < n: return
+                yield t, chunk
+    return meta, records()
+
+
+# ===== replay =====
+_STARTED: Dict[str, "ReplayPort"] = {}              # latest replay of each file
+_FAILED: Dict[str, Tuple[float, str]] = {}           # file -> (when, why) its replay could not open
+_STARTED_LOCK = threading.Lock()
+QUEUE_MAX = 256                                      # chunks read ahead of the engine
+
+
+class ReplayPort:
+    """
+    Serial-like handle for the ingest engine that keeps each chunk's arrival
+    time.  A producer thread reads the file, paced by ``speed``, into a
+    bounded queue; the engine drains it on its own thread with
+    ``read_timed()`` and splits and dispatches the lines exactly as live
+    data, stamped with the recorded (or shifted) times.  ``read_timed()``
+    returns None once the file is exhausted and the engine closes the port.
+    """
+    in_waiting = 0
+
+    def __init__(self, path: str, speed: float = 1.0, clock: str = "shift"):
+        if clock not in ("shift", "original"):
+            raise ValueError(f"unknown replay clock: {clock}")
+        self.meta, self._records = read_capture(path)
+        self.path = path; self.speed = speed; self.clock = clock
+        self.chunks = 0
+        self.opened = time.monotonic()
+        self.finished = False               # every chunk handed to the engine
+        self.done = threading.Event()       # closed, finished or not
+        self._q: "queue.Queue[Tuple[float, bytes]]" = queue.Queue(QUEUE_MAX)
+        self._eof = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def fileno(self) -> int:
+        raise io.UnsupportedOperation("replay port has no file descriptor")
+
+    def read(self, _n: int = 0) -> bytes:
+        return b""
+
+    def read_timed(self) -> Optional[List[Tuple[float, bytes]]]:
+        """Every (arrival epoch, chunk) queued so far; None once the file is exhausted."""
+        out = []
+        while True:
+            try: out.append(self._q.get_nowait())
+            except queue.Empty: break
+        if not out and self._eof.is_set() and self._q.empty():
+            self.finished = True
+            return None
+        self.chunks += len(out)
+        return out
+
+    def start(self):
+        with _STARTED_LOCK: _STARTED[os.path.abspath(self.path)] = self
+        self._thread = threading.Thread(target=self._run, name=f"replay-{os.path.basename(self.path)}", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(2.0)
+        self.done.set()
+
+    def _put(self, item: Tuple[float, bytes]) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._q.put(item, timeout=0.1); return True
+            except queue.Full:
+                pass
+        return False
+
+    def _run(self):
+        t0 = shift = 0.0; wall0 = time.monotonic()
+        try:
+            for n, (t, chunk) in enumerate(self._records):
+                if self._stop.is_set(): return
+                if n == 0:
+                    t0 = t; shift = time.time() - t if self.clock == "shift" else 0.0
+                if self.speed > 0:
+                    delay = wall0 + (t - t0) / self.speed - time.monotonic()
+                    if delay > 0 and self._stop.wait(delay): return
+                if not self._put((t + shift, chunk)): return
+        finally:
+            self._eof.set()
+
+
+def is_replay(port: str) -> bool:
+    return isinstance(port, str) and port.startswith(SCHEME)
+
+
+def parse_url(url: str) -> Tuple[str, float, str]:
+    """'replay:<file>?speed=10&clock=original' -> (file, speed, clock); speed 0 means as fast as possible."""
+    path, _, query = url[len(SCHEME):].partition("?")
+    q = {k: v[-1] for k, v in parse_qs(query).items()}
+    speed = q.get("speed", "1")
+    return path, 0.0 if speed == "max" else float(speed), q.get("clock", "shift")
+
+
+def replay_url(path: str, speed: Optional[float] = 1.0, clock: str = "shift") -> str:
+    return f"{SCHEME}{path}?speed={'max' if not speed else speed}&clock={clock}"
+
+
+def open_port(url: str) -> ReplayPort:
+    path, speed, clock = parse_url(url)
+    try:
+        return ReplayPort(path, speed, clock)
+    except Exception as e:
+        with _STARTED_LOCK: _FAILED[os.path.abspath(path)] = (time.monotonic(), str(e))
+        raise
+
+
+def wait_replays(paths: Iterable[str], timeout: Optional[float] = None, since: float = 0.0) -> bool:
+    """
+    Block until a replay of each file (opened after ``since``, a monotonic
+    time) has delivered all of it.  Ports open on the engine thread, so a file
+    that has not started yet is waited for too.  False at once when a file is
+    missing, could not be opened or its port closed early, and on timeout.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    want = {os.path.abspath(p) for p in paths}
+    if not all(os.path.isfile(p) for p in want): return False
+    while True:
+        with _STARTED_LOCK:
+            if any(p in _FAILED and _FAILED[p][0] >= since for p in want): return False
+            ports = [port if port and port.opened >= since else None for port in map(_STARTED.get, want)]
+        if any(port and port.done.is_set() and not port.finished for port in ports): return False
+        if all(port and port.finished for port in ports): return True
+        if deadline is not None and time.monotonic() >= deadline: return False
+        time.sleep(0.05)
+
+
+def check_file(path: str):
+    """Raise OSError / ValueError unless ``path`` is a readable capture file."""
+    with open(path, "rb") as fh:
+        if fh.readline() != MAGIC:
+            raise ValueError(f"{path}: not a capture file")
+
+
+# ===== CLI =====
+def _info(path: str) -> str:
+    meta, records = read_capture(path)
+    n = size = lines = 0; first = last = None
+    for t, chunk in records:
+        n += 1; size += len(chunk); lines += chunk.count(b"\n")
+        first = t if first is None else first; last = t
+    span = (last - first) if n else 0.0
+    return (f"{path}: {meta.get('key')} on {meta.get('port')} @ {meta.get('baud')} baud, "
+            f"{n} chunks, {lines} lines, {size} bytes over {span:.1f} s")
+
+
+def _replay(args) -> Dict[str, int]:
+    import b_write, firebase_sink, lb_write
+    ports = dict(spec.split("=", 1) for spec in args.boards)
+    url = {b: replay_url(p, args.speed, args.clock) for b, p in ports.items()}
+    b_ports = {b: url[b] for b in ("B1", "B2") if b in url}
+    lb_ports = {b: url[b] for b in ("LB1", "LB2") if b in url}
+    unknown = set(url) - set(b_ports) - set(lb_ports)
+    if unknown: raise SystemExit(f"unknown boards: {', '.join(sorted(unknown))} (use B1, B2, LB1, LB2)")
+    for p in ports.values():
+        try: check_file(p)
+        except (OSError, ValueError) as e: raise SystemExit(f"cannot replay {p}: {e}")
+    timeout = getattr(args, "timeout", None)
+    t0 = time.monotonic()
+    with firebase_sink.offline():       # re-deriving a session offline never uploads it again
+        if b_ports:
+            b_write.start_capture(args.stage, args.substance, args.test_id, args.flowrate, 0, args.interval, b_ports,
+                                  backpressure=True)
+        if lb_ports:
+            lb_write.start_capture(args.stage, args.substance, args.test_id, args.flowrate, args.interval, lb_ports,
+                                   backpressure=True)
+        ok = wait_replays(ports.values(), timeout, since=t0)
+        # stop_capture closes the readers, then the writers drain what is queued
+        if b_ports: b_write.stop_capture()
+        if lb_ports: lb_write.stop_capture()
+    rows = b_write.BOARDS.run.writer_stats.get("rows", 0)
+    with _STARTED_LOCK:
+        failed = {p: why for p, (t, why) in _FAILED.items() if t >= t0 and p in map(os.path.abspath, ports.values())}
+    for p, why in failed.items(): print(f"replay of {p} failed: {why}")
+    if not ok and not failed: print(f"replay incomplete after {time.monotonic() - t0:.1f} s")
+    print(f"replayed {', '.join(sorted(url))} in {time.monotonic() - t0:.1f} s; {rows} B rows")
+    for line in b_write.snapshot()["status_lines"] + lb_write.snapshot()["status_lines"]:
+        print("  " + line)
+    return {"rows": rows, "complete": ok}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serial capture files: inspect and replay")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    info = sub.add_parser("info", help="summarise capture files")
+    info.add_argument("files", nargs="+")
+    rep = sub.add_parser("replay", help="run a capture session from recorded files")
+    rep.add_argument("boards", nargs="+", metavar="BOARD=FILE", help="e.g. B1=B_B1_20261017.cap")
+    rep.add_argument("--stage", default="Testing")
+    rep.add_argument("--substance", default="Replay")
+    rep.add_argument("--test-id", default="replay")
+    rep.add_argument("--flowrate", type=float, default=1.0)
+    rep.add_argument("--interval", type=float, default=0.0, help="decimation interval, s (0 = keep every block)")
+    rep.add_argument("--speed", default="max", help="N times real time, or 'max'")
+    rep.add_argument("--clock", choices=("shift", "original"), default="original")
+    rep.add_argument("--timeout", type=float, help="give up after this many seconds (default: no limit)")
+    args = parser.parse_args()
+    import capture      # the module ingest uses, not this __main__ copy
+    if args.cmd == "info":
+        for f in args.files: print(capture._info(f))
+    else:
+        args.speed = 0.0 if args.speed == "max" else float(args.speed)
+        if not capture._replay(args)["complete"]: raise SystemExit(1)
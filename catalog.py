@@ -0,0 +1,247 @@
+#catalog.py
+"""
+SQLite index of every captured session, maintained by the writers.
+
+One row per (file, test_id): stage, substance, board kind (B / LB1 / LB2),
+row count and time range (epoch seconds), plus the flowrates seen.  Writers
+call ``CATALOG.note_row(...)`` for each row they write; counts are aggregated
+in memory and upserted every FLUSH_S seconds by a background flusher thread
+(and on ``flush()`` at stop), so the capture path never waits on the
+database.  The Read page lists stages, substances and sessions from here
+instead of scanning folders; sessions recorded before the catalog existed, or
+copied in later, are indexed by ``ensure_scanned`` whenever a stage folder's
+tree changes.
+"""
+import glob, os, sqlite3, threading, time
+from contextlib import contextmanager
+
+import csv_sink
+import partition
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+CATALOG_PATH = os.getenv("SESSION_CATALOG", "sessions.db")
+FLUSH_S = 5.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT NOT NULL, test_id TEXT NOT NULL,
+    stage TEXT NOT NULL, substance TEXT NOT NULL, kind TEXT NOT NULL,
+    rows INTEGER NOT NULL DEFAULT 0, t_first REAL, t_last REAL, updated REAL,
+    PRIMARY KEY (path, test_id)
+);
+CREATE INDEX IF NOT EXISTS files_by_substance ON files (stage, substance);
+CREATE TABLE IF NOT EXISTS flowrates (
+    path TEXT NOT NULL, test_id TEXT NOT NULL, flowrate REAL NOT NULL,
+    PRIMARY KEY (path, test_id, flowrate)
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+Key = Tuple[str, str]   # (path, test_id)
+
+
+class _Pending:
+    __slots__ = ("stage", "substance", "kind", "rows", "t_first", "t_last", "flows")
+
+    def __init__(self, stage: str, substance: str, kind: str):
+        self.stage = stage; self.substance = substance; self.kind = kind
+        self.rows = 0; self.t_first = None; self.t_last = None
+        self.flows: Set[float] = set()
+
+
+class Catalog:
+    def __init__(self, path: str = CATALOG_PATH, flush_s: float = FLUSH_S):
+        self.path = path
+        self.flush_s = flush_s
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()      # one upsert at a time (flusher thread vs stop path)
+        self._pending: Dict[Key, _Pending] = {}
+        self._flusher: Optional[threading.Thread] = None
+        self._scanned: Dict[str, int] = {}       # root -> tree mtime at the last scan
+        self._ready = False
+
+    @contextmanager
+    def _db(self):
+        """One short-lived connection per call: commit on success, always close."""
+        con = sqlite3.connect(self.path, timeout=5.0)
+        try:
+            if not self._ready:
+                con.executescript(_SCHEMA)
+                self._ready = True
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    # ----- writer side -----
+    def note_row(self, path: str, stage: str, substance: str, test_id: Optional[str], kind: str,
+                 ts_epoch: float, flowrate: Optional[float] = None):
+        key = (os.path.normpath(path), test_id or "")
+        with self._lock:
+            p = self._pending.get(key)
+            if p is None:
+                p = self._pending[key] = _Pending(stage, substance, kind)
+            p.rows += 1
+            p.t_first = ts_epoch if p.t_first is None else min(p.t_first, ts_epoch)
+            p.t_last = ts_epoch if p.t_last is None else max(p.t_last, ts_epoch)
+            if flowrate is not None: p.flows.add(float(flowrate))
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name="catalog-flush", daemon=True)
+                self._flusher.start()
+
+    def _flush_loop(self):
+        """Upsert what the writers noted every flush_s; exits once a round finds nothing new."""
+        while True:
+            time.sleep(self.flush_s)
+            self.flush()
+            with self._lock:
+                if not self._pending:
+                    self._flusher = None
+                    return
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending: return
+            try:
+                with self._db() as con:
+                    self._upsert(con, pending)
+            except sqlite3.Error as e:
+                print(f"[catalog] update failed, will retry: {e}")
+                with self._lock:
+                    for key, p in pending.items():
+                        self._merge_back(key, p)
+
+    def _merge_back(self, key: Key, p: _Pending):
+        cur = self._pending.get(key)
+        if cur is None:
+            self._pending[key] = p; return
+        cur.rows += p.rows
+        cur.t_first = min(x for x in (cur.t_first, p.t_first) if x is not None)
+        cur.t_last = max(x for x in (cur.t_last, p.t_last) if x is not None)
+        cur.flows |= p.flows
+
+    @staticmethod
+    def _upsert(con: sqlite3.Connection, pending: Dict[Key, _Pending]):
+        now = time.time()
+        con.executemany(
+            """INSERT INTO files (path, test_id, stage, substance, kind, rows, t_first, t_last, updated)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (path, test_id) DO UPDATE SET
+                   rows = rows + excluded.rows,
+                   t_first = MIN(COALESCE(t_first, excluded.t_first), COALESCE(excluded.t_first, t_first)),
+                   t_last = MAX(COALESCE(t_last, excluded.t_last), COALESCE(excluded.t_last, t_last)),
+                   updated = excluded.updated""",
+            [(k[0], k[1], p.stage, p.substance, p.kind, p.rows, p.t_first, p.t_last, now)
+             for k, p in pending.items()])
+        con.executemany("INSERT OR IGNORE INTO flowrates (path, test_id, flowrate) VALUES (?, ?, ?)",
+                        [(k[0], k[1], f) for k, p in pending.items() for f in p.flows])
+
+    # ----- read side -----
+    def stages(self) -> List[str]:
+        with self._db() as con:
+            return [r[0] for r in con.execute("SELECT DISTINCT stage FROM files ORDER BY stage")]
+
+    def substances(self, stage: str) -> List[str]:
+        with self._db() as con:
+            return [r[0] for r in con.execute(
+                "SELECT DISTINCT substance FROM files WHERE stage = ? ORDER BY substance", (stage,))]
+
+    def sessions(self, stage: str, substance: str) -> List[dict]:
+        """One entry per test_id, newest first, with {kind: [files, oldest first]} that hold it."""
+        with self._db() as con:
+            rows = con.execute(
+                """SELECT f.test_id, f.path, f.kind, f.rows, f.t_first, f.t_last,
+                          (SELECT group_concat(flowrate) FROM flowrates r
+                           WHERE r.path = f.path AND r.test_id = f.test_id)
+                   FROM files f WHERE f.stage = ? AND f.substance = ?""", (stage, substance)).fetchall()
+        out: Dict[str, dict] = {}
+        for test_id, path, kind, n, t0, t1, flows in rows:
+            s = out.setdefault(test_id, {"test_id": test_id, "files": {}, "rows": 0,
+                                         "t_first": t0, "t_last": t1, "flowrates": set()})
+            s["files"].setdefault(kind, []).append((t0 or 0, path))
+            s["rows"] += n
+            if t0 is not None: s["t_first"] = min(x for x in (s["t_first"], t0) if x is not None)
+            if t1 is not None: s["t_last"] = max(x for x in (s["t_last"], t1) if x is not None)
+            if flows: s["flowrates"].update(float(f) for f in flows.split(","))
+        for s in out.values():
+            s["flowrates"] = sorted(s["flowrates"])
+            s["files"] = {k: [p for _t, p in sorted(v)] for k, v in s["files"].items()}
+        return sorted(out.values(), key=lambda s: s["t_last"] or 0, reverse=True)
+
+    # ----- index of sessions the writers did not record (older, or copied in) -----
+    def ensure_scanned(self, roots: Iterable[str]):
+        """Scan each root whose folder tree changed since its last scan (kept in memory and in meta)."""
+        sigs = {r: _tree_mtime(r) for r in roots}
+        stale = [r for r, sig in sigs.items() if self._scanned.get(r) != sig]
+        if not stale: return
+        with self._db() as con:
+            stored = dict(con.execute("SELECT key, value FROM meta WHERE key LIKE 'scanned:%'").fetchall())
+        stale = [r for r in stale if stored.get(f"scanned:{r}") != str(sigs[r])]
+        if stale:
+            self.scan(stale)
+            with self._db() as con:
+                con.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                [(f"scanned:{r}", str(sigs[r])) for r in stale])
+        self._scanned.update(sigs)
+
+    def scan(self, roots: Iterable[str]):
+        """
+        Index session CSVs not already in the catalog: per-test partitions
+        (<stage>/<substance>/<test folder>/*.csv, test_id from the folder's
+        sidecar, else its name) and older cumulative files directly in the
+        substance folder (test_id = file name).
+        """
+        import pandas as pd
+        self.flush()            # files a running capture has noted rows for are known, not rescanned
+        with self._db() as con:
+            known = {r[0] for r in con.execute("SELECT DISTINCT path FROM files")}
+        pending: Dict[Key, _Pending] = {}
+        for stage in roots:
+            flat = glob.glob(os.path.join(stage, "*", "*.csv"))
+            nested = {os.path.normpath(p) for p in glob.glob(os.path.join(stage, "*", "*", "*.csv"))}
+            for path in flat + sorted(nested):
+                path = os.path.normpath(path)
+                if path in known or "_pending_" in path or csv_sink.is_segment(path): continue
+                try:
+                    df = csv_sink.read_frame(path, usecols=lambda c: c in ("Timestamp", "Flowrate (L/min)"))
+                except Exception as e:
+                    print(f"[catalog] skipped {path}: {e}"); continue
+                ts = pd.to_datetime(df.get("Timestamp"), errors="coerce").dropna() if "Timestamp" in df else None
+                if path in nested:
+                    test_dir = os.path.dirname(path)
+                    substance = os.path.basename(os.path.dirname(test_dir))
+                    test_id = partition.read_test_id(test_dir) or os.path.basename(test_dir)
+                else:
+                    substance, test_id = os.path.basename(os.path.dirname(path)), os.path.splitext(os.path.basename(path))[0]
+                p = pending[(path, test_id)] = _Pending(stage, substance, kind_of(path))
+                p.rows = len(df)
+                if ts is not None and len(ts):
+                    p.t_first = ts.min().to_pydatetime().timestamp()
+                    p.t_last = ts.max().to_pydatetime().timestamp()
+                if "Flowrate (L/min)" in df:
+                    p.flows = set(pd.to_numeric(df["Flowrate (L/min)"], errors="coerce").dropna().unique().tolist())
+        if pending:
+            with self._db() as con:
+                self._upsert(con, pending)
+
+
+def _tree_mtime(root: str) -> int:
+    """Newest mtime of a stage folder and its substance and test folders (0 if missing)."""
+    base = glob.escape(root)
+    newest = 0
+    for d in [root] + glob.glob(os.path.join(base, "*", "")) + glob.glob(os.path.join(base, "*", "*", "")):
+        try: newest = max(newest, os.stat(d).st_mtime_ns)
+        except OSError: pass
+    return newest
+
+
+def kind_of(path: str) -> str:
+    name = os.path.basename(path)
+    for kind in ("LB1", "LB2", "LB", "Aligned"):
+        if f"_{kind}_" in name: return kind
+    return "B"
+
+
+CATALOG = Catalog()
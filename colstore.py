@@ -0,0 +1,309 @@
+#colstore.py
+"""
+Typed columnar copy of a session, next to its CSV:
+
+    Ethanol_B_Readings.csv
+    Ethanol_B_Readings.cols/
+        schema.json     {"version": 1, "time": "t.i64", "columns": [{"name", "file", "unit", "dtype"}]}
+        t.i64           timestamp as written in the CSV (local wall clock), int64 ns
+        c000.f64 ...    one little-endian float64 file per column, NaN = blank cell
+
+Every file is a flat array, so loading is ``np.memmap`` per column: no text
+parsing and no unit stripping (units live in the schema).  The row count is
+the shortest file, so a crash mid-flush just loses the torn rows.  ColumnSink
+appends alongside CsvSink in the writers, buffered the same way (flush_rows /
+flush_s); ``python colstore.py convert <csv>...`` builds the same layout for
+existing sessions.
+
+The copy is only used in place of the CSV while ``current(csv)`` holds: same
+row count and same first and last Timestamp.  A session resumed after a
+COLSTORE=0 run, or appended to a CSV that predates its copy, is converted
+again by ``open_sink`` before the writers append to it.
+"""
+import argparse, json, os, re, threading, time
+from datetime import datetime, timedelta
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+import csv_sink
+
+ENABLED = os.getenv("COLSTORE", "1") != "0"
+SCHEMA = "schema.json"
+TIME_FILE = "t.i64"
+
+_F64 = np.dtype("<f8")
+_I64 = np.dtype("<i8")
+_EPOCH = datetime(1970, 1, 1)
+_NAME_UNIT_RE = re.compile(r"\(([^()]+)\)\s*$")
+_NUMBER_RE = re.compile(r"([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*(.*?)\s*$")
+
+
+def dir_for(csv_path: str) -> str:
+    return os.path.splitext(csv_path)[0] + ".cols"
+
+
+def unit_of(name: str) -> Optional[str]:
+    """Unit carried in a column name: 'B1 - GM102B (NO2) (ppm)' -> ppm, 'B1 - TGS2600 - V' -> V."""
+    if name.endswith(" - V"): return "V"
+    if name.endswith(" - raw"): return "raw"
+    m = _NAME_UNIT_RE.search(name)
+    return m.group(1) if m else None
+
+
+def _read_schema(d: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(d, SCHEMA), encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_schema(d: str, schema: dict):
+    tmp = os.path.join(d, SCHEMA + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(schema, fh, indent=1, ensure_ascii=False)
+    os.replace(tmp, os.path.join(d, SCHEMA))
+
+
+def _rows(d: str, schema: dict) -> int:
+    files = [schema["time"]] + [c["file"] for c in schema["columns"]]
+    sizes = [os.path.getsize(os.path.join(d, f)) if os.path.exists(os.path.join(d, f)) else 0 for f in files]
+    return min(sizes) // 8
+
+
+# ===== writing =====
+def _wall_ns(ts_epoch: float) -> int:
+    """Epoch seconds -> local wall-clock ns, the same instant the CSV's Timestamp shows."""
+    dt = datetime.fromtimestamp(ts_epoch)
+    return (dt - _EPOCH) // timedelta(microseconds=1) * 1000
+
+
+def _wall_str(wall_ns: int) -> str:
+    return (_EPOCH + timedelta(microseconds=int(wall_ns) // 1000)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class ColumnSink:
+    """
+    Append-only columnar twin of CsvSink: ``write(ts_epoch, values)`` per row,
+    kept in memory and appended every ``flush_rows`` rows / ``flush_s`` seconds
+    (``maybe_flush()`` for callers that go idle, ``close()`` for the rest).
+    """
+    def __init__(self, d: str, columns: Sequence[str], units: Optional[Mapping[str, Optional[str]]] = None,
+                 flush_rows: Optional[int] = None, flush_s: Optional[float] = None):
+        self.dir = d
+        self.flush_rows = max(1, int(csv_sink.FLUSH_ROWS if flush_rows is None else flush_rows))
+        self.flush_s = float(csv_sink.FLUSH_S if flush_s is None else flush_s)
+        self._lock = threading.Lock()
+        self._buf_t: List[int] = []
+        self._buf: List[List[float]] = []
+        self._last_flush = time.monotonic()
+        os.makedirs(d, exist_ok=True)
+        schema = _read_schema(d) or {"version": 1, "time": TIME_FILE, "columns": []}
+        self.rows = _rows(d, schema) if schema["columns"] or os.path.exists(os.path.join(d, TIME_FILE)) else 0
+        # drop any torn tail so every file holds exactly self.rows values
+        for f in [schema["time"]] + [c["file"] for c in schema["columns"]]:
+            p = os.path.join(d, f)
+            if os.path.exists(p) and os.path.getsize(p) != self.rows * 8:
+                os.truncate(p, self.rows * 8)
+        self._schema = schema
+        self._index: Dict[str, int] = {c["name"]: i for i, c in enumerate(schema["columns"])}
+        self._t = open(os.path.join(d, schema["time"]), "ab")
+        self._fhs = [open(os.path.join(d, c["file"]), "ab") for c in schema["columns"]]
+        self.add_columns(columns, units)
+
+    def add_columns(self, columns: Sequence[str], units: Optional[Mapping[str, Optional[str]]] = None):
+        """Register new columns; earlier rows read NaN for them."""
+        new = [c for c in columns if c not in self._index]
+        if not new: return
+        with self._lock:
+            self._flush_locked()        # buffered rows are as wide as the files they go to
+            for name in new:
+                f = f"c{len(self._schema['columns']):03d}.f64"
+                unit = (units or {}).get(name) or unit_of(name)
+                self._schema["columns"].append({"name": name, "file": f, "unit": unit, "dtype": "float64"})
+                self._index[name] = len(self._fhs)
+                fh = open(os.path.join(self.dir, f), "ab")
+                if self.rows: fh.write(np.full(self.rows, np.nan, dtype=_F64).tobytes())
+                self._fhs.append(fh)
+            _write_schema(self.dir, self._schema)
+
+    def write(self, ts_epoch: float, values: Union[Sequence, Mapping[str, object]]):
+        """One row: a sequence in registration order, or a {column: value} dict (missing -> NaN)."""
+        if isinstance(values, Mapping):
+            self.add_columns([c for c in values if c not in self._index])
+            row = [np.nan] * len(self._fhs)
+            for c, v in values.items(): row[self._index[c]] = v
+        else:
+            row = list(values) + [np.nan] * (len(self._fhs) - len(values))
+        row = [np.nan if v is None or v == "" else float(v) for v in row]
+        with self._lock:
+            self._buf.append(row)
+            self._buf_t.append(_wall_ns(ts_epoch))
+            if len(self._buf_t) >= self.flush_rows or time.monotonic() - self._last_flush >= self.flush_s:
+                self._flush_locked()
+
+    def maybe_flush(self):
+        """Time-based flush for callers that go idle between rows."""
+        with self._lock:
+            if self._buf_t and time.monotonic() - self._last_flush >= self.flush_s:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock: self._flush_locked()
+
+    def _flush_locked(self):
+        self._last_flush = time.monotonic()
+        if not self._buf_t: return
+        n = len(self._buf_t)
+        block = np.array(self._buf, dtype=_F64).reshape(n, len(self._fhs))
+        # values first, time last: a torn flush is shorter in t.i64 and gets dropped
+        for i, fh in enumerate(self._fhs):
+            fh.write(block[:, i].tobytes()); fh.flush()
+        self._t.write(np.array(self._buf_t, dtype=_I64).tobytes()); self._t.flush()
+        self.rows += n
+        self._buf.clear(); self._buf_t.clear()
+
+    def close(self):
+        with self._lock:
+            self._flush_locked()
+            for fh in self._fhs + [self._t]:
+                try:
+                    os.fsync(fh.fileno()); fh.close()
+                except (OSError, ValueError):
+                    pass
+
+
+def open_sink(csv_path: str, columns: Sequence[str],
+              units: Optional[Mapping[str, Optional[str]]] = None) -> ColumnSink:
+    """ColumnSink next to a CSV the writers append to; rows the copy lacks are converted first."""
+    if _csv_extent(csv_path)[0] and not current(csv_path):
+        convert_csv(csv_path)
+    return ColumnSink(dir_for(csv_path), columns, units)
+
+
+# ===== reading =====
+class Session:
+    def __init__(self, d: str):
+        schema = _read_schema(d)
+        if schema is None:
+            raise FileNotFoundError(os.path.join(d, SCHEMA))
+        n = _rows(d, schema)
+        self.dir = d
+        self.rows = n
+        self.units: Dict[str, Optional[str]] = {c["name"]: c.get("unit") for c in schema["columns"]}
+        self.t = self._map(schema["time"], _I64, n)
+        self.columns: Dict[str, np.ndarray] = {c["name"]: self._map(c["file"], _F64, n) for c in schema["columns"]}
+
+    def _map(self, f: str, dtype, n: int) -> np.ndarray:
+        if n == 0: return np.empty(0, dtype=dtype)
+        return np.memmap(os.path.join(self.dir, f), dtype=dtype, mode="r", shape=(n,))
+
+    def to_frame(self):
+        """pandas DataFrame with a datetime64 'Timestamp' column (one copy, no parsing)."""
+        import pandas as pd
+        data = {"Timestamp": pd.to_datetime(np.asarray(self.t), unit="ns")}
+        data.update({name: np.asarray(col) for name, col in self.columns.items()})
+        return pd.DataFrame(data, copy=False)
+
+
+def exists(csv_path: str) -> bool:
+    return os.path.exists(os.path.join(dir_for(csv_path), SCHEMA))
+
+
+def _first_field(line: bytes) -> str:
+    return line.split(b",", 1)[0].strip().strip(b'"').decode("utf-8", "replace")
+
+
+def _csv_extent(csv_path: str) -> Tuple[int, Optional[str], Optional[str]]:
+    """(data rows, first Timestamp, last Timestamp) over every segment of a CSV, without parsing it."""
+    rows, first, last = 0, None, None
+    for p in csv_sink.segments(csv_path):
+        with open(p, "rb") as fh:
+            fh.readline()                                   # header
+            row1 = fh.readline()
+            if not row1.strip(): continue
+            n, end = row1.count(b"\n"), row1
+            for chunk in iter(lambda: fh.read(1 << 20), b""):
+                n += chunk.count(b"\n"); end = chunk
+            if not end.endswith(b"\n"): n += 1                # last row without its line break
+            fh.seek(max(0, fh.tell() - 4096))
+            tail = fh.read().rstrip(b"\r\n").rsplit(b"\n", 1)[-1]
+        rows += n
+        if first is None: first = _first_field(row1)
+        last = _first_field(tail)
+    return rows, first, last
+
+
+_CURRENT: Dict[str, Tuple[tuple, bool]] = {}
+
+
+def current(csv_path: str) -> bool:
+    """
+    True when the columnar copy holds exactly the CSV's rows: same count, same
+    first and last Timestamp.  Memoized on the files' sizes and mtimes.
+    """
+    if not exists(csv_path): return False
+    d = dir_for(csv_path)
+    try:
+        files = csv_sink.segments(csv_path) + [os.path.join(d, SCHEMA), os.path.join(d, TIME_FILE)]
+        key = tuple((st.st_size, st.st_mtime_ns) for st in map(os.stat, files))
+    except OSError:
+        return False
+    hit = _CURRENT.get(csv_path)
+    if hit and hit[0] == key: return hit[1]
+    try:
+        rows, first, last = _csv_extent(csv_path)
+        s = Session(d)
+        ok = s.rows == rows and (rows == 0 or (_wall_str(s.t[0]), _wall_str(s.t[-1])) == (first, last))
+    except (OSError, ValueError):
+        ok = False
+    _CURRENT[csv_path] = (key, ok)
+    return ok
+
+
+# ===== converting existing CSVs =====
+def convert_csv(csv_path: str, d: Optional[str] = None) -> str:
+    """Write the columnar layout for an existing session CSV; units found in cells go to the schema."""
+    import pandas as pd
+    d = d or dir_for(csv_path)
+    df = csv_sink.read_frame(csv_path)
+    ts = pd.to_datetime(df.pop("Timestamp"), errors="coerce")
+    keep = ts.notna().to_numpy()
+    wall_ns = ts[keep].to_numpy(dtype="datetime64[ns]").view(_I64)
+
+    columns: Dict[str, np.ndarray] = {}
+    units: Dict[str, Optional[str]] = {}
+    for name in df.columns:
+        col = df[name][keep]
+        if pd.api.types.is_numeric_dtype(col):
+            columns[name] = col.to_numpy(dtype=float); continue
+        parts = col.astype(str).str.extract(_NUMBER_RE)
+        columns[name] = pd.to_numeric(parts[0], errors="coerce").to_numpy(dtype=float)
+        cell_units = parts[1].dropna()
+        cell_units = cell_units[cell_units != ""]
+        units[name] = cell_units.mode().iat[0] if len(cell_units) else None
+
+    if os.path.isdir(d):
+        for f in os.listdir(d): os.remove(os.path.join(d, f))
+    os.makedirs(d, exist_ok=True)
+    schema = {"version": 1, "time": TIME_FILE, "columns": []}
+    wall_ns.tofile(os.path.join(d, TIME_FILE))
+    for i, (name, arr) in enumerate(columns.items()):
+        f = f"c{i:03d}.f64"
+        arr.astype(_F64).tofile(os.path.join(d, f))
+        schema["columns"].append({"name": name, "file": f, "unit": units.get(name) or unit_of(name), "dtype": "float64"})
+    _write_schema(d, schema)
+    return d
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Columnar copies of session CSVs")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    conv = sub.add_parser("convert", help="write <name>.cols/ next to each CSV")
+    conv.add_argument("csv", nargs="+")
+    args = parser.parse_args()
+    for path in args.csv:
+        out = convert_csv(path)
+        s = Session(out)
+        print(f"{path} -> {out} ({s.rows} rows, {len(s.columns)} columns)")
@@ -0,0 +1,238 @@
+#csv_sink.py
+"""
+Long-lived CSV output for the capture writers.
+
+One CsvSink per output file keeps the handle and csv writer open for the whole
+capture and flushes every ``flush_rows`` rows or ``flush_s`` seconds, whichever
+comes first.  fsync policy:
+    "never"   leave it to the OS
+    "flush"   fsync on every flush (default)
+    "always"  flush + fsync after every row
+If the file is locked (PermissionError, e.g. open in Excel on Windows) rows go
+to one ``<name>_pending_<stamp>.csv`` until the main file can be reopened,
+retried every ``retry_s``.  With ``max_bytes`` set (CSV_MAX_BYTES), a file
+that has grown past it is closed and rows continue in the next segment with
+the same header: nothing is renamed, so a crash cannot lose a rotated file.
+
+The header is never rewritten in place.  New columns (``add_columns``, or a
+dict row with new keys), or an existing file whose header differs from ours,
+start a new segment ``<name>.seg<N>.csv`` with its own header, and one schema
+record per segment is appended to ``<name>.schema.jsonl``.  ``read_frame``
+reads every segment back as one DataFrame (union of the columns).
+"""
+import csv, glob, json, os, re, threading, time
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Union
+
+FLUSH_ROWS = 10
+FLUSH_S = 2.0
+FSYNC = "flush"
+RETRY_S = 30.0
+MAX_BYTES = int(os.getenv("CSV_MAX_BYTES", "0")) or None    # rotate a segment past this size; None = never
+
+Row = Union[Sequence, Dict[str, object]]
+
+_SEG_RE = re.compile(r"\.seg(\d+)\.csv$")
+
+
+# ----- segments -----
+def segment_path(path: str, n: int) -> str:
+    root, ext = os.path.splitext(path)
+    return path if n <= 1 else f"{root}.seg{n}{ext}"
+
+
+def schema_path(path: str) -> str:
+    return os.path.splitext(path)[0] + ".schema.jsonl"
+
+
+def is_segment(path: str) -> bool:
+    return bool(_SEG_RE.search(path))
+
+
+def segments(path: str) -> List[str]:
+    """Existing files of ``path``, first segment first."""
+    root, ext = os.path.splitext(path)
+    numbered = sorted((int(m.group(1)), p) for p in glob.glob(glob.escape(root) + ".seg*" + ext)
+                      if (m := _SEG_RE.search(p)))
+    return ([path] if os.path.exists(path) else []) + [p for _n, p in numbered]
+
+
+def _read_header(path: str) -> List[str]:
+    try:
+        with open(path, newline="", encoding="utf-8-sig") as fh:
+            return next(csv.reader(fh), [])
+    except OSError:
+        return []
+
+
+def read_frame(path: str, **read_csv_kw):
+    """
+    Every segment of ``path`` as one pandas DataFrame: columns in first-seen
+    order, blank where a segment predates a column.  One parse per segment,
+    one concat.
+    """
+    import pandas as pd
+    kw = {"on_bad_lines": "skip", "encoding": "utf-8-sig", **read_csv_kw}
+    frames = [pd.read_csv(p, **kw) for p in segments(path)]
+    if not frames:
+        raise FileNotFoundError(path)
+    return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True, sort=False)
+
+
+class CsvSink:
+    def __init__(self, path: str, header: List[str], flush_rows: Optional[int] = None,
+                 flush_s: Optional[float] = None, fsync: str = FSYNC,
+                 max_bytes: Optional[int] = None, retry_s: float = RETRY_S):
+        if fsync not in ("never", "flush", "always"):
+            raise ValueError(f"unknown fsync policy: {fsync}")
+        self.path = path
+        self.header = list(header)
+        # None: the module defaults as they are now, so a caller (bench) can change them for every sink
+        self.flush_rows = max(1, int(FLUSH_ROWS if flush_rows is None else flush_rows))
+        self.flush_s = float(FLUSH_S if flush_s is None else flush_s)
+        self.fsync = fsync
+        self.max_bytes = (MAX_BYTES if max_bytes is None else max_bytes) or None     # 0: never rotate
+        self.retry_s = retry_s
+        self.pending_path: Optional[str] = None
+        self.rows_written = 0
+        existing = segments(path)
+        self.segment = int(_SEG_RE.search(existing[-1]).group(1)) if existing and is_segment(existing[-1]) else 1
+        self._segment_reason = "new file"
+        header_now = _read_header(existing[-1]) if existing else []
+        if header_now and header_now != self.header:
+            self.segment += 1
+            self._segment_reason = "header differs from existing file"
+        self._lock = threading.Lock()
+        self._fh = None
+        self._writer = None
+        self.closed = False
+        self._unflushed = 0
+        self._last_flush = time.monotonic()
+        self._retry_at = 0.0
+        try: self._open(self.main_path)
+        except PermissionError: self._to_pending()
+
+    @property
+    def main_path(self) -> str:
+        """The segment rows currently go to (``path`` itself until the header changes)."""
+        return segment_path(self.path, self.segment)
+
+    # ----- file handling -----
+    def _open(self, path: str):
+        d = os.path.dirname(path)
+        if d: os.makedirs(d, exist_ok=True)
+        fh = open(path, "a", newline="", encoding="utf-8")
+        self._fh = fh
+        self._writer = csv.writer(fh)
+        if fh.tell() == 0:
+            self._writer.writerow(self.header)
+            if path == self.main_path: self._record_schema()
+
+    def _record_schema(self):
+        rec = {"segment": self.segment, "file": os.path.basename(self.main_path), "columns": self.header,
+               "started": datetime.now().isoformat(timespec="seconds"), "reason": self._segment_reason}
+        with open(schema_path(self.path), "a", encoding="utf-8") as fh:
+            fh.write(json.dumps(rec, ensure_ascii=False) + "\n")
+
+    def _close_handle(self):
+        if self._fh is None: return
+        try:
+            self._fh.flush()
+            if self.fsync != "never": os.fsync(self._fh.fileno())
+        finally:
+            self._fh.close(); self._fh = None; self._writer = None
+
+    def _to_pending(self):
+        """Main file is locked: divert to one pending file and retry later."""
+        try: self._close_handle()
+        except OSError: pass
+        if self.pending_path is None:
+            stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            self.pending_path = os.path.splitext(self.main_path)[0] + f"_pending_{stamp}.csv"
+        self._open(self.pending_path)
+        self._retry_at = time.monotonic() + self.retry_s
+
+    def _maybe_return_to_main(self):
+        if self.pending_path is None or time.monotonic() < self._retry_at: return
+        try:
+            self._close_handle(); self._open(self.main_path)
+            self.pending_path = None
+        except PermissionError:
+            self._open(self.pending_path)
+            self._retry_at = time.monotonic() + self.retry_s
+
+    def _rotate(self):
+        """Continue in the next segment; the full one stays where it is."""
+        size = self._fh.tell()
+        self._close_handle()
+        self.segment += 1
+        self._segment_reason = f"rotated at {size} bytes"
+        self._open(self.main_path)
+
+    # ----- public API -----
+    def _check_open(self):
+        if self.closed: raise ValueError(f"CsvSink for {self.path} is closed")
+
+    def add_columns(self, columns: Sequence[str]):
+        """Append columns to the header; rows from now on go to a new segment (nothing is rewritten)."""
+        new = [c for c in columns if c not in self.header]
+        if not new: return
+        with self._lock:
+            self._check_open()
+            try: self._close_handle()
+            except OSError: pass
+            self.header += new
+            self.segment += 1
+            self._segment_reason = f"new columns: {', '.join(new)}"
+            self.pending_path = None
+            try: self._open(self.main_path)
+            except PermissionError: self._to_pending()
+
+    def write(self, row: Row):
+        """One row: a list in header order (may be shorter), or a dict; unknown keys become new columns."""
+        if isinstance(row, dict):
+            extra = [k for k in row if k not in self.header]
+            if extra: self.add_columns(extra)
+            row = [row.get(c) for c in self.header]
+        with self._lock:
+            self._check_open()
+            self._maybe_return_to_main()
+            try:
+                if self._fh is None: self._open(self.main_path)
+                self._writer.writerow(row)
+            except PermissionError:
+                self._to_pending()
+                self._writer.writerow(row)
+            self.rows_written += 1
+            self._unflushed += 1
+            if self.fsync == "always" or self._unflushed >= self.flush_rows \
+                    or time.monotonic() - self._last_flush >= self.flush_s:
+                self._flush_locked()
+
+    def maybe_flush(self):
+        """Time-based flush for callers that go idle between rows."""
+        with self._lock:
+            if self._unflushed and time.monotonic() - self._last_flush >= self.flush_s:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock: self._flush_locked()
+
+    def _flush_locked(self):
+        if self._fh is None: return
+        self._fh.flush()
+        if self.fsync != "never": os.fsync(self._fh.fileno())
+        self._unflushed = 0
+        self._last_flush = time.monotonic()
+        if self.max_bytes and self.pending_path is None and self._fh.tell() >= self.max_bytes:
+            self._rotate()
+
+    def close(self):
+        """Flush and close; writing afterwards raises ValueError."""
+        with self._lock:
+            self.closed = True
+            self._close_handle()
+
+    @property
+    def current_path(self) -> str:
+        return self.pending_path or self.path
@@ -0,0 +1,85 @@
+#downsample.py
+"""
+Server-side downsampling for the Read / Plot figures.
+
+Both functions take x (monotonic, any numeric; timestamps as int64 ns) and y
+arrays and return the *indices* of the points to keep, in order, so callers
+can slice whatever else goes with them (the original Timestamp column):
+
+    lttb(x, y, n)     Largest-Triangle-Three-Buckets: n points that keep the
+                      visual shape of the line (Steinarsson 2013)
+    minmax(x, y, n)   min and max of each of n//2 buckets: keeps every spike
+
+``select(x, y, budget, method)`` drops NaNs and returns all indices when the
+series already fits the budget.
+"""
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+
+METHOD = os.getenv("READ_DOWNSAMPLE", "lttb")   # "lttb" | "minmax" | "none"
+MIN_BUDGET = 200
+
+
+def _edges(n_points: int, n_buckets: int) -> np.ndarray:
+    return np.linspace(0, n_points, n_buckets + 1).astype(np.int64)
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n: int) -> np.ndarray:
+    size = len(x)
+    if n >= size or n < 3:
+        return np.arange(size)
+    x = np.asarray(x, dtype=np.float64); y = np.asarray(y, dtype=np.float64)
+
+    # first and last points are fixed; the middle is split into n - 2 buckets
+    edges = _edges(size - 2, n - 2) + 1
+    # the third vertex of each triangle is the mean of the *next* bucket
+    avg_x = np.add.reduceat(x[1:-1], edges[:-1] - 1) / np.diff(edges)
+    avg_y = np.add.reduceat(y[1:-1], edges[:-1] - 1) / np.diff(edges)
+    avg_x = np.append(avg_x[1:], x[-1]); avg_y = np.append(avg_y[1:], y[-1])
+
+    out = np.empty(n, dtype=np.int64)
+    out[0] = 0; out[-1] = size - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        bx = x[lo:hi]; by = y[lo:hi]
+        area = np.abs((x[a] - avg_x[i]) * (by - y[a]) - (x[a] - bx) * (avg_y[i] - y[a]))
+        a = lo + int(area.argmax())
+        out[i + 1] = a
+    return out
+
+
+def minmax(x: np.ndarray, y: np.ndarray, n: int) -> np.ndarray:
+    size = len(y)
+    buckets = n // 2
+    if n >= size or buckets < 1:
+        return np.arange(size)
+    y = np.asarray(y, dtype=np.float64)
+    edges = _edges(size, buckets)
+    keep = np.empty(2 * buckets + 2, dtype=np.int64)
+    keep[0] = 0; keep[-1] = size - 1
+    for i in range(buckets):
+        lo, hi = edges[i], edges[i + 1]
+        seg = y[lo:hi]
+        keep[2 * i + 1] = lo + int(seg.argmin())
+        keep[2 * i + 2] = lo + int(seg.argmax())
+    return np.unique(keep)
+
+
+def select(x: np.ndarray, y: np.ndarray, budget: int, method: str = METHOD) -> np.ndarray:
+    y = np.asarray(y, dtype=np.float64)
+    valid = np.flatnonzero(~np.isnan(y))
+    if method == "none" or len(valid) <= budget:
+        return valid
+    fn = minmax if method == "minmax" else lttb
+    return valid[fn(np.asarray(x)[valid], y[valid], max(MIN_BUDGET, int(budget)))]
+
+
+def clip(x: np.ndarray, x_range: Optional[Tuple[float, float]]) -> slice:
+    """Slice of a sorted ``x`` covering ``x_range`` plus one point either side, so lines reach the edges."""
+    if not x_range: return slice(0, len(x))
+    lo = max(0, int(np.searchsorted(x, x_range[0], side="left")) - 1)
+    hi = min(len(x), int(np.searchsorted(x, x_range[1], side="right")) + 1)
+    return slice(lo, hi)
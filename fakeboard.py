@@ -0,0 +1,62 @@
+#fakeboard.py
+"""
+Stand-in boards for exercising the readers without hardware.
+
+FakeSource is a serial-like handle (``in_waiting`` / ``read`` / ``close``) that
+the ingest engine accepts in place of a port name, so fake data goes through
+the same polling, line splitting and engine thread as a real board:
+
+    ingest.ENGINE.add("preview:B1", fakeboard.FakeSource(), 9600, on_line)
+
+``start()`` (called by the engine once the port is registered) emits
+``block_fn(n)`` every ``period_s``; with ``block_fn=None`` nothing is generated
+and tests push bytes with ``feed()``.
+"""
+import math, threading
+from typing import Callable, List, Optional
+
+
+def fake_b_block(n: int) -> List[bytes]:
+    """The n-th block of a plausible B board, framed like Board2 (two empty lines end it)."""
+    w = math.sin(n / 30.0)
+    return [b"New Data",
+            b"TGS2600: %d" % (400 + 40 * w), b"TGS2602: %d" % (430 + 25 * w), b"MQ2: %d" % (72 + 10 * w),
+            b"GM102B (NO2): %d ppm" % (210 + 30 * w), b"GM502B (VOC): %d ppm" % (73 + 12 * w),
+            b"temperature: %.2f \xc2\xb0C" % (24.4 + 0.3 * w), b"", b""]
+
+
+class FakeSource:
+    def __init__(self, block_fn: Optional[Callable[[int], List[bytes]]] = fake_b_block, period_s: float = 1.0):
+        self.block_fn = block_fn; self.period_s = period_s
+        self._buf = bytearray()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def in_waiting(self) -> int:
+        with self._lock: return len(self._buf)
+
+    def read(self, n: int) -> bytes:
+        with self._lock:
+            out = bytes(self._buf[:n]); del self._buf[:n]
+        return out
+
+    def feed(self, data: bytes):
+        with self._lock: self._buf += data
+
+    def start(self):
+        if self.block_fn is None: return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="fake-board", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+
+    def _run(self):
+        n = 0
+        while not self._stop.is_set():
+            self.feed(b"".join(raw + b"\r\n" for raw in self.block_fn(n)))
+            n += 1
+            self._stop.wait(self.period_s)
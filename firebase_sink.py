@@ -0,0 +1,579 @@
+#firebase_sink.py
+"""
+The one Firebase sink shared by b_write, lb_write and realtime.
+
+SINK owns the process-wide connection, the sequence allocator and the uploader.
+``SINK.init()`` connects if not yet connected; a failed attempt (or a sink that
+went offline after repeated write errors) is retried by a later call - each
+writer's start_capture makes one - once a backoff of INIT_BACKOFF_S, doubling
+up to BACKOFF_MAX_S, has passed.  ``SINK.put_reading(...)`` allocates the next
+reading key under a lock and hands the payload to the uploader, connected or
+not: readings taken offline wait in the write-ahead queue, and the uploader
+retries ``init()`` (at its backoff) until it can send them.  The backend
+is chosen with FIREBASE_BACKEND, read when ``init()`` first needs one:
+    "firebase"  firebase_admin from DATABASE_URL + FIREBASE_KEY / credentials file (default)
+    "file"      local JSON-lines database at FIREBASE_FILE_PATH, for bench/offline runs
+    "memory"    in-process FakeDb
+
+The uploader's ``enqueue(path, payload)`` returns immediately.  A
+daemon thread batches queued readings into one multi-path
+``db.reference("/").update({...})`` per BATCH_MAX items / BATCH_S seconds.
+Every enqueued reading is first appended to a local JSON-lines write-ahead
+queue (QUEUE_PATH).  The file is append-only: once a batch has been accepted
+the byte offset just past it is written to ``<queue>.ack``, and only when
+everything is acknowledged (and the file has reached COMPACT_BYTES) is it
+truncated.  So readings survive network outages and restarts: failed
+batches are retried with exponential backoff, and on the next start
+``init()`` replays the file from the acknowledged offset.
+
+SeqAllocator hands out the numbered reading keys.  Resuming a test reads the
+last key with an ``order_by_key().limit_to_last(1)`` query (one child over the
+wire, not the whole ``readings`` node), or not at all when a local
+``*.fbseq.json`` next to the CSV already knows it.  That file is written once
+per SEQ_BLOCK readings and records a reserved upper bound (hi/lo), so a crash
+can leave a gap in the numbering but never reuses a key.
+
+FakeDb is an in-process stand-in for ``firebase_admin.db``; the file and
+memory backends are built on it.  ``SINK.use(backend, queue_path)`` switches
+the shared sink to another backend in place (the writers keep their
+reference to SINK), and ``with offline():`` runs simulations and offline
+replays against a MemoryBackend with no write-ahead queue.
+"""
+import json, os, threading, time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+QUEUE_PATH = os.getenv("FIREBASE_QUEUE_PATH", "firebase_queue.jsonl")
+COMPACT_BYTES = 1 << 20
+BATCH_MAX = 200
+BATCH_S = 1.0
+BACKOFF_MAX_S = 60.0
+INIT_BACKOFF_S = 5.0
+SEQ_BLOCK = 100
+FILE_PATH = os.getenv("FIREBASE_FILE_PATH", "firebase_local.jsonl")
+MAX_ERRORS = 3
+
+
+class Uploader:
+    def __init__(self, db_provider: Callable[[], Any], queue_path: Optional[str] = QUEUE_PATH,
+                 batch_max: int = BATCH_MAX, batch_s: float = BATCH_S):
+        self.db_provider = db_provider
+        self.queue_path = queue_path
+        self.batch_max = batch_max
+        self.batch_s = batch_s
+        self.status = "idle"
+        self.uploaded = 0
+        self.failures = 0
+        self.last_latency_s: Optional[float] = None    # round trip of the last accepted batch
+        self.last_delay_s: Optional[float] = None      # how long its oldest reading had been queued
+        self._pending: Deque[Tuple[str, Any, int]] = deque()   # (path, payload, queue-file offset past it)
+        self._queued_at: Deque[float] = deque()        # enqueue time of each _pending item
+        self._cv = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = False
+        self._wal_lock = threading.Lock()              # queue-file appends and truncation; never held with I/O to the db
+        self._wal = None
+        self._wal_end = 0
+        self._opened = False
+
+    # ----- write-ahead queue -----
+    @property
+    def ack_path(self) -> str:
+        return self.queue_path + ".ack"
+
+    def open(self):
+        """Load what the queue file still holds (first call only; SINK.init() calls this)."""
+        with self._wal_lock: self._open_locked()
+
+    def _open_locked(self):
+        if self._opened: return
+        self._opened = True
+        if not self.queue_path: return
+        self.queue_path = os.path.abspath(self.queue_path)
+        records = self._replay()
+        now = time.time()
+        with self._cv:
+            for rec in records:
+                self._pending.append(rec); self._queued_at.append(now)
+
+    def _read_ack(self) -> int:
+        try:
+            with open(self.ack_path, encoding="utf-8") as fh:
+                return int(fh.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _write_ack(self, offset: int):
+        tmp = self.ack_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            fh.write(str(offset))
+        os.replace(tmp, self.ack_path)
+
+    def _replay(self) -> List[Tuple[str, Any, int]]:
+        """Records past the acknowledged offset; a torn last line from a crash is cut off the file."""
+        out: List[Tuple[str, Any, int]] = []
+        try:
+            fh = open(self.queue_path, "rb")
+        except FileNotFoundError:
+            return out
+        with fh:
+            size = os.fstat(fh.fileno()).st_size
+            pos = self._read_ack()
+            if pos > size: pos = 0
+            fh.seek(pos)
+            for ln in fh:
+                if not ln.endswith(b"\n"): break
+                pos += len(ln)
+                try:
+                    rec = json.loads(ln); out.append((rec["p"], rec["v"], pos))
+                except (ValueError, KeyError):
+                    continue
+        if pos < size: os.truncate(self.queue_path, pos)
+        self._wal_end = pos
+        return out
+
+    def _acknowledge(self, offset: int):
+        """The records up to ``offset`` were accepted; truncate the file once all of it is."""
+        if not self.queue_path or not offset: return
+        try:
+            self._write_ack(offset)
+            if offset < COMPACT_BYTES: return
+            with self._wal_lock:
+                if self._wal_end != offset: return          # more was queued meanwhile
+                self._write_ack(0)      # before truncating: a crash in between only replays accepted records
+                if self._wal is not None: self._wal.close(); self._wal = None
+                os.truncate(self.queue_path, 0)
+                self._wal_end = 0
+        except OSError as e:
+            self.status = f"write-ahead queue error: {e}"      # the batch was accepted; the ack is retried with the next
+
+    # ----- public API -----
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def enqueue(self, path: str, payload: Any):
+        with self._wal_lock:
+            self._open_locked()
+            if self.queue_path:
+                if self._wal is None: self._wal = open(self.queue_path, "ab")
+                self._wal.write((json.dumps({"p": path, "v": payload}) + "\n").encode()); self._wal.flush()
+                self._wal_end = self._wal.tell()
+            with self._cv:
+                self._pending.append((path, payload, self._wal_end)); self._queued_at.append(time.time())
+                self._ensure_thread()
+                if len(self._pending) >= self.batch_max: self._cv.notify()
+
+    def start(self):
+        """Upload whatever is queued (e.g. replayed from the write-ahead queue) now."""
+        with self._cv:
+            if self._pending: self._ensure_thread(); self._cv.notify()
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Block until the queue is empty (or timeout); True if everything was uploaded."""
+        deadline = time.time() + timeout
+        with self._cv:
+            self._ensure_thread(); self._cv.notify()
+            while self._pending and time.time() < deadline:
+                self._cv.wait(0.05)
+            return not self._pending
+
+    def stop(self, timeout: float = 2.0):
+        with self._cv:
+            self._stop = True; self._cv.notify()
+        if self._thread: self._thread.join(timeout)
+        with self._wal_lock:
+            if self._wal is not None: self._wal.close(); self._wal = None
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop = False
+            self._thread = threading.Thread(target=self._run, name="firebase-uploader", daemon=True)
+            self._thread.start()
+
+    # ----- uploader thread -----
+    def _run(self):
+        backoff = 0.0
+        while True:
+            with self._cv:
+                if not self._stop:
+                    if backoff: self._cv.wait(backoff)
+                    elif len(self._pending) < self.batch_max: self._cv.wait(self.batch_s)
+                if not self._pending:
+                    if self._stop: return
+                    continue
+                batch = [self._pending[i] for i in range(min(self.batch_max, len(self._pending)))]
+
+            t0 = time.time()
+            try:
+                db = self.db_provider()
+            except ConnectionError as e:
+                backoff = min(BACKOFF_MAX_S, max(1.0, backoff * 2))
+                self.status = f"waiting for connection ({e})"
+                if self._stop: return
+                continue
+            try:
+                db.reference("/").update({p: v for p, v, _end in batch})
+            except Exception as e:
+                self.failures += 1
+                backoff = min(BACKOFF_MAX_S, max(1.0, backoff * 2))
+                self.status = f"retrying in {backoff:.0f}s ({e})"
+                if self._stop: return      # the write-ahead queue keeps the rest for next time
+                continue
+            backoff = 0.0
+            done = time.time()
+            self.last_latency_s = done - t0
+            self.uploaded += len(batch)
+            self.status = "online"
+            self._acknowledge(batch[-1][2])
+            with self._cv:
+                self.last_delay_s = done - self._queued_at[0]
+                for _ in batch: self._pending.popleft(); self._queued_at.popleft()
+                self._cv.notify_all()
+
+
+# ----- sequence numbers -----
+def seq_file_for(csv_path: str) -> str:
+    return os.path.splitext(csv_path)[0] + ".fbseq.json"
+
+
+def last_key(db, path: str) -> int:
+    """Largest integer child key under ``path`` (0 if none), fetching a single child."""
+    snap = db.reference(path).order_by_key().limit_to_last(1).get()
+    if isinstance(snap, dict):
+        keys = [int(k) for k in snap.keys() if str(k).isdigit()]
+        if keys: return max(keys)
+    elif isinstance(snap, list) and snap:    # the SDK returns a list for dense integer keys
+        return len(snap) - 1
+    return 0
+
+
+class SeqAllocator:
+    def __init__(self, block: int = SEQ_BLOCK):
+        self.block = block
+        self._next: Dict[str, int] = {}
+        self._reserved: Dict[str, int] = {}
+        self._files: Dict[str, str] = {}
+        self._local = set()
+
+    @staticmethod
+    def _load(seq_file: str) -> Dict[str, int]:
+        try:
+            with open(seq_file, encoding="utf-8") as fh:
+                return {k: int(v) for k, v in json.load(fh).items()}
+        except (OSError, ValueError, AttributeError):
+            return {}
+
+    def _save(self, seq_file: str):
+        data = self._load(seq_file)
+        data.update({p: self._reserved[p] for p, f in self._files.items() if f == seq_file and p in self._reserved})
+        tmp = seq_file + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(data, fh)
+        os.replace(tmp, seq_file)
+
+    def prime(self, path: str, seq_file: Optional[str] = None):
+        """Next key for ``path`` from the local file, else 1 until prime_remote() knows better."""
+        if seq_file: self._files[path] = seq_file
+        local = self._load(seq_file).get(path) if seq_file else None
+        self._next[path] = local or 1
+        self._reserved[path] = self._next[path]
+        if local: self._local.add(path)
+        else: self._local.discard(path)
+
+    def prime_remote(self, path: str, db):
+        if path in self._local: return
+        self._next[path] = max(self._next.get(path, 1), last_key(db, path) + 1)
+        self._reserved[path] = self._next[path]
+
+    def next(self, path: str) -> int:
+        n = self._next.get(path, 1)
+        self._next[path] = n + 1
+        if n >= self._reserved.get(path, 0):
+            self._reserved[path] = n + self.block
+            seq_file = self._files.get(path)
+            if seq_file:
+                try: self._save(seq_file)
+                except OSError: pass
+        return n
+
+
+# ----- in-process stand-in for firebase_admin.db -----
+class FakeDb:
+    """Nested-dict database with the subset of the firebase_admin.db API we use."""
+    def __init__(self):
+        self.data: Dict[str, Any] = {}
+        self.fail_next = 0      # raise on the next N calls, to simulate an outage
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def reference(self, path: str = "/") -> "_FakeRef":
+        return _FakeRef(self, [p for p in path.split("/") if p])
+
+    def _check(self):
+        self.calls += 1
+        if self.fail_next > 0:
+            self.fail_next -= 1
+            raise ConnectionError("FakeDb: simulated outage")
+
+    def _apply(self, parts: List[str], value):
+        if not parts:
+            self.data = json.loads(json.dumps(value)); return
+        node = self.data
+        for p in parts[:-1]:
+            if not isinstance(node.get(p), dict): node[p] = {}
+            node = node[p]
+        node[parts[-1]] = json.loads(json.dumps(value))
+
+    def _log(self, parts: List[str], value):
+        pass
+
+
+class _FakeRef:
+    def __init__(self, db: FakeDb, parts: List[str], limit_last: Optional[int] = None):
+        self._db = db; self._parts = parts; self._limit_last = limit_last
+
+    def _node(self):
+        node = self._db.data
+        for p in self._parts:
+            if not isinstance(node, dict) or p not in node: return None
+            node = node[p]
+        return node
+
+    def get(self, shallow: bool = False):
+        with self._db._lock:
+            self._db._check()
+            node = self._node()
+            if not isinstance(node, dict):
+                return node
+            keys = sorted(node.keys(), key=lambda k: (not str(k).isdigit(), int(k) if str(k).isdigit() else 0, str(k)))
+            if self._limit_last is not None:
+                keys = keys[-self._limit_last:] if self._limit_last else []
+            if shallow:
+                return {k: True for k in keys}
+            return json.loads(json.dumps({k: node[k] for k in keys}))
+
+    def set(self, value):
+        with self._db._lock:
+            self._db._check()
+            self._set(self._parts, value)
+
+    def update(self, values: Dict[str, Any]):
+        with self._db._lock:
+            self._db._check()
+            for rel, v in values.items():
+                self._set(self._parts + [p for p in rel.split("/") if p], v)
+
+    def _set(self, parts: List[str], value):
+        self._db._apply(parts, value)
+        self._db._log(parts, value)
+
+    def order_by_key(self) -> "_FakeRef":
+        return self
+
+    def limit_to_last(self, n: int) -> "_FakeRef":
+        return _FakeRef(self._db, self._parts, n)
+
+
+class _FileDb(FakeDb):
+    """FakeDb that appends every write to a JSON-lines file and replays it on open."""
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as fh:
+                for ln in fh:
+                    try:
+                        rec = json.loads(ln); self._apply([p for p in rec["p"].split("/") if p], rec["v"])
+                    except (ValueError, KeyError):
+                        continue
+        self._fh = open(path, "a", encoding="utf-8")
+
+    def _log(self, parts: List[str], value):
+        self._fh.write(json.dumps({"p": "/".join(parts), "v": value}) + "\n"); self._fh.flush()
+
+
+# ----- backends -----
+class BackendUnavailable(Exception):
+    """The backend is not configured (yet); init() reports it and retries after the backoff."""
+
+
+class FirebaseBackend:
+    name = "firebase"
+
+    def connect(self):
+        import firebase_admin
+        from firebase_admin import credentials, db
+        if getattr(firebase_admin, "_apps", None):
+            return db
+
+        db_url = os.getenv("DATABASE_URL") or os.getenv("databaseURL")
+        if not db_url:
+            raise BackendUnavailable("DATABASE_URL missing")
+
+        key_env = os.getenv("FIREBASE_KEY")
+        if key_env:
+            svc = json.loads(key_env)
+            if isinstance(svc.get("private_key"), str):
+                svc["private_key"] = svc["private_key"].replace("\\n", "\n")
+            cred = credentials.Certificate(svc)
+        else:
+            path = (
+                os.getenv("FIREBASE_CREDENTIALS_PATH")
+                or os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+                or "serviceAccountKey.json"
+            )
+            cred = credentials.Certificate(path)
+
+        firebase_admin.initialize_app(cred, {"databaseURL": db_url})
+        return db
+
+
+class FileBackend:
+    name = "file"
+
+    def __init__(self, path: str = FILE_PATH):
+        self.path = path
+
+    def connect(self):
+        return _FileDb(self.path)
+
+
+class MemoryBackend:
+    name = "memory"
+
+    def __init__(self, db: Optional[FakeDb] = None):
+        self.db = db or FakeDb()
+
+    def connect(self):
+        return self.db
+
+
+BACKENDS = {"firebase": FirebaseBackend, "file": FileBackend, "memory": MemoryBackend}
+
+
+def make_backend(name: Optional[str] = None):
+    name = name or os.getenv("FIREBASE_BACKEND", "firebase")
+    try:
+        return BACKENDS[name.lower()]()
+    except KeyError:
+        raise ValueError(f"unknown FIREBASE_BACKEND: {name}") from None
+
+
+# ----- the shared sink -----
+def seq_path(stage: str, substance: str, test_id: str, fb_board: str) -> str:
+    return f"{stage}/{substance}/{test_id}/{fb_board}/readings"
+
+
+class FirebaseSink:
+    def __init__(self, backend=None, queue_path: Optional[str] = QUEUE_PATH, max_errors: int = MAX_ERRORS):
+        self.backend = backend              # None: make_backend() on the first init()
+        self.ready = False
+        self.disabled_reason: Optional[str] = None
+        self._db = None
+        self._retry_at = 0.0
+        self._backoff = 0.0
+        self._errors = 0
+        self._max_errors = max_errors
+        self._lock = threading.Lock()       # connection + sequence allocation
+        self._seq = SeqAllocator()          # "<stage>/<sub>/<test>/<board>/readings" -> next int
+        self.uploader = Uploader(self._connected_db, queue_path)
+
+    def _connected_db(self):
+        """The db for the uploader; offline, retries init() once its backoff has passed."""
+        if self._db is None and not self.init():
+            raise ConnectionError(self.disabled_reason or "not connected")
+        return self._db
+
+    def disable(self, reason: str):
+        """Go offline; the next init() after the backoff tries to connect again."""
+        self.ready = False
+        self.disabled_reason = reason
+        self._backoff = min(BACKOFF_MAX_S, self._backoff * 2 or INIT_BACKOFF_S)
+        self._retry_at = time.monotonic() + self._backoff
+
+    def init(self) -> bool:
+        """Connect unless connected or still backing off from the last failure."""
+        with self._lock:
+            if self.ready or time.monotonic() < self._retry_at:
+                return self.ready
+            try:
+                if self.backend is None:
+                    self.backend = make_backend()
+                self._db = self.backend.connect()
+                self.ready = True
+                self.disabled_reason = None
+                self._errors = 0
+                self._backoff = 0.0
+            except BackendUnavailable as e:
+                self.disable(str(e))
+            except Exception as e:
+                self.disable(f"init error: {e}")
+        if self.ready:
+            self.uploader.open()
+            self.uploader.start()
+        return self.ready
+
+    def use(self, backend, queue_path: Optional[str] = None):
+        """Disconnect and switch to ``backend`` (None: FIREBASE_BACKEND at the next init) with a fresh uploader."""
+        self.uploader.stop()        # first: its last batches go to the backend they were queued for
+        with self._lock:
+            self.backend = backend
+            self.ready = False
+            self.disabled_reason = None
+            self._db = None
+            self._errors = 0
+            self._retry_at = self._backoff = 0.0
+            self._seq = SeqAllocator()
+            self.uploader = Uploader(self._connected_db, queue_path)
+
+    def status_text(self) -> str:
+        return "online" if self.ready else f"offline: {self.disabled_reason or 'not initialised'}"
+
+    def _with_db(self, fn) -> bool:
+        """Run a db op, returning True on success; on repeated failures go offline."""
+        if not self.ready:
+            return False
+        try:
+            fn(self._db)
+            return True
+        except Exception as e:
+            self._errors += 1
+            if self._errors >= self._max_errors:
+                self.disable(f"write error: {e}")
+            return False
+
+    def load_seq(self, stage: str, substance: str, test_id: str, seq_files: Dict[str, Optional[str]]):
+        """Prime the counters of ``{fb_board: seq_file}`` (local file first, then one remote query)."""
+        paths = {b: seq_path(stage, substance, test_id, b) for b in seq_files}
+        with self._lock:
+            for b, path in paths.items():
+                self._seq.prime(path, seq_files[b])
+            self._with_db(lambda db: [self._seq.prime_remote(p, db) for p in paths.values()])
+
+    def put_reading(self, stage: str, substance: str, test_id: str, fb_board: str,
+                    ts_epoch: float, readings: Dict[str, float], extra: Optional[Dict[str, Any]] = None):
+        path = seq_path(stage, substance, test_id, fb_board)
+        with self._lock:
+            n = self._seq.next(path)
+        payload = {"timestamp": datetime.fromtimestamp(ts_epoch).strftime("%H-%M-%S %d-%m-%Y"),
+                   "readings": readings}
+        if extra: payload.update(extra)
+        self.uploader.enqueue(f"{path}/{n}", payload)
+
+
+SINK = FirebaseSink()
+
+
+@contextmanager
+def offline(sink: Optional[FirebaseSink] = None):
+    """Run with an in-memory backend and no write-ahead queue, then restore the previous backend."""
+    sink = sink or SINK
+    saved = sink.backend, sink.uploader.queue_path
+    sink.use(MemoryBackend(), None)
+    try:
+        yield sink.backend.db
+    finally:
+        sink.use(*saved)
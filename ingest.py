@@ -0,0 +1,309 @@
+#ingest.py
+"""
+One ingestion thread for every open serial port (B, LB and live preview).
+
+Ports are opened non-blocking (timeout=0) and drained in bulk with
+``in_waiting``; complete lines are split here and handed, still as bytes, to
+the registered ``on_line(raw_line, arrival_epoch)`` callback on the engine
+thread (see block_parser.clean_line).  Ports that
+expose a selectable fd (POSIX) are multiplexed with ``selectors``; handles
+without one (Windows COM ports) are polled every POLL_INTERVAL.
+
+With SERIAL_RECORD_DIR set every chunk read is also written, with its arrival
+time, to a capture file; a ``replay:<file>`` port plays one back through the
+same callbacks, on the engine thread, with the recorded times (see capture.py).  ``port`` may also be an already open
+serial-like object such as fakeboard.FakeSource; the engine calls its
+``start()``, if any, once the port is registered.
+
+A read that fails with SerialException / OSError (a USB glitch, a board
+reset) does not end the capture: the port reports "error read: ...
+(retrying in N s)", is closed and reopened after a backoff that doubles
+from REOPEN_S up to REOPEN_MAX_S and resets once data flows again.  A port
+object passed in is read again instead of reopened.  Other errors, and any
+error on a replay, close the port.
+"""
+import io, selectors, threading, time
+from typing import Any, Callable, Dict, List, Optional, Union
+
+import serial
+
+import capture
+import metrics
+
+READ_CHUNK = 4096
+SELECT_TIMEOUT = 0.1   # upper bound on add/remove latency, independent of serial timeouts
+POLL_INTERVAL = 0.02   # for handles select() cannot watch
+REOPEN_S = 0.5         # first wait before reopening a port after a read error
+REOPEN_MAX_S = 10.0
+
+LineHandler = Callable[[bytes, float], None]
+StatusHandler = Callable[[str], None]
+
+
+class _Port:
+    def __init__(self, key: str, port: Union[str, Any], baud: int, on_line: LineHandler,
+                 on_status: Optional[StatusHandler], on_close: Optional[Callable[[], None]]):
+        self.key = key; self.port = port; self.baud = baud
+        self.on_line = on_line; self.on_status = on_status; self.on_close = on_close
+        self.ser: Optional[serial.Serial] = None
+        self.recorder: Optional[capture.Recorder] = None
+        self.counters = metrics.board(key)
+        self.buf = bytearray()
+        self.buf_t = 0.0                  # arrival of the chunk that last extended buf
+        self.selectable = False
+        self.timed = False                # chunks come with their own times (read_timed, a replay)
+        self.retry_at: Optional[float] = None   # set while waiting to reopen after a read error
+        self.backoff = 0.0
+        self.closed = threading.Event()
+
+    def status(self, msg: str):
+        if self.on_status:
+            try: self.on_status(msg)
+            except Exception: pass
+
+
+class IngestEngine:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ports: Dict[str, _Port] = {}
+        self._to_open: List[_Port] = []
+        self._to_close: List[str] = []
+        self._handles: Dict[str, _Port] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._sel: Optional[selectors.BaseSelector] = None
+
+    # ----- public API (any thread) -----
+    def add(self, key: str, port: Union[str, Any], baud: int, on_line: LineHandler,
+            on_status: Optional[StatusHandler] = None, on_close: Optional[Callable[[], None]] = None):
+        p = _Port(key, port, baud, on_line, on_status, on_close)
+        p.status("starting")
+        with self._lock:
+            self._to_open.append(p)
+            self._handles[key] = p
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="serial-ingest", daemon=True)
+                self._thread.start()
+
+    def remove(self, key: str):
+        with self._lock:
+            self._to_close.append(key)
+
+    def wait_closed(self, key: str, timeout: float = 2.0) -> bool:
+        with self._lock:
+            p = self._handles.get(key)
+        if p is None or threading.current_thread() is self._thread:
+            return True
+        return p.closed.wait(timeout)
+
+    def keys(self) -> List[str]:
+        with self._lock:
+            return list(self._ports.keys())
+
+    # ----- engine thread -----
+    def _run(self):
+        sel = self._sel = selectors.DefaultSelector()
+        try:
+            while True:
+                self._apply_pending()
+                with self._lock:
+                    if not self._ports and not self._to_open and not self._to_close:
+                        self._thread = None
+                        return
+                self._reopen_due()
+                for p in self._ready():
+                    self._drain(p)
+        finally:
+            try: sel.close()
+            except Exception: pass
+
+    def _apply_pending(self):
+        with self._lock:
+            opening, self._to_open = self._to_open, []
+            closing, self._to_close = self._to_close, []
+        for p in opening:
+            old = self._ports.get(p.key)
+            if old: self._close(old)
+            self._open(p)
+        for key in closing:
+            p = self._ports.get(key)
+            if p: self._close(p)
+            else:
+                with self._lock: q = self._handles.get(key)
+                if q and q.ser is None: self._forget(q); q.closed.set()
+
+    def _open(self, p: _Port):
+        try:
+            if not isinstance(p.port, str):
+                p.ser = p.port
+            elif capture.is_replay(p.port):
+                p.ser = capture.open_port(p.port)
+            else:
+                p.ser = serial.Serial(p.port, p.baud, timeout=0)
+                p.recorder = capture.recorder_for(p.key, p.port, p.baud)
+        except Exception as e:
+            p.status(f"error open: {e}")
+            self._forget(p)
+            p.closed.set()
+            return
+        p.timed = hasattr(p.ser, "read_timed")
+        self._register(p)
+        self._ports[p.key] = p
+        p.status("listening")
+        start = getattr(p.ser, "start", None)
+        if start: start()
+
+    def _register(self, p: _Port):
+        try:
+            self._sel.register(p.ser.fileno(), selectors.EVENT_READ, p)
+            p.selectable = True
+        except (AttributeError, ValueError, OSError, io.UnsupportedOperation):
+            p.selectable = False
+
+    def _read_failed(self, p: _Port, e: Exception):
+        """Close a replay or on an unexpected error; otherwise retry after a backoff."""
+        if p.timed or not isinstance(e, (serial.SerialException, OSError)):
+            self._close(p, f"error read: {e}"); return
+        if p.selectable:
+            try: self._sel.unregister(p.ser.fileno())
+            except Exception: pass
+            p.selectable = False
+        if isinstance(p.port, str):
+            try: p.ser.close()
+            except Exception: pass
+            p.ser = None
+        p.buf.clear()                     # a line cut by the error would parse as garbage
+        p.backoff = min(REOPEN_MAX_S, p.backoff * 2 or REOPEN_S)
+        p.retry_at = time.monotonic() + p.backoff
+        p.status(f"error read: {e} (retrying in {p.backoff:g} s)")
+
+    def _reopen_due(self):
+        now = time.monotonic()
+        for p in [p for p in self._ports.values() if p.retry_at is not None and p.retry_at <= now]:
+            if p.ser is None:
+                try:
+                    p.ser = serial.Serial(p.port, p.baud, timeout=0)
+                except Exception as e:
+                    p.backoff = min(REOPEN_MAX_S, p.backoff * 2)
+                    p.retry_at = now + p.backoff
+                    p.status(f"error open: {e} (retrying in {p.backoff:g} s)"); continue
+            p.retry_at = None
+            self._register(p)
+            p.status("listening")
+
+    def _close(self, p: _Port, reason: Optional[str] = None):
+        self._ports.pop(p.key, None)
+        if p.selectable:
+            try: self._sel.unregister(p.ser.fileno())
+            except Exception: pass
+        try:
+            if p.ser: p.ser.close()
+        except Exception:
+            pass
+        if p.recorder:
+            p.recorder.close(); p.recorder = None
+        if p.buf:
+            self._dispatch(p, [bytes(p.buf)], p.buf_t or time.time()); p.buf.clear()
+        if reason: p.status(reason)
+        if p.on_close:
+            try: p.on_close()
+            except Exception as e: p.status(f"error close: {e}")
+        self._forget(p)
+        p.closed.set()
+
+    def _forget(self, p: _Port):
+        """Drop the handle of a port that is done, unless ``add`` has already replaced it."""
+        with self._lock:
+            if self._handles.get(p.key) is p: del self._handles[p.key]
+
+    def _ready(self) -> List[_Port]:
+        polled = [p for p in self._ports.values() if not p.selectable and p.retry_at is None]
+        if any(p.selectable for p in self._ports.values()):
+            events = self._sel.select(POLL_INTERVAL if polled else SELECT_TIMEOUT)
+            ready = [key.data for key, _ in events]
+        else:
+            time.sleep(POLL_INTERVAL if polled else SELECT_TIMEOUT)
+            ready = []
+        for p in polled:
+            try:
+                if p.timed or p.ser.in_waiting: ready.append(p)
+            except Exception as e:
+                self._read_failed(p, e)
+        return ready
+
+    def _drain(self, p: _Port):
+        if p.key not in self._ports or p.retry_at is not None: return
+        if p.timed:
+            self._drain_timed(p); return
+        try:
+            waiting = p.ser.in_waiting
+            chunk = p.ser.read(waiting or READ_CHUNK)
+        except Exception as e:
+            self._read_failed(p, e); return
+        if not chunk: return
+        p.backoff = 0.0
+        c = p.counters
+        c.bytes_read += len(chunk)
+        if waiting > c.serial_buffer_hwm: c.serial_buffer_hwm = waiting
+        now = time.time()
+        if p.recorder:
+            try: p.recorder.write(now, chunk)
+            except (OSError, ValueError) as e:
+                p.status(f"recording stopped: {e}"); p.recorder.close(); p.recorder = None
+        self._feed(p, chunk, now)
+
+    def _drain_timed(self, p: _Port):
+        """Chunks that carry their own arrival times; None from read_timed means the source is done."""
+        try:
+            chunks = p.ser.read_timed()
+        except Exception as e:
+            self._close(p, f"error read: {e}"); return
+        if chunks is None:
+            self._close(p, "replay finished"); return
+        for t, chunk in chunks:
+            p.counters.bytes_read += len(chunk)
+            self._feed(p, chunk, t)
+
+    def _feed(self, p: _Port, chunk: bytes, t: float):
+        p.buf += chunk; p.buf_t = t
+        if b"\n" not in chunk: return
+        *lines, rest = p.buf.split(b"\n")
+        p.buf = bytearray(rest)
+        self._dispatch(p, lines, t)
+
+    def _dispatch(self, p: _Port, lines: List[bytes], now: float):
+        for raw in lines:
+            try:
+                p.on_line(raw, now)
+            except Exception as e:
+                p.status(f"error handler: {e}")
+
+
+class Decimator:
+    """
+    Down-sampling stage between a block framer and its consumer.
+
+    Readers drain continuously and offer every complete block with its arrival
+    time; the first block in each ``interval_s`` slot of a fixed grid is kept.
+    The grid (rather than "interval since last emit") keeps the output rate at
+    1/interval even when the board period jitters around the interval.
+    """
+    def __init__(self, interval_s: float):
+        self.interval_s = max(0.0, float(interval_s or 0.0))
+        self._t0: Optional[float] = None
+        self._last_slot = -1
+        self.kept = 0
+        self.dropped = 0
+
+    def offer(self, t: float) -> bool:
+        if self.interval_s <= 0:
+            self.kept += 1; return True
+        if self._t0 is None: self._t0 = t
+        slot = int((t - self._t0) // self.interval_s)
+        if slot <= self._last_slot:
+            self.dropped += 1; return False
+        self._last_slot = slot
+        self.kept += 1
+        return True
+
+
+ENGINE = IngestEngine()
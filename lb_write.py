@@ -1,122 +1,24 @@
 #lb_write.py
-import os, re, time, csv, threading, json
+import time, queue, threading
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple
 
-import serial
+import boardstate
+import catalog
+import colstore
+import firebase_sink
+import ingest
+import merge
+import metrics
+import partition
+from block_parser import BAT_RE, clean_line, is_new_data, is_rule, parse_block
+from csv_sink import CsvSink
 
-class _FirebaseGate:
-    def __init__(self):
-        self.ready = False
-        self.disabled_reason = None
-        self._seq_cache: Dict[str, int] = {}  # "<stage>/<sub>/<test>/<L?>/readings"
-        self._errors = 0
-        self._max_errors = 3
-
-    def disable(self, reason: str):
-        self.ready = False
-        self.disabled_reason = reason
-
-    def init(self):
-        if self.ready or self.disabled_reason:
-            return
-        try:
-            import firebase_admin  
-            from firebase_admin import credentials  
-            if getattr(firebase_admin, "_apps", None):
-                self.ready = True
-                return
-
-            db_url = os.getenv("DATABASE_URL") or os.getenv("databaseURL")
-            if not db_url:
-                self.disable("DATABASE_URL missing")
-                return
-
-            key_env = os.getenv("FIREBASE_KEY")
-            if key_env:
-                svc = json.loads(key_env)
-                if isinstance(svc.get("private_key"), str):
-                    svc["private_key"] = svc["private_key"].replace("\\n", "\n")
-                cred = credentials.Certificate(svc)
-            else:
-                path = (
-                    os.getenv("FIREBASE_CREDENTIALS_PATH")
-                    or os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
-                    or "serviceAccountKey.json"
-                )
-                cred = credentials.Certificate(path)
-
-            firebase_admin.initialize_app(cred, {"databaseURL": db_url})
-            self.ready = True
-        except Exception as e:
-            self.disable(f"init error: {e}")
-
-    def _with_db(self, fn) -> bool:
-        if not self.ready or self.disabled_reason:
-            return False
-        try:
-            from firebase_admin import db  
-            fn(db)
-            return True
-        except Exception as e:
-            self._errors += 1
-            if self._errors >= self._max_errors:
-                self.disable(f"write error: {e}")
-            return False
-
-    def _seq_path(self, stage:str, sub:str, test_id:str, board:str)->str:
-        fb_board = "L1" if board.upper()=="LB1" else "L2"
-        return f"{stage}/{sub}/{test_id}/{fb_board}/readings"
-
-    def load_seq_if_needed(self, stage: str, substance: str, test_id: str, boards: List[str]):
-        if not self.ready or self.disabled_reason:
-            for b in boards:
-                self._seq_cache[self._seq_path(stage, substance, test_id, b)] = 1
-            return
-
-        def _op(db):
-            base = f"{stage}/{substance}/{test_id}"
-            for b in boards:
-                fb_board = "L1" if b.upper()=="LB1" else "L2"
-                path = f"{base}/{fb_board}/readings"
-                snap = db.reference(path).get()
-                if isinstance(snap, dict) and snap:
-                    try:
-                        mx = max(int(k) for k in snap.keys() if str(k).isdigit())
-                    except ValueError:
-                        mx = 0
-                else:
-                    mx = 0
-                self._seq_cache[path] = mx + 1
-
-        self._with_db(_op)
-
-    def put_reading(self, stage: str, substance: str, test_id: str,
-                    board_id: str, ts_epoch: float, readings: Dict[str, float],
-                    batt_pct: Optional[float], batt_v: Optional[float]):
-        path = self._seq_path(stage, substance, test_id, board_id)
-        n = self._seq_cache.get(path, 1)
-        ts_label = datetime.fromtimestamp(ts_epoch).strftime("%H-%M-%S %d-%m-%Y")
-        payload = {"timestamp": ts_label, "readings": readings}
-        if batt_pct is not None or batt_v is not None:
-            payload["battery"] = {
-                "percent": None if batt_pct is None else float(batt_pct),
-                "volts": None if batt_v is None else float(batt_v),
-            }
-
-        def _op(db):
-            db.reference(f"{path}/{n}").set(payload)
-
-        ok = self._with_db(_op)
-        if ok or not self.ready or self.disabled_reason:
-            self._seq_cache[path] = n + 1
-
-_FB = _FirebaseGate()
+_FB = firebase_sink.SINK   # shared with b_write/realtime
 
 # ===== Config / naming =====
 PREFIX_MAP = {"Testing": "T", "Experiment": "E", "Deployment": "D", "Baseline": "B"}
 BAUD_LIBELIUM = 115200
-SER_TIMEOUT = 1.0
 
 EXPECTED_SENSORS: Dict[str, List[str]] = {
     "LB1": ["SO2", "NO2", "H2S", "CH4"],
@@ -124,197 +26,294 @@ EXPECTED_SENSORS: Dict[str, List[str]] = {
 }
 DEFAULT_UNIT = {"O2": "%"}  
 
+def _fb_board(board_id: str) -> str:
+    return "L1" if board_id.upper() == "LB1" else "L2"
+
 # ===== Public state =====
-STATE = {
-    "active": False,
-    "stage": None,
-    "substance": None,
-    "test_id": None,
-    "flowrate": None,
-    "interval": 1.0,
-    "duration_sec": None,
-    "folder": None,
-    "per_board_status": {},  
-}
+# per-board status, battery, latest block and CSV path, plus "Firebase"/"Columnar" status, and
+# the capture parameters and test folder in BOARDS.run; see boardstate
+BOARDS = boardstate.BoardStates()
 
-_LOCK = threading.Lock()
-_THREADS: Dict[str, "LBSerialReader"] = {}
+_READERS: Dict[str, "LBSerialReader"] = {}
 _STOP_EVENT = threading.Event()
-
-_LAST_BATT: Dict[str, Tuple[Optional[float], Optional[float]]] = {}
-_CUM_PATHS: Dict[str, str] = {}
-_CUM_HEADERS: Dict[str, List[str]] = {}
-
-NEW_DATA_RE = re.compile(r"^\s*new\s*data\s*$", re.IGNORECASE)
-PAIR_RE = re.compile(r"^\s*([A-Za-z0-9µμ°/%\-\s\(\)\.\[\]]+?)\s*:\s*([\-+]?[0-9]*\.?\d+)\s*([A-Za-z°%/\.]+)?\s*$")
-BAT_RE  = re.compile(r"Battery\s+Level\s*:\s*(\d+)\s*%\s*\|\s*Battery\s*\(Volts\)\s*:\s*([\-+]?[0-9]*\.?\d+)")
+_WRITER: Optional["LBWriter"] = None
+IDLE_FLUSH_CHECK_S = 0.5
+ROW_QUEUE_SIZE = 256
+OVERLOAD_WAIT_S = 0.5       # a reader waits this long on a full queue before a row is dropped
+DRAIN_TIMEOUT_S = 10.0      # stop_capture: longest wait for the writer to empty the queue
+_EOS = ("", 0.0, None, None, None, None)      # end of stream: the writer drains up to here, then closes
+_ROW_QUEUE: "queue.Queue[tuple]" = queue.Queue(maxsize=ROW_QUEUE_SIZE)
+metrics.gauge("enose_lb_writer_queue_depth", "Rows waiting for the LB CSV writer.", _ROW_QUEUE.qsize)
 
 def _fmt(v): return round(v,3) if isinstance(v,float) else v
-def _canon_unit(g: str, u: Optional[str])->str: return ("°C" if u=="C" else (u or DEFAULT_UNIT.get(g.upper(),"ppm")))
-def _clean_ascii(s: str)->str: return re.sub(r"[^\x20-\x7E\n\r\t]","",s)
-
-def _make_paths(stage:str, substance:str, board_id:str):
-    folder = os.path.join("Baseline","baseline") if stage=="Baseline" else os.path.join(stage, substance)
-    os.makedirs(folder, exist_ok=True)
-    return folder, os.path.join(folder, f"{('baseline' if stage=='Baseline' else substance)}_{board_id}_Readings.csv")
+def _canon_unit(g: str, u: Optional[str])->str: return u or DEFAULT_UNIT.get(g.upper(),"ppm")
 
 def _row_base(ts: str, flow: float)->Dict[str, Optional[float]]:
     return {"Timestamp": ts, "Flowrate (L/min)": _fmt(flow)}
 
-class LBSerialReader(threading.Thread):
-    daemon = True
+class LBSerialReader:
+    """Block framer for one Libelium board; lines arrive from the shared ingest engine."""
     def __init__(self, board_id: str, port: str, interval_s: float):
-        super().__init__(name=f"{board_id}-LB-reader")
         self.board_id = board_id; self.port = port; self.interval_s = interval_s
-        self.stop_flag = threading.Event(); self.ser: Optional[serial.Serial] = None
-        self._buffer: List[str] = []; self._in_block = False
+        self.key = f"LB:{board_id}"
+        self._buffer: List[str] = []; self._in_block = False; self._block_t = 0.0
+        self.decimator = ingest.Decimator(interval_s)
+        self.counters = metrics.board(self.key)
 
-    def stop(self): self.stop_flag.set()
+    def start(self):
+        ingest.ENGINE.add(self.key, self.port, BAUD_LIBELIUM, self.feed_line,
+                          self._on_status, self._on_close)
 
-    def run(self):
-        STATE["per_board_status"][self.board_id] = "starting"
-        try:
-            self.ser = serial.Serial(self.port, BAUD_LIBELIUM, timeout=SER_TIMEOUT)
-            time.sleep(0.6); STATE["per_board_status"][self.board_id] = "listening"
-        except Exception as e:
-            STATE["per_board_status"][self.board_id] = f"error open: {e}"; return
+    def stop(self): ingest.ENGINE.remove(self.key)
+
+    def join(self, timeout: Optional[float] = None): ingest.ENGINE.wait_closed(self.key, timeout or 2.0)
+
+    def _on_status(self, status: str):
+        BOARDS.publish(self.board_id, status=status)
+
+    def _on_close(self):
+        if self._buffer: self._offer_block(self._buffer, self._block_t); self._buffer = []
 
-        while not self.stop_flag.is_set() and not _STOP_EVENT.is_set():
+    def feed_line(self, raw: bytes, arrived: float):
+        line = clean_line(raw)
+        if not line: return
+        self.counters.lines_parsed += 1
+
+        mb = BAT_RE.search(line)
+        if mb:
             try:
-                raw = self.ser.readline().decode(errors="ignore")
-            except Exception:
-                time.sleep(0.2); continue
-
-            line = _clean_ascii(raw).strip()
-            if not line: continue
-
-            mb = BAT_RE.search(line)
-            if mb:
-                try:
-                    pct = float(mb.group(1)); v = float(mb.group(2))
-                    with _LOCK: _LAST_BATT[self.board_id] = (pct, v)
-                except ValueError: pass
-                continue
-
-            if NEW_DATA_RE.match(line):
-                if self._buffer:
-                    self._emit_block(self._buffer); self._buffer=[]
-                    time.sleep(self.interval_s)
-                self._in_block = True; STATE["per_board_status"][self.board_id] = "capturing"; continue
-
-            if self._in_block:
-                self._buffer.append(line)
+                BOARDS.publish(self.board_id, battery=(float(mb.group(1)), float(mb.group(2))))
+            except ValueError: pass
+            return
 
-        try:
-            if self.ser: self.ser.close()
-        except Exception: pass
-        if self._buffer: self._emit_block(self._buffer)
-
-    def _ensure_writer_ready(self, header_cols: List[str]):
-        if self.board_id in _CUM_HEADERS: return
-        folder, cum_csv = _make_paths(STATE["stage"], STATE["substance"], self.board_id)
-        _CUM_PATHS[self.board_id] = cum_csv
-        need_header = (not os.path.exists(cum_csv)) or os.path.getsize(cum_csv)==0
-        if need_header:
-            with open(cum_csv,"a",newline="",encoding="utf-8") as fh:
-                csv.DictWriter(fh, fieldnames=header_cols).writeheader()
-        _CUM_HEADERS[self.board_id] = header_cols
-
-    def _emit_block(self, lines: List[str]):
+        if is_rule(line) or is_new_data(line):
+            if self._buffer:
+                self._offer_block(self._buffer, self._block_t); self._buffer = []
+            self._in_block = True; self._block_t = arrived
+            rec = BOARDS.get(self.board_id)
+            if rec is None or rec.status != "capturing": BOARDS.publish(self.board_id, status="capturing")
+            return
+
+        if self._in_block:
+            self._buffer.append(line)
+
+    def _offer_block(self, lines: List[str], captured_at: float):
         gases: Dict[str, Tuple[float,str]] = {}
-        for ln in lines:
-            m = PAIR_RE.match(ln)
-            if not m: continue
-            label, num, unit = m.group(1).strip(), m.group(2), (m.group(3) or "").strip()
-            try: val = float(num)
-            except ValueError: continue
-            gas = label.upper(); unit_final = _canon_unit(gas, unit)
-            gases[gas] = (val, unit_final)
-
-        if not gases and self.board_id not in _LAST_BATT: return
-
-        ts_epoch = time.time()
+        readings = parse_block(lines)
+        self.counters.parse_failures += sum(1 for ln in lines if ":" in ln) - len(readings)
+        for label, val, unit in readings:
+            gas = label.upper()
+            gases[gas] = (val, _canon_unit(gas, unit))
+
+        # parsed first: a block with nothing to write must not take the decimation slot of the next one
+        rec = BOARDS.get(self.board_id)
+        if not gases and (rec is None or rec.battery is None): return
+        if self.decimator.offer(captured_at): self._emit_block(gases, captured_at, rec)
+
+    def _emit_block(self, gases: Dict[str, Tuple[float,str]], captured_at: float,
+                    rec: Optional[boardstate.BoardRecord]):
+        self.counters.blocks_emitted += 1
+
+        ts_epoch = captured_at
         ts_str = datetime.fromtimestamp(ts_epoch).strftime("%Y-%m-%d %H:%M:%S")
 
-        row = _row_base(ts_str, float(STATE["flowrate"]))
-        with _LOCK: pct, volts = _LAST_BATT.get(self.board_id, (None, None))
+        row = _row_base(ts_str, float(BOARDS.run.flowrate))
+        pct, volts = (rec.battery if rec is not None and rec.battery else (None, None))
         row[f"{self.board_id} - Battery (%)"] = _fmt(pct) if pct is not None else None
         row[f"{self.board_id} - Battery (V)"] = _fmt(volts) if volts is not None else None
 
         readings_fb: Dict[str,float] = {}
         for gas,(val,unit) in gases.items():
-            col = f"{self.board_id} - {gas} ({unit})"
-            row[col] = _fmt(val); readings_fb[f"{gas} ({unit})"] = _fmt(val)
+            row[_gas_col(self.board_id, gas, unit)] = _fmt(val); readings_fb[f"{gas} ({unit})"] = _fmt(val)
+
+        battery = None
+        if pct is not None or volts is not None:
+            battery = {"battery": {"percent": None if pct is None else float(pct),
+                                   "volts": None if volts is None else float(volts)}}
+        BOARDS.publish(self.board_id, status="capturing", block=gases, block_t=ts_epoch)
+        _push_row(self.board_id, ts_epoch, row, gases, readings_fb, battery)
+
+def _gas_col(board_id: str, gas: str, unit: str) -> str:
+    return f"{board_id} - {gas} ({unit})"
+
+def _push_row(board_id: str, ts_epoch: float, row: Dict[str, Optional[float]],
+              gases: Dict[str, Tuple[float, str]], readings_fb: Dict[str, float], battery: Optional[dict]):
+    """
+    Hand a row to the writer, as b_write._push_block does for blocks: a full
+    queue waits up to OVERLOAD_WAIT_S (or, with backpressure, as long as the
+    writer runs) before the oldest unwritten row is dropped and reported.
+    """
+    item = (board_id, ts_epoch, row, gases, readings_fb, battery)
+    while True:
+        try:
+            _ROW_QUEUE.put(item, timeout=OVERLOAD_WAIT_S); return
+        except queue.Full:
+            w = _WRITER
+            if not (BOARDS.run.backpressure and w is not None and w.is_alive()): break
+    while True:
+        try:
+            lost = _ROW_QUEUE.get_nowait()[0]
+            BOARDS.count(queue_dropped=1)
+            metrics.board(f"LB:{lost}").blocks_dropped += 1
+            dropped = BOARDS.run.writer_stats.get("queue_dropped", 0)
+            BOARDS.publish("Writer", status=f"overloaded, {dropped} rows dropped")
+            if dropped == 1 or dropped % 100 == 0:
+                print(f"[LB] writer queue full for {OVERLOAD_WAIT_S} s: dropped a {lost} row ({dropped} so far)")
+        except queue.Empty:
+            pass
+        try:
+            _ROW_QUEUE.put_nowait(item); return
+        except queue.Full:
+            pass
+
+# === CSV writer thread ===
+class LBWriter(threading.Thread):
+    """
+    Owns the LB outputs: CSV, columnar copy, catalog and Firebase.  Readers
+    frame and parse on the ingest engine thread and queue one row per block,
+    so a slow disk or fsync stalls this thread, not every serial port.
+    Between rows it flushes quiet boards' sinks on time.
+    """
+    daemon = True
+    def __init__(self):
+        super().__init__(name="LB-Writer")
+        self.sinks: Dict[str, CsvSink] = {}
+        self.cols: Dict[str, colstore.ColumnSink] = {}
+        self.paths: Dict[str, str] = {}
 
-        header_cols = list(row.keys())
-        self._ensure_writer_ready(header_cols)
-        cum_csv = _CUM_PATHS[self.board_id]
+    def finish(self, timeout: float):
+        """Called once the readers are closed: write every row still queued, then close."""
+        try: _ROW_QUEUE.put(_EOS, timeout=timeout)
+        except queue.Full: print("[LB] writer did not take the end of stream; queued rows are lost")
+        self.join(timeout)
+
+    def run(self):
+        next_idle = time.monotonic() + IDLE_FLUSH_CHECK_S
         try:
-            with open(cum_csv,"a",newline="",encoding="utf-8") as fh:
-                csv.DictWriter(fh, fieldnames=_CUM_HEADERS[self.board_id]).writerow(row)
-        except PermissionError:
-            stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            alt = os.path.splitext(cum_csv)[0] + f"_pending_{stamp}.csv"
-            with open(alt,"a",newline="",encoding="utf-8") as fh:
-                cw = csv.DictWriter(fh, fieldnames=_CUM_HEADERS[self.board_id])
-                if os.path.getsize(alt)==0: cw.writeheader()
-                cw.writerow(row)
+            while True:
+                try: item = _ROW_QUEUE.get(timeout=IDLE_FLUSH_CHECK_S)
+                except queue.Empty: item = None
+                if item is _EOS: break
+                if item: self._write(*item)
+                if time.monotonic() >= next_idle:
+                    self._flush_idle(); next_idle = time.monotonic() + IDLE_FLUSH_CHECK_S
+        finally:
+            for sink in list(self.sinks.values()) + list(self.cols.values()):
+                try: sink.close()
+                except Exception: pass
+            catalog.CATALOG.flush()
+
+    def _flush_idle(self):
+        """Time-based flush for boards that go quiet (a sink is otherwise only flushed by its next row)."""
+        for board_id, sink in list(self.sinks.items()) + list(self.cols.items()):
+            try: sink.maybe_flush()
+            except OSError as e:
+                metrics.board(f"LB:{board_id}").write_failures += 1
+                BOARDS.publish(board_id, status=f"flush failed: {e}")
+
+    def _ensure_ready(self, board_id: str, header_cols: List[str], gases: Dict[str, Tuple[float, str]],
+                      ts_epoch: float) -> str:
+        run = BOARDS.run
+        cum_csv = partition.path_for(run.stage, run.substance, run.test_id, board_id, ts_epoch)
+        if self.paths.get(board_id) == cum_csv: return cum_csv
+        # first row, or the day rolled over: continue in the new partition
+        for old in (self.sinks.pop(board_id, None), self.cols.pop(board_id, None)):
+            if old: old.close()
+        BOARDS.publish_run(folder=partition.ensure_test_dir(run.stage, run.substance, run.test_id))
+        self.sinks[board_id] = CsvSink(cum_csv, header_cols)
+        if colstore.ENABLED:
+            units = {f"{board_id} - Battery (%)": "%", f"{board_id} - Battery (V)": "V",
+                     **{_gas_col(board_id, g, u): u for g, (_v, u) in gases.items()}}
+            self.cols[board_id] = colstore.open_sink(cum_csv, header_cols[1:], units)
+        self.paths[board_id] = cum_csv
+        BOARDS.publish(board_id, path=cum_csv)
+        return cum_csv
+
+    def _write(self, board_id: str, ts_epoch: float, row: Dict[str, Optional[float]],
+               gases: Dict[str, Tuple[float, str]], readings_fb: Dict[str, float], battery: Optional[dict]):
+        if merge.LIVE.active:
+            merge.LIVE.push(board_id, ts_epoch, {k: v for k, v in row.items()
+                                                 if k not in ("Timestamp", "Flowrate (L/min)") and v is not None})
+
+        run = BOARDS.run
+        cum_csv = self._ensure_ready(board_id, list(row.keys()), gases, ts_epoch)
+        self.sinks[board_id].write(row)
+        metrics.board(f"LB:{board_id}").rows_written += 1
+        catalog.CATALOG.note_row(cum_csv, run.stage, run.substance, run.test_id, board_id, ts_epoch, run.flowrate)
+        cols = self.cols.get(board_id)
+        if cols:
+            try:
+                cols.write(ts_epoch, {k: v for k, v in row.items() if k != "Timestamp"})
+            except OSError as e:
+                BOARDS.publish("Columnar", status=f"disabled ({e})")
+                self.cols.pop(board_id, None)
 
         # Firebase numbered write
-        _FB.put_reading(STATE["stage"], STATE["substance"], STATE["test_id"] or "",
-                        self.board_id, ts_epoch, readings_fb, pct, volts)
-        if _FB.disabled_reason:
-            STATE["per_board_status"]["Firebase"] = f"offline ({_FB.disabled_reason})"
+        _FB.put_reading(run.stage, run.substance, run.test_id or "",
+                        _fb_board(board_id), ts_epoch, readings_fb, battery)
+        _publish_fb()
+
+def _publish_fb():
+    """The "Firebase" record follows the sink as it goes offline and reconnects."""
+    st = "online" if _FB.ready else f"offline ({_FB.disabled_reason})"
+    rec = BOARDS.get("Firebase")
+    if rec is None or rec.status != st: BOARDS.publish("Firebase", status=st)
 
 # ===== Public API =====
 def start_capture(stage: str, substance: Optional[str], test_id: str,
                   flowrate: float, interval: float, ports: Dict[str, Optional[str]],
-                  duration_sec: Optional[int] = None):
+                  duration_sec: Optional[int] = None, backpressure: bool = False):
     stop_capture(); _STOP_EVENT.clear()
-    with _LOCK:
-        STATE.update({
-            "active": True, "stage": stage,
-            "substance": "baseline" if stage=="Baseline" else (substance or "").title(),
-            "test_id": test_id, "flowrate": float(flowrate),
-            "interval": float(interval), "duration_sec": int(duration_sec) if duration_sec else None,
-            "folder": None, "per_board_status": {},
-        })
-        _LAST_BATT.clear(); _CUM_PATHS.clear(); _CUM_HEADERS.clear()
+    while not _ROW_QUEUE.empty():
+        try: _ROW_QUEUE.get_nowait()
+        except queue.Empty: break
+    run = BOARDS.reset({b: "idle" for b, p in ports.items() if p},
+                       active=True, stage=stage,
+                       substance="baseline" if stage=="Baseline" else (substance or "").title(),
+                       test_id=test_id, flowrate=float(flowrate), interval=float(interval),
+                       duration_sec=int(duration_sec or 0), backpressure=backpressure)
+    merge.LIVE.start("LB", stage, run.substance, test_id, float(flowrate))
 
     for b,p in ports.items():
         if not p: continue
-        STATE["per_board_status"][b] = "idle"
-        r = LBSerialReader(b,p,float(interval)); _THREADS[b]=r; r.start()
+        r = LBSerialReader(b,p,float(interval)); _READERS[b]=r; r.start()
 
-    # Firebase: attempt init & prime counters
+    # Firebase: attempt init & prime counters; offline, readings are queued until it connects
     _FB.init()
-    if _FB.ready:
-        STATE["per_board_status"]["Firebase"] = "online"
-        _FB.load_seq_if_needed(STATE["stage"], STATE["substance"], STATE["test_id"] or "",
-                               [b for b,p in ports.items() if p])
-    else:
-        STATE["per_board_status"]["Firebase"] = f"offline ({_FB.disabled_reason})"
-
-    if duration_sec and duration_sec>0:
+    boards = [b for b,p in ports.items() if p]
+    _FB.load_seq(run.stage, run.substance, run.test_id or "",
+                 {_fb_board(b): firebase_sink.seq_file_for(partition.seq_base(run.stage, run.substance, run.test_id, b))
+                  for b in boards})
+    _publish_fb()
+    global _WRITER
+    _WRITER = LBWriter(); _WRITER.start()      # rows queued meanwhile are numbered from the loaded sequence
+
+    if run.duration_sec>0:
         def _auto():
             t0=time.time()
-            while time.time()-t0<duration_sec and not _STOP_EVENT.is_set(): time.sleep(0.25)
+            while time.time()-t0<run.duration_sec and not _STOP_EVENT.is_set(): time.sleep(0.25)
             if not _STOP_EVENT.is_set(): stop_capture()
         threading.Thread(target=_auto, daemon=True).start()
 
 def stop_capture():
+    global _WRITER
     _STOP_EVENT.set()
-    for r in list(_THREADS.values()):
+    for r in list(_READERS.values()):
         try: r.stop(); r.join(timeout=2.0)
         except Exception: pass
-    _THREADS.clear()
-    with _LOCK: STATE["active"]=False
+    _READERS.clear()
+    if _WRITER: _WRITER.finish(timeout=DRAIN_TIMEOUT_S); _WRITER = None
+    merge.LIVE.stop("LB")
+    BOARDS.publish_run(active=False)
 
 def snapshot():
+    view, run = BOARDS.view, BOARDS.run     # consistent board and run records, no lock
     lines=[]
-    with _LOCK:
-        for b,st in STATE.get("per_board_status",{}).items(): lines.append(f"{b}: {st}")
-        for b in ("LB1","LB2"):
-            if b in _CUM_PATHS: lines.append(f"Cumulative ({b}): {_CUM_PATHS[b]}")
-        if STATE.get("test_id"): lines.append(f"Firebase test_id: {STATE['test_id']}")
-    return {"status_lines": lines}
+    for b,rec in view.items(): lines.append(f"{b}: {rec.status}")
+    for b in ("LB1","LB2"):
+        if b in view and view[b].path: lines.append(f"Cumulative ({b}): {view[b].path}")
+    if run.test_id: lines.append(f"Firebase test_id: {run.test_id}")
+    if _FB.ready or _FB.uploader.depth:
+        up = _FB.uploader
+        lines.append(f"Firebase uploads: {up.status}, {up.depth} queued")
+    return {"status_lines": lines, "boards": metrics.boards("LB"), "firebase": metrics.firebase()}
@@ -0,0 +1,76 @@
+#livebus.py
+"""
+In-process publish/subscribe for the live page's server-push stream.
+
+Producers (the preview readers, on the ingest thread) call
+``BUS.publish(event, data)`` and return immediately.  Each open browser
+stream holds a Subscription: a small bounded queue that drops its oldest
+event when a slow client falls behind, so a stalled tab can never block
+ingestion.  ``sse(event, data)`` formats one Server-Sent Events frame.
+"""
+import json, threading
+from collections import deque
+from typing import Any, Deque, List, Optional, Tuple
+
+QUEUE_MAX = 1000
+
+Event = Tuple[str, Any]
+
+
+class Subscription:
+    def __init__(self, bus: "LiveBus", maxlen: int):
+        self._bus = bus
+        self._q: Deque[Event] = deque(maxlen=maxlen)
+        self._cv = threading.Condition()
+        self.dropped = 0
+
+    def _put(self, ev: Event):
+        with self._cv:
+            if len(self._q) == self._q.maxlen: self.dropped += 1
+            self._q.append(ev)
+            self._cv.notify()
+
+    def get(self, timeout: Optional[float] = None) -> List[Event]:
+        """Everything queued so far, waiting up to ``timeout`` for the first event ([] on timeout)."""
+        with self._cv:
+            if not self._q: self._cv.wait(timeout)
+            out = list(self._q); self._q.clear()
+            return out
+
+    def close(self):
+        self._bus._unsubscribe(self)
+
+
+class LiveBus:
+    def __init__(self, queue_max: int = QUEUE_MAX):
+        self.queue_max = queue_max
+        self._subs: List[Subscription] = []
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def subscribe(self) -> Subscription:
+        sub = Subscription(self, self.queue_max)
+        with self._lock: self._subs.append(sub)
+        return sub
+
+    def _unsubscribe(self, sub: Subscription):
+        with self._lock:
+            if sub in self._subs: self._subs.remove(sub)
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subs)
+
+    def publish(self, event: str, data: Any):
+        with self._lock:
+            subs = list(self._subs)
+            self.published += 1
+        for sub in subs:
+            sub._put((event, data))
+
+
+def sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+BUS = LiveBus()
@@ -0,0 +1,323 @@
+#merge.py
+"""
+Time alignment of the boards' streams (B1/B2, LB1, LB2) onto one time grid.
+
+Offline, over a stored session:
+
+    frames = load_session("Experiment", "Ethanol", "T1")   # {"B": df, "LB1": df, "LB2": df}
+    aligned = align(frames, step_s=1.0, tolerance_s=2.0, method="nearest")
+
+or ``python merge.py Experiment Ethanol T1 --method interpolate -o out.csv``.
+
+Live, during capture: with ALIGN_STEP_S > 0 the writers push every board's
+readings into LIVE, which writes aligned rows to
+``<test>/<substance>_Aligned_Readings.csv`` as each grid time settles.
+
+For grid time t and each stream, ``method`` picks:
+    "nearest"      the closest sample within +/- tolerance
+    "backward"     the latest sample at or before t, at most tolerance old
+    "interpolate"  linear between the samples either side of t (each within
+                   tolerance), or the one in range when only one is
+and NaN otherwise.  Offline runs pd.merge_asof / np.searchsorted over whole
+columns; live applies the same rules to a short window of recent samples.
+"""
+import argparse, bisect, math, os, threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+import colstore
+import csv_sink
+import partition
+
+STEP_S = float(os.getenv("ALIGN_STEP_S", "0"))          # live alignment grid; 0 = off
+TOLERANCE_S = float(os.getenv("ALIGN_TOLERANCE_S", "2.0"))
+METHOD = os.getenv("ALIGN_METHOD", "nearest")
+METHODS = ("nearest", "backward", "interpolate")
+STREAMS = ("B", "LB1", "LB2")
+
+Sample = Tuple[float, Dict[str, float]]
+
+
+# ===== offline =====
+def _load(path: str):
+    """One stored file as a typed frame: the columnar copy when it is current, else the CSV segments."""
+    import pandas as pd
+    if colstore.current(path):
+        return colstore.Session(colstore.dir_for(path)).to_frame()
+    df = csv_sink.read_frame(path)
+    df["Timestamp"] = pd.to_datetime(df["Timestamp"], errors="coerce")
+    for c in df.columns:
+        if c != "Timestamp":
+            df[c] = pd.to_numeric(df[c], errors="coerce")
+    return df
+
+
+def load_session(stage: str, substance: str, test_id: str) -> Dict[str, "object"]:
+    """{stream: frame} for every stream of a test that has data (all partitions of each)."""
+    out = {}
+    for kind in STREAMS:
+        df = partition.load(partition.parts(stage, substance, kind, test_id), _load)
+        if df is not None and len(df):
+            out[kind] = df
+    return out
+
+
+def _prepared(df):
+    import pandas as pd
+    df = df.assign(Timestamp=pd.to_datetime(df["Timestamp"], errors="coerce").astype("datetime64[ns]"))
+    return df.dropna(subset=["Timestamp"]).sort_values("Timestamp", kind="stable").reset_index(drop=True)
+
+
+def _interpolated(grid_ns: np.ndarray, ts_ns: np.ndarray, values: np.ndarray, tol_ns: int) -> np.ndarray:
+    n = len(ts_ns)
+    prv = np.searchsorted(ts_ns, grid_ns, side="right") - 1     # last sample <= t
+    nxt = np.searchsorted(ts_ns, grid_ns, side="left")          # first sample >= t
+    p = np.clip(prv, 0, n - 1); q = np.clip(nxt, 0, n - 1)
+    ok_p = (prv >= 0) & (grid_ns - ts_ns[p] <= tol_ns)
+    ok_n = (nxt < n) & (ts_ns[q] - grid_ns <= tol_ns)
+    span = (ts_ns[q] - ts_ns[p]).astype(np.float64)
+    w = np.divide((grid_ns - ts_ns[p]).astype(np.float64), span, out=np.zeros(len(grid_ns)), where=span > 0)
+
+    out = np.full((len(grid_ns), values.shape[1]), np.nan)
+    both = ok_p & ok_n
+    out[both] = values[p[both]] + (values[q[both]] - values[p[both]]) * w[both, None]
+    out[ok_p & ~ok_n] = values[p[ok_p & ~ok_n]]
+    out[ok_n & ~ok_p] = values[q[ok_n & ~ok_p]]
+    return out
+
+
+def align(frames: Dict[str, "object"], step_s: float = 1.0, tolerance_s: float = TOLERANCE_S,
+          method: str = METHOD, start=None, end=None):
+    """
+    One frame on a regular grid of ``step_s`` from the earliest to the latest
+    sample (or ``start``/``end``): 'Timestamp' plus every stream's columns.
+    A column name already taken by an earlier stream (e.g. the flowrate) is
+    prefixed with the stream name.
+    """
+    import pandas as pd
+    if method not in METHODS:
+        raise ValueError(f"unknown alignment method: {method}")
+    frames = {k: _prepared(df) for k, df in frames.items() if df is not None and len(df)}
+    frames = {k: df for k, df in frames.items() if len(df)}
+    if not frames:
+        return pd.DataFrame({"Timestamp": pd.Series([], dtype="datetime64[ns]")})
+
+    step = pd.Timedelta(seconds=step_s)
+    tol = pd.Timedelta(seconds=tolerance_s)
+    lo = pd.Timestamp(start) if start is not None else min(df["Timestamp"].iloc[0] for df in frames.values())
+    hi = pd.Timestamp(end) if end is not None else max(df["Timestamp"].iloc[-1] for df in frames.values())
+    grid = pd.DataFrame({"Timestamp": pd.date_range(lo.floor(step), hi, freq=step).astype("datetime64[ns]")})
+
+    parts = [grid]
+    taken = {"Timestamp"}
+    for name, df in frames.items():
+        df = df.rename(columns={c: f"{name} - {c}" for c in df.columns if c in taken and c != "Timestamp"})
+        cols = [c for c in df.columns if c != "Timestamp"]
+        taken.update(cols)
+        if method == "interpolate":
+            values = df[cols].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float64)
+            out = _interpolated(grid["Timestamp"].to_numpy().view(np.int64),
+                                df["Timestamp"].to_numpy().view(np.int64), values, tol.value)
+            parts.append(pd.DataFrame(out, columns=cols))
+        else:
+            merged = pd.merge_asof(grid, df, on="Timestamp", direction=method, tolerance=tol)
+            parts.append(merged[cols])
+    return pd.concat(parts, axis=1)
+
+
+# ===== live =====
+class StreamAligner:
+    """
+    Incremental ``align``: ``push(stream, t, values)`` as readings arrive
+    (epoch seconds, {column: value}); each grid time t is emitted once the
+    newest reading seen is past t + tolerance, so later samples can no longer
+    change it.  Rows with no value at all (capture paused) are skipped.
+    ``flush()`` emits what is left, e.g. at stop.
+    """
+    def __init__(self, step_s: float = 1.0, tolerance_s: float = TOLERANCE_S, method: str = METHOD,
+                 on_row: Optional[Callable[[float, Dict[str, float]], None]] = None):
+        if method not in METHODS:
+            raise ValueError(f"unknown alignment method: {method}")
+        self.step_s = step_s
+        self.tolerance_s = tolerance_s
+        self.method = method
+        self.on_row = on_row
+        self.late = 0
+        self._samples: Dict[str, List[Sample]] = {}
+        self._next_t: Optional[float] = None
+        self._watermark = -math.inf
+        self._lock = threading.Lock()
+
+    def push(self, stream: str, t: float, values: Dict[str, float]) -> List[Tuple[float, Dict[str, float]]]:
+        with self._lock:
+            if self._next_t is not None and t < self._next_t - self.tolerance_s:
+                self.late += 1          # the grid times it could affect are already out
+                return []
+            samples = self._samples.setdefault(stream, [])
+            if not samples or t >= samples[-1][0]: samples.append((t, values))
+            else: samples.insert(bisect.bisect_right([s[0] for s in samples], t), (t, values))
+            if self._next_t is None:
+                self._next_t = math.ceil(t / self.step_s) * self.step_s
+            self._watermark = max(self._watermark, t)
+            # emitted under the lock: rows reach on_row in time order whichever board pushed
+            return self._emit(self._ready(self._watermark - self.tolerance_s))
+
+    def flush(self) -> List[Tuple[float, Dict[str, float]]]:
+        with self._lock:
+            return self._emit(self._ready(self._watermark))
+
+    def _emit(self, rows):
+        if self.on_row:
+            for t, values in rows: self.on_row(t, values)
+        return rows
+
+    def _ready(self, until: float) -> List[Tuple[float, Dict[str, float]]]:
+        rows = []
+        while self._next_t is not None and self._next_t <= until:
+            t = self._next_t
+            values: Dict[str, float] = {}
+            for samples in self._samples.values():
+                values.update(self._at(samples, t))
+            if values: rows.append((t, values))
+            self._next_t = t + self.step_s
+        # keep one sample before the next grid time's window (backward / interpolate need it)
+        horizon = (self._next_t or 0) - self.tolerance_s
+        for samples in self._samples.values():
+            i = bisect.bisect_left([s[0] for s in samples], horizon)
+            del samples[:max(0, i - 1)]
+        return rows
+
+    def _at(self, samples: List[Sample], t: float) -> Dict[str, float]:
+        times = [s[0] for s in samples]
+        i = bisect.bisect_right(times, t)               # samples[:i] are <= t
+        prv = samples[i - 1] if i and t - times[i - 1] <= self.tolerance_s else None
+        j = bisect.bisect_left(times, t)                # samples[j:] are >= t
+        nxt = samples[j] if j < len(samples) and times[j] - t <= self.tolerance_s else None
+        if self.method == "backward":
+            return dict(prv[1]) if prv else {}
+        if self.method == "nearest":
+            best = min((s for s in (prv, nxt) if s), key=lambda s: abs(s[0] - t), default=None)
+            return dict(best[1]) if best else {}
+        if prv and nxt and nxt[0] > prv[0]:
+            w = (t - prv[0]) / (nxt[0] - prv[0])
+            out = {**prv[1], **nxt[1]}
+            for k in prv[1].keys() & nxt[1].keys():
+                out[k] = prv[1][k] + (nxt[1][k] - prv[1][k]) * w
+            return out
+        return dict((prv or nxt)[1]) if (prv or nxt) else {}
+
+
+class _AlignedRun:
+    """One test's aligned output: its aligner and CSV, with the key and flowrate every row carries."""
+    def __init__(self, key: Tuple[str, str, Optional[str]], flowrate: float,
+                 step_s: float, tolerance_s: float, method: str):
+        self.key = key
+        self.flowrate = flowrate
+        self.step_s = step_s
+        self.closed = False
+        self._lock = threading.Lock()
+        self._sink: Optional[csv_sink.CsvSink] = None
+        self.aligner = StreamAligner(step_s, tolerance_s, method, on_row=self._write)
+
+    def _write(self, t: float, values: Dict[str, float]):
+        stamp = datetime.fromtimestamp(t).strftime("%Y-%m-%d %H:%M:%S.%f")
+        row = {"Timestamp": stamp[:-7] if self.step_s >= 1 else stamp[:-3],
+               "Flowrate (L/min)": self.flowrate}
+        row.update((k, round(v, 3)) for k, v in values.items())
+        path = partition.path_for(*self.key, "Aligned", t)
+        with self._lock:
+            if self.closed: return
+            if self._sink is None or self._sink.path != path:
+                if self._sink: self._sink.close()
+                partition.ensure_test_dir(*self.key)
+                self._sink = csv_sink.CsvSink(path, list(row))
+            self._sink.write(row)
+
+    def flush(self):
+        self.aligner.flush()
+        with self._lock:
+            if self._sink and not self.closed: self._sink.flush()
+
+    def close(self):
+        self.aligner.flush()
+        with self._lock:
+            self.closed = True
+            if self._sink: self._sink.close()
+
+
+class LiveAligned:
+    """
+    The aligned CSV of the capture in progress, fed by both b_write and
+    lb_write.  Each writer ``start``s it under its own name and ``stop``s it
+    when it is done; the file is flushed and closed only when the last one
+    stops, so stopping one board family never cuts the other's grid short.
+    """
+    def __init__(self, step_s: float = STEP_S, tolerance_s: float = TOLERANCE_S, method: str = METHOD):
+        self.step_s = step_s
+        self.tolerance_s = tolerance_s
+        self.method = method
+        self._lock = threading.Lock()
+        self._run: Optional[_AlignedRun] = None
+        self._owners: Set[str] = set()
+
+    @property
+    def active(self) -> bool:
+        return self._run is not None
+
+    def start(self, owner: str, stage: str, substance: str, test_id: Optional[str], flowrate: float):
+        """Begin the test's aligned output, or join it if the other board family already started it."""
+        if self.step_s <= 0: return
+        key = (stage, substance, test_id)
+        with self._lock:
+            if self._run is None or self._run.key != key:
+                self._close_locked()
+                self._run = _AlignedRun(key, flowrate, self.step_s, self.tolerance_s, self.method)
+            self._owners.add(owner)
+
+    def push(self, stream: str, t: float, values: Dict[str, float]):
+        run = self._run
+        if run is not None and values:
+            run.aligner.push(stream, t, values)
+
+    def flush(self):
+        """Emit every settled grid time and flush the file; the capture may continue."""
+        run = self._run
+        if run is not None: run.flush()
+
+    def stop(self, owner: str):
+        """``owner`` is done writing; the last one to stop closes the aligned output."""
+        with self._lock:
+            self._owners.discard(owner)
+            if not self._owners: self._close_locked()
+
+    def close(self):
+        """Flush and close the aligned output whoever still holds it."""
+        with self._lock:
+            self._owners.clear()
+            self._close_locked()
+
+    def _close_locked(self):
+        if self._run: self._run.close()
+        self._run = None
+
+
+LIVE = LiveAligned()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Align a stored session's board streams onto one time grid")
+    parser.add_argument("stage"); parser.add_argument("substance"); parser.add_argument("test_id")
+    parser.add_argument("--step", type=float, default=1.0, help="grid step, seconds")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE_S, help="max distance to a sample, seconds")
+    parser.add_argument("--method", choices=METHODS, default=METHOD)
+    parser.add_argument("-o", "--out", help="CSV to write (default: print a summary)")
+    args = parser.parse_args()
+    frames = load_session(args.stage, args.substance, args.test_id)
+    aligned = align(frames, args.step, args.tolerance, args.method)
+    if args.out:
+        aligned.to_csv(args.out, index=False)
+    filled = aligned.drop(columns="Timestamp").notna().mean() if len(aligned) else None
+    print(f"{', '.join(frames) or 'no streams'}: {len(aligned)} rows x {aligned.shape[1] - 1} columns"
+          + (f", {filled.mean():.0%} of cells filled" if filled is not None and len(filled) else ""))
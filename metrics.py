@@ -0,0 +1,126 @@
+#metrics.py
+"""
+Per-board pipeline counters, for b_write/lb_write ``snapshot()`` and /metrics.
+
+Counters are kept per ingest key ("B:B1", "LB:LB1", "preview:B1") and
+bumped by the stage that owns them:
+    bytes_read, serial_buffer_hwm            ingest engine (hwm = largest backlog found waiting in one drain)
+    lines_parsed, parse_failures,            B / LB readers (a failure is a block line with a ':' that
+    blocks_emitted, blocks_dropped             did not parse; dropped = lost to a full writer queue)
+    rows_written                             B / LB writer, after the CSV write
+    write_failures                           LB writer (a flush of a board's CSV or columnar copy failed)
+Each field has a single writing thread, so readers see at worst a value one
+update old.  They count for the life of the process, as Prometheus expects;
+a new capture does not reset them.
+
+GET /metrics serves them, with the Firebase uploader's queue and latency,
+in the Prometheus text format.
+"""
+import math
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+import firebase_sink
+
+FIELDS = ("bytes_read", "serial_buffer_hwm", "lines_parsed", "parse_failures",
+          "blocks_emitted", "blocks_dropped", "rows_written", "write_failures")
+
+# field -> (Prometheus name, type, help)
+_PROM = {
+    "bytes_read": ("enose_bytes_read_total", "counter", "Raw bytes read from the board's serial port."),
+    "serial_buffer_hwm": ("enose_serial_buffer_hwm_bytes", "gauge",
+                          "Largest number of bytes found waiting in the serial buffer in one read."),
+    "lines_parsed": ("enose_lines_parsed_total", "counter", "Non-empty lines handled by the board's reader."),
+    "parse_failures": ("enose_parse_failures_total", "counter",
+                       "Block lines with a ':' that did not parse as 'label: value [unit]'."),
+    "blocks_emitted": ("enose_blocks_emitted_total", "counter", "Complete blocks passed on by the reader after decimation."),
+    "blocks_dropped": ("enose_blocks_dropped_total", "counter", "Blocks discarded because the writer queue was full."),
+    "rows_written": ("enose_rows_written_total", "counter", "CSV rows written that include this board's readings."),
+    "write_failures": ("enose_write_failures_total", "counter", "Failed flushes of this board's CSV or columnar output."),
+}
+
+
+class Counters:
+    __slots__ = FIELDS
+
+    def __init__(self):
+        for f in FIELDS: setattr(self, f, 0)
+
+    def as_dict(self) -> Dict[str, int]:
+        return {f: getattr(self, f) for f in FIELDS}
+
+
+_LOCK = threading.Lock()
+_BOARDS: Dict[str, Counters] = {}
+_GAUGES: Dict[str, Tuple[str, Callable[[], float]]] = {}   # name -> (help, read fn), from other modules
+
+
+def board(key: str) -> Counters:
+    c = _BOARDS.get(key)
+    if c is None:
+        with _LOCK: c = _BOARDS.setdefault(key, Counters())
+    return c
+
+
+def boards(prefix: str) -> Dict[str, Dict[str, int]]:
+    """{board_id: counters} for the keys of one pipeline, e.g. boards("B")."""
+    with _LOCK: items = list(_BOARDS.items())
+    return {key.split(":", 1)[1]: c.as_dict() for key, c in items if key.split(":", 1)[0] == prefix}
+
+
+def gauge(name: str, doc: str, fn: Callable[[], float]):
+    """Serve ``fn()`` on /metrics as gauge ``name`` (e.g. a queue depth owned by another module)."""
+    _GAUGES[name] = (doc, fn)
+
+
+def firebase() -> Dict[str, Optional[float]]:
+    up = firebase_sink.SINK.uploader
+    return {"ready": firebase_sink.SINK.ready, "queue_depth": up.depth, "uploaded": up.uploaded,
+            "failures": up.failures, "upload_latency_s": up.last_latency_s, "upload_delay_s": up.last_delay_s}
+
+
+# ===== Prometheus text format =====
+def _label(v: str) -> str:
+    return v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _sample(value) -> str:
+    """A sample value at full precision: ints as ints, floats as repr (":g" would round to 6 digits)."""
+    if isinstance(value, (bool, int)): return str(int(value))
+    v = float(value)
+    if math.isnan(v): return "NaN"
+    if math.isinf(v): return "+Inf" if v > 0 else "-Inf"
+    return repr(v)
+
+
+def render() -> str:
+    with _LOCK: items = sorted(_BOARDS.items())
+    out: List[str] = []
+    for f in FIELDS:
+        name, kind, doc = _PROM[f]
+        out += [f"# HELP {name} {doc}", f"# TYPE {name} {kind}"]
+        for key, c in items:
+            pipeline, _, board_id = key.partition(":")
+            out.append(f'{name}{{pipeline="{_label(pipeline)}",board="{_label(board_id)}"}} {getattr(c, f)}')
+
+    fb = firebase()
+    def _one(name, kind, doc, value):
+        if value is None: return
+        out.extend([f"# HELP {name} {doc}", f"# TYPE {name} {kind}", f"{name} {_sample(value)}"])
+    for name, (doc, fn) in sorted(_GAUGES.items()):
+        try: _one(name, "gauge", doc, fn())
+        except Exception: pass
+    _one("enose_firebase_ready", "gauge", "1 when the Firebase sink is connected.", int(bool(fb["ready"])))
+    _one("enose_firebase_queue_depth", "gauge", "Readings waiting to be uploaded.", fb["queue_depth"])
+    _one("enose_firebase_uploaded_total", "counter", "Readings accepted by Firebase.", fb["uploaded"])
+    _one("enose_firebase_failures_total", "counter", "Failed upload batches.", fb["failures"])
+    _one("enose_firebase_upload_latency_seconds", "gauge", "Round trip of the last uploaded batch.",
+         fb["upload_latency_s"])
+    _one("enose_firebase_upload_delay_seconds", "gauge",
+         "Time the oldest reading of the last batch spent queued before it was accepted.", fb["upload_delay_s"])
+    return "\n".join(out) + "\n"
+
+
+def register_routes(app):
+    from flask import Response
+    app.server.add_url_rule("/metrics", "metrics", lambda: Response(render(), mimetype="text/plain; version=0.0.4"))
@@ -0,0 +1,113 @@
+#partition.py
+"""
+Output layout: one folder per test instead of one ever-growing CSV per substance.
+
+    <stage>/<substance>/<test_id>/<substance>_B_Readings.csv
+    <stage>/<substance>/<test_id>/<substance>_LB1_Readings.csv
+    ...
+With ROLLOVER="day" each file also carries the date of its rows and a capture
+that runs past midnight continues in a new file:
+
+    <stage>/<substance>/<test_id>/<substance>_B_Readings_2026-10-17.csv
+
+The folder name is the test_id made filesystem-safe; ``ensure_test_dir``
+also writes the raw test_id to ``<test folder>/test.json`` so a catalog scan
+can index the folder under the id the writers used (``read_test_id``).
+
+Firebase sequence files stay per test (``seq_base``), so rollover never
+restarts numbering.  ``parts()`` lists a test's files oldest first and
+``load()`` concatenates them into one time-sorted frame, so readers see a
+single dataset whatever the layout; CSVs written before partitioning (directly
+in the substance folder) are still found by ``parts(..., test_id=None)``.
+"""
+import glob, json, os, re
+from datetime import datetime
+from typing import Callable, List, Optional
+
+ROLLOVER = os.getenv("PARTITION_ROLLOVER", "none")   # "none" | "day"
+NO_TEST_ID = "untitled"
+SIDECAR = "test.json"
+
+_UNSAFE_RE = re.compile(r"[^\w.-]+")
+
+
+def substance_dir(stage: str, substance: str) -> str:
+    return os.path.join("Baseline", "baseline") if stage == "Baseline" else os.path.join(stage, substance)
+
+
+def _base(stage: str, substance: str) -> str:
+    return "baseline" if stage == "Baseline" else substance
+
+
+def test_dir(stage: str, substance: str, test_id: Optional[str]) -> str:
+    return os.path.join(substance_dir(stage, substance), _UNSAFE_RE.sub("_", test_id or "").strip("._") or NO_TEST_ID)
+
+
+def ensure_test_dir(stage: str, substance: str, test_id: Optional[str]) -> str:
+    """Create the test's folder and its sidecar (raw test_id) if missing; returns the folder."""
+    folder = test_dir(stage, substance, test_id)
+    sidecar = os.path.join(folder, SIDECAR)
+    if not os.path.exists(sidecar):
+        os.makedirs(folder, exist_ok=True)
+        tmp = sidecar + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump({"test_id": test_id or ""}, fh, ensure_ascii=False)
+        os.replace(tmp, sidecar)
+    return folder
+
+
+def read_test_id(folder: str) -> Optional[str]:
+    """The raw test_id recorded in a test folder's sidecar, or None (folders from before the sidecar)."""
+    try:
+        with open(os.path.join(folder, SIDECAR), encoding="utf-8") as fh:
+            return json.load(fh)["test_id"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def seq_base(stage: str, substance: str, test_id: Optional[str], kind: str) -> str:
+    """The test's undated file name for ``kind`` (B, LB1, LB2): what the partitions are named after."""
+    return os.path.join(test_dir(stage, substance, test_id), f"{_base(stage, substance)}_{kind}_Readings.csv")
+
+
+def path_for(stage: str, substance: str, test_id: Optional[str], kind: str,
+             ts_epoch: Optional[float] = None, rollover: str = ROLLOVER) -> str:
+    """File that a row captured at ``ts_epoch`` belongs to."""
+    base = seq_base(stage, substance, test_id, kind)
+    if rollover == "day":
+        day = datetime.fromtimestamp(ts_epoch if ts_epoch is not None else datetime.now().timestamp())
+        return f"{os.path.splitext(base)[0]}_{day:%Y-%m-%d}.csv"
+    return base
+
+
+def parts(stage: str, substance: str, kind: str, test_id: Optional[str] = None) -> List[str]:
+    """
+    CSV files holding ``kind`` rows, oldest first: the partitions of one test,
+    or with ``test_id=None`` every test plus any pre-partitioning cumulative file.
+    """
+    name = f"{_base(stage, substance)}_{kind}_Readings"
+    if test_id is not None:
+        dirs = [test_dir(stage, substance, test_id)]
+    else:
+        folder = substance_dir(stage, substance)
+        dirs = [folder] + sorted(glob.glob(os.path.join(glob.escape(folder), "*", "")))
+    out: List[str] = []
+    for d in dirs:
+        d = glob.escape(d.rstrip(os.sep))
+        # undated before dated; dated names sort by day
+        out += glob.glob(os.path.join(d, f"{name}.csv")) + sorted(glob.glob(os.path.join(d, f"{name}_????-??-??.csv")))
+    return out
+
+
+def load(paths: List[str], loader: Callable[[str], object]):
+    """
+    One time-sorted frame from several partitions.  ``loader`` reads a single
+    file (read._load_session, which caches); None when nothing could be read.
+    """
+    import pandas as pd
+    frames = [df for df in (loader(p) for p in paths) if df is not None and "Timestamp" in df.columns]
+    if not frames:
+        return None
+    if len(frames) == 1:
+        return frames[0]
+    return pd.concat(frames, ignore_index=True).sort_values("Timestamp", kind="stable").reset_index(drop=True)
@@ -1,12 +1,34 @@
 import os
 import re
 import glob
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional, Tuple
 import pandas as pd
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
-from dash import dcc, html, Input, Output, State
+from dash import ctx, dcc, html, no_update, Input, Output, State
+
+import catalog
+import colstore
+import csv_sink
+import downsample
+import partition
 from write import PREFIX_MAP
 
+CACHE_SIZE = 8            # parsed session files kept in memory
+TRACE_CACHE_SIZE = 256    # downsampled traces kept in memory
+
+_SESSIONS: "OrderedDict[Tuple[str, int, int], Optional[pd.DataFrame]]" = OrderedDict()
+_TRACES: OrderedDict = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+
+GRAPHS = ["b1-graph", "b1-raw-graph", "b2-graph", "b2-raw-graph", "env-b1-graph", "env-b2-graph", "lb-graph"]
+POINTS_PER_PX = 2
+DEFAULT_PLOT_WIDTH = 1200
+
 
 def layout(nav_fn):
     return html.Div(
@@ -23,6 +45,9 @@ def layout(nav_fn):
                     html.Label("Substance"),
                     dcc.Dropdown(id="r-substance", placeholder="Select substance"),
                     html.Br(),
+                    html.Label("Session"),
+                    dcc.Dropdown(id="r-session", placeholder="Newest session", clearable=False),
+                    html.Br(),
                     html.Label("Flowrate"),
                     dcc.Dropdown(id="r-flow", placeholder="Select flowrate"),
                     html.Br(),
@@ -58,7 +83,8 @@ def layout(nav_fn):
 
                     html.H4("Libelium Gases (LB1 + LB2)"),
                     dcc.Graph(id="lb-graph"),
-                    dcc.Store(id="r-file-paths")  
+                    dcc.Store(id="r-file-paths"),
+                    dcc.Store(id="r-plot-width")
                 ],
                 style={"maxWidth": "95%", "margin": "auto", "marginTop": "30px"},
             ),
@@ -68,31 +94,41 @@ def layout(nav_fn):
 
 def _discover_files(stage: str, substance: str):
     """
-    Inside <stage>/<substance>/ auto-pick the newest B csv and its paired LB csv.
+    Fallback when the session catalog is unavailable: the newest test under
+    <stage>/<substance>/ and its LB files.
 
-    Expected filenames (examples):
-      Test Today 2_B_Readings.csv
-      Test Today 2_LB_Readings.csv
+    Per-test folders (see partition.py):
+      Ethanol/<test_id>/Ethanol_B_Readings[_<day>].csv, Ethanol_LB1_Readings[_<day>].csv
+    Older cumulative files directly in the substance folder:
+      Test Today 2_B_Readings.csv, Test Today 2_LB_Readings.csv
 
     Returns:
-      dict with keys: {'b_csv': <path or None>, 'lb_csv': <path or None>, 'base': <str or None>}
+      dict with keys: {'b_csvs': [paths], 'lb_csvs': [paths]}
     """
     folder = os.path.join(stage, substance)
     if not os.path.isdir(folder):
-        return {"b_csv": None, "lb_csv": None, "base": None}
+        return {"b_csvs": [], "lb_csvs": []}
 
 
-    b_candidates = glob.glob(os.path.join(folder, "*_B_Readings.csv"))
+    b_candidates = [p for p in glob.glob(os.path.join(folder, "*_B_Readings*.csv")) +
+                    glob.glob(os.path.join(folder, "*", "*_B_Readings*.csv")) if not csv_sink.is_segment(p)]
     if not b_candidates:
 
         fallback = os.path.join(folder, f"{substance}_Readings.csv")
         if os.path.isfile(fallback):
-            return {"b_csv": fallback, "lb_csv": None, "base": None}
-        return {"b_csv": None, "lb_csv": None, "base": None}
+            return {"b_csvs": [fallback], "lb_csvs": []}
+        return {"b_csvs": [], "lb_csvs": []}
 
 
     newest_b = max(b_candidates, key=os.path.getmtime)
 
+    test_dir = os.path.dirname(newest_b)
+    if os.path.normpath(test_dir) != os.path.normpath(folder):
+        test_id = os.path.basename(test_dir)
+        return {"b_csvs": partition.parts(stage, substance, "B", test_id),
+                "lb_csvs": partition.parts(stage, substance, "LB1", test_id) +
+                           partition.parts(stage, substance, "LB2", test_id)}
+
     base = os.path.basename(newest_b).replace("_B_Readings.csv", "")
     lb_path = os.path.join(folder, f"{base}_LB_Readings.csv")
     if not os.path.isfile(lb_path):
@@ -100,101 +136,234 @@ def _discover_files(stage: str, substance: str):
         generic_lb = os.path.join(folder, f"{substance}_LB_Readings.csv")
         lb_path = generic_lb if os.path.isfile(generic_lb) else None
 
-    return {"b_csv": newest_b, "lb_csv": lb_path, "base": base}
+    return {"b_csvs": [newest_b], "lb_csvs": [lb_path] if lb_path else []}
+
+
+def _sessions(stage: str, substance: str):
+    """Catalogued sessions, newest first ([] if the catalog can't be read)."""
+    try:
+        return catalog.CATALOG.sessions(stage, substance)
+    except sqlite3.Error as e:
+        print(f"[read.py] session catalog unavailable: {e}")
+        return []
+
+
+def _session_files(sessions, test_id):
+    """
+    files_data for one catalogued session.  Tests recorded before per-test
+    folders share their substance's cumulative CSVs, so the session is also
+    bounded in time: from its first row up to the next session that starts in
+    any of its files (open-ended when no other test shares them).
+    """
+    s = next((s for s in sessions if s["test_id"] == test_id), None)
+    if s is None:
+        return None
+    paths = {p for ps in s["files"].values() for p in ps}
+    later = [o["t_first"] for o in sessions
+             if o is not s and o["t_first"] is not None and s["t_first"] is not None
+             and o["t_first"] > s["t_first"] and paths & {p for ps in o["files"].values() for p in ps}]
+    return {
+        "b_csvs": s["files"].get("B", []),
+        "lb_csvs": [p for k, ps in sorted(s["files"].items()) if k.startswith("LB") for p in ps],
+        "t_lo": int(s["t_first"]) if s["t_first"] is not None else None,
+        "t_hi": int(min(later)) if later else None,
+    }
+
+
+def _between(df, t_lo, t_hi):
+    """Rows of a Timestamp-sorted frame with t_lo <= time < t_hi (epoch seconds, either may be None)."""
+    if df is None or (t_lo is None and t_hi is None):
+        return df
+    ts = df["Timestamp"]
+    lo = ts.searchsorted(pd.Timestamp(datetime.fromtimestamp(t_lo)), side="left") if t_lo is not None else 0
+    hi = ts.searchsorted(pd.Timestamp(datetime.fromtimestamp(t_hi)), side="left") if t_hi is not None else len(df)
+    return df.iloc[lo:hi]
 
 
 def _safe_read_csv(path):
     try:
-        return pd.read_csv(path, on_bad_lines="skip")
+        return csv_sink.read_frame(path)
     except Exception as e:
         print(f"[read.py] CSV read error for {path}: {e}")
         return None
 
 
+def _session_source(path):
+    """The columnar copy's time file when it holds exactly the CSV's rows (colstore.current), else the CSV."""
+    if colstore.current(path):
+        return os.path.join(colstore.dir_for(path), colstore.TIME_FILE)
+    return path
+
+
+def _session_key(path):
+    """(source, newest mtime, total size); a CSV counts all its segments (see csv_sink)."""
+    src = _session_source(path)
+    try:
+        st = [os.stat(f) for f in (csv_sink.segments(path) if src == path else [src])]
+    except OSError:
+        return None
+    if not st:
+        return None
+    return os.path.abspath(src), max(s.st_mtime_ns for s in st), sum(s.st_size for s in st)
+
+
+def _load_session(path):
+    """
+    Parsed, typed session CSV: Timestamp as datetime64 (unparseable rows dropped),
+    sorted by time, every other column numeric.  Read from the columnar copy
+    when there is one (no parsing at all), else from the CSV.  Cached by
+    (path, mtime, size) with LRU eviction, so UI changes never re-read or
+    re-parse a file that has not changed.  The returned frame is shared:
+    filter it, don't modify it.
+    """
+    key = _session_key(path)
+    if key is None:
+        return None
+    with _CACHE_LOCK:
+        if key in _SESSIONS:
+            _SESSIONS.move_to_end(key)
+            return _SESSIONS[key]
+
+    if key[0].endswith(colstore.TIME_FILE):
+        try:
+            df = colstore.Session(os.path.dirname(key[0])).to_frame()
+            df = df.sort_values("Timestamp", kind="stable").reset_index(drop=True)
+        except (OSError, ValueError) as e:
+            print(f"[read.py] columnar read error for {path}: {e}")
+            df = None
+    else:
+        df = _safe_read_csv(path)
+    if df is not None and key[0] == os.path.abspath(path) and "Timestamp" in df.columns:
+        df["Timestamp"] = pd.to_datetime(df["Timestamp"], errors="coerce")
+        df = df.dropna(subset=["Timestamp"]).sort_values("Timestamp", kind="stable").reset_index(drop=True)
+        for c in df.columns:
+            if c != "Timestamp" and not pd.api.types.is_numeric_dtype(df[c]):
+                df[c] = _to_float_safe(df[c])
+
+    with _CACHE_LOCK:
+        for old in [k for k in _SESSIONS if k[0] == key[0]]:
+            del _SESSIONS[old]          # superseded by the file's new version
+        _SESSIONS[key] = df
+        while len(_SESSIONS) > CACHE_SIZE:
+            _SESSIONS.popitem(last=False)
+    return df
+
+
 def register_callbacks(app):
 
     @app.callback(Output("r-substance", "options"), Input("r-stage", "value"))
     def sub_opts(stage):
         if not stage:
             return []
-        p = os.path.join(stage)
-        subs = [d for d in os.listdir(p) if os.path.isdir(os.path.join(p, d))] if os.path.isdir(p) else []
+        try:
+            catalog.CATALOG.ensure_scanned(PREFIX_MAP)
+            subs = catalog.CATALOG.substances(stage)
+        except sqlite3.Error as e:
+            print(f"[read.py] session catalog unavailable: {e}")
+            p = os.path.join(stage)
+            subs = [d for d in os.listdir(p) if os.path.isdir(os.path.join(p, d))] if os.path.isdir(p) else []
         return [{"label": s, "value": s} for s in subs]
 
+    @app.callback(
+        Output("r-session", "options"),
+        Output("r-session", "value"),
+        Input("r-stage", "value"),
+        Input("r-substance", "value")
+    )
+    def session_opts(stage, sub):
+        if not (stage and sub):
+            return [], None
+        opts = []
+        for s in _sessions(stage, sub):
+            when = datetime.fromtimestamp(s["t_first"]).strftime("%Y-%m-%d %H:%M") if s["t_first"] else "?"
+            boards = "+".join(sorted(s["files"]))
+            opts.append({"label": f"{s['test_id'] or '(no test id)'} - {when} - {boards}, {s['rows']} rows",
+                         "value": s["test_id"]})
+        return opts, (opts[0]["value"] if opts else None)
+
     @app.callback(
         Output("r-file-paths", "data"),
         Output("r-flow", "options"),
         Input("r-stage", "value"),
-        Input("r-substance", "value")
+        Input("r-substance", "value"),
+        Input("r-session", "value")
     )
-    def discover_and_flows(stage, sub):
+    def discover_and_flows(stage, sub, test_id):
         if not (stage and sub):
             return None, []
 
+        sessions = _sessions(stage, sub)
+        found = _session_files(sessions, test_id) if test_id is not None else None
+        if found is not None:
+            flows = next(s["flowrates"] for s in sessions if s["test_id"] == test_id)
+            return found, [{"label": f"{f} L/min", "value": f} for f in flows]
+
+        # not catalogued: newest files in the folder
         found = _discover_files(stage, sub)
-        b_csv, lb_csv = found["b_csv"], found["lb_csv"]
 
         flows = set()
 
-        if b_csv and os.path.isfile(b_csv):
-            dfb = _safe_read_csv(b_csv)
-            if dfb is not None and "Flowrate (L/min)" in dfb.columns:
-                flows.update(dfb["Flowrate (L/min)"].dropna().unique().tolist())
-
-
-        if lb_csv and os.path.isfile(lb_csv):
-            dfl = _safe_read_csv(lb_csv)
-            if dfl is not None and "Flowrate (L/min)" in dfl.columns:
-                flows.update(dfl["Flowrate (L/min)"].dropna().unique().tolist())
+        for path in found["b_csvs"] + found["lb_csvs"]:
+            df = _load_session(path)
+            if df is not None and "Flowrate (L/min)" in df.columns:
+                flows.update(df["Flowrate (L/min)"].dropna().unique().tolist())
 
         flow_opts = [{"label": f"{f} L/min", "value": f} for f in sorted(flows)]
         return found, flow_opts
 
+    app.clientside_callback(
+        """function(_flow) {
+            var g = document.getElementById("b1-graph");
+            return (g && g.offsetWidth) || window.innerWidth;
+        }""",
+        Output("r-plot-width", "data"),
+        Input("r-flow", "value"),
+    )
+
     @app.callback(
-        Output("b1-graph", "figure"),
-        Output("b1-raw-graph", "figure"),
-        Output("b2-graph", "figure"),
-        Output("b2-raw-graph", "figure"),
-        Output("env-b1-graph", "figure"),
-        Output("env-b2-graph", "figure"),
-        Output("lb-graph", "figure"),
+        [Output(g, "figure") for g in GRAPHS],
         Input("r-flow", "value"),
         State("r-stage", "value"),
         State("r-substance", "value"),
-        State("r-file-paths", "data"),
+        Input("r-file-paths", "data"),
         Input("env-sensor-select", "value"),
+        Input("r-plot-width", "data"),
+        [Input(g, "relayoutData") for g in GRAPHS],
     )
-    def plot_all(flow, stage, sub, files_data, selected_sensors):
+    def plot_all(flow, stage, sub, files_data, selected_sensors, plot_width, *relayouts):
         empty_fig = go.Figure()
         if not all([stage, sub, flow]) or not files_data:
             return (empty_fig,)*7
 
-        b_csv = files_data.get("b_csv")
-        lb_csv = files_data.get("lb_csv")
+        # zoom/pan on one graph re-queries just that graph for the visible x range
+        zoomed = ctx.triggered_id if ctx.triggered_id in GRAPHS else None
+        x_range = None
+        if zoomed:
+            x_range = _x_range(relayouts[GRAPHS.index(zoomed)])
+            if x_range is None:
+                return (no_update,)*7
+        budget = _point_budget(plot_width)
+        revision = f"{stage}/{sub}/{files_data.get('t_lo')}/{flow}"
 
+        # every partition of the test (day files; LB1 + LB2) read as one time-sorted dataset
+        b_csvs = files_data.get("b_csvs") or []
+        lb_csvs = files_data.get("lb_csvs") or []
+        t_lo, t_hi = files_data.get("t_lo"), files_data.get("t_hi")
 
-        if not b_csv or not os.path.isfile(b_csv):
-            return (empty_fig,)*7
 
-        dfb = _safe_read_csv(b_csv)
-        if dfb is None or "Timestamp" not in dfb.columns or "Flowrate (L/min)" not in dfb.columns:
+        dfb = partition.load(b_csvs, _load_session)
+        if dfb is None or "Flowrate (L/min)" not in dfb.columns:
             return (empty_fig,)*7
-
-        
-        dfb["Timestamp"] = pd.to_datetime(dfb["Timestamp"], errors="coerce")
-        dfb = dfb.dropna(subset=["Timestamp"])
-        dfb = dfb[dfb["Flowrate (L/min)"] == flow].sort_values("Timestamp")
+        dfb = _between(dfb, t_lo, t_hi)
+        dfb = dfb[dfb["Flowrate (L/min)"] == flow]
 
     
-        dfl = None
-        if lb_csv and os.path.isfile(lb_csv):
-            dfl = _safe_read_csv(lb_csv)
-            if dfl is not None and "Timestamp" in dfl.columns and "Flowrate (L/min)" in dfl.columns:
-                dfl["Timestamp"] = pd.to_datetime(dfl["Timestamp"], errors="coerce")
-                dfl = dfl.dropna(subset=["Timestamp"])
-                dfl = dfl[dfl["Flowrate (L/min)"] == flow].sort_values("Timestamp")
-            else:
-                dfl = None  
+        dfl = partition.load(lb_csvs, _load_session)
+        if dfl is not None and "Flowrate (L/min)" in dfl.columns:
+            dfl = _between(dfl, t_lo, t_hi)
+            dfl = dfl[dfl["Flowrate (L/min)"] == flow]
+        else:
+            dfl = None
 
 
         def cols_startswith(prefix, suffix=None, contains_any=None):
@@ -223,35 +392,43 @@ def register_callbacks(app):
         humidity_cols = [c for c in dfb.columns if re.search(r"%$", c) and "humidity" in c.lower()]
         pressure_cols = [c for c in dfb.columns if c.endswith("KPa")]
 
+        sources = {id(dfb): (tuple(_session_key(p) for p in b_csvs), flow, t_lo, t_hi)}
+        if dfl is not None:
+            sources[id(dfl)] = (tuple(_session_key(p) for p in lb_csvs), flow, t_lo, t_hi)
+
+        def scatter(df, col, **kw):
+            x, y = _downsampled(df["Timestamp"], df[col], budget, x_range, memo=(sources[id(df)], col))
+            return go.Scatter(x=x, y=y, **kw)
+
         def create_fig(df, voltage_cols, ppm_cols, title):
             fig = make_subplots(specs=[[{"secondary_y": True}]])
             for v_col in voltage_cols:
                 sensor_id = v_col.replace(" - V", "")
                 fig.add_trace(
-                    go.Scatter(x=df["Timestamp"], y=df[v_col], name=v_col,
-                               mode="lines+markers", line_shape="spline", legendgroup=sensor_id),
+                    scatter(df, v_col, name=v_col,
+                            mode="lines+markers", line_shape="spline", legendgroup=sensor_id),
                     secondary_y=False
                 )
 
                 for g_col in [c for c in ppm_cols if sensor_id in c]:
                     fig.add_trace(
-                        go.Scatter(x=df["Timestamp"], y=_to_float_safe(df[g_col]),
-                                   name=g_col, mode="lines+markers",
-                                   line_shape="spline", legendgroup=sensor_id),
+                        scatter(df, g_col,
+                                name=g_col, mode="lines+markers",
+                                line_shape="spline", legendgroup=sensor_id),
                         secondary_y=True
                     )
             fig.update_xaxes(title_text="Time")
             fig.update_yaxes(title_text="Voltage (V)", secondary_y=False, range=[0, 5])
             fig.update_yaxes(title_text="ppm / ppb", secondary_y=True)
-            fig.update_layout(title=title, hovermode="x unified", height=500)
+            fig.update_layout(title=title, hovermode="x unified", height=500, uirevision=revision)
             return fig
 
         def create_env_fig(df, voltage_cols, title):
             fig = make_subplots(specs=[[{"secondary_y": True}]])
             for col in voltage_cols:
                 fig.add_trace(
-                    go.Scatter(x=df["Timestamp"], y=df[col], name=col,
-                               mode="lines+markers", line_shape="spline"),
+                    scatter(df, col, name=col,
+                            mode="lines+markers", line_shape="spline"),
                     secondary_y=False
                 )
 
@@ -261,9 +438,9 @@ def register_callbacks(app):
                 if sensor_type in selected_sensors:
                     for col in cols:
                         fig.add_trace(
-                            go.Scatter(x=df["Timestamp"], y=_to_float_safe(df[col]), name=col,
-                                       mode="lines+markers", line_shape="spline",
-                                       line=dict(dash="dash")),
+                            scatter(df, col, name=col,
+                                    mode="lines+markers", line_shape="spline",
+                                    line=dict(dash="dash")),
                             secondary_y=True
                         )
 
@@ -271,7 +448,7 @@ def register_callbacks(app):
             fig.update_yaxes(title_text="Gas Sensor Voltage (V)", secondary_y=False, range=[0, 5])
             fig.update_yaxes(title_text="Unit", secondary_y=True)
             fig.update_layout(title=title, height=600, hovermode="x unified",
-                              legend=dict(orientation="h", x=0, y=-0.2))
+                              legend=dict(orientation="h", x=0, y=-0.2), uirevision=revision)
             return fig
 
         def create_raw_fig(df, raw_cols, sensor_hints, title):
@@ -279,9 +456,9 @@ def register_callbacks(app):
             for col in raw_cols:
                
                 sensor_name = next((s for s in sensor_hints if s in col), col)
-                fig.add_trace(go.Scatter(
-                    x=df["Timestamp"],
-                    y=_to_float_safe(df[col]),
+                fig.add_trace(scatter(
+                    df,
+                    col,
                     mode="lines+markers",
                     name=sensor_name,
                     line_shape="spline"
@@ -292,22 +469,14 @@ def register_callbacks(app):
                 yaxis_title="Raw Value",
                 yaxis=dict(range=[0, 1023]),
                 height=400,
-                hovermode="x unified"
+                hovermode="x unified",
+                uirevision=revision
             )
             return fig
 
-
-        fig_b1 = create_fig(dfb, voltage_b1, ppm_b1, "B1 Voltage + Gas")
-        fig_b1_raw = create_raw_fig(dfb, raw_b1, ["TGS2600", "TGS2602", "TGS2603", "MQ2"], "B1 Raw Data")
-        fig_b2 = create_fig(dfb, voltage_b2, ppm_b2, "B2 Voltage + Gas")
-        fig_b2_raw = create_raw_fig(dfb, raw_b2, ["TGS2610", "TGS2611", "TGS2612", "MQ9"], "B2 Raw Data")
-        fig_env_b1 = create_env_fig(dfb, voltage_b1, "Environmental Sensors B1")
-        fig_env_b2 = create_env_fig(dfb, voltage_b2, "Environmental Sensors B2")
-
-
-        if dfl is None or dfl.empty:
-            fig_lb = empty_fig
-        else:
+        def create_lb_fig():
+            if dfl is None or dfl.empty:
+                return empty_fig
 
             gases = ["NO", "CO", "NO2", "NH3", "O2"]
             fig_lb = go.Figure()
@@ -316,26 +485,90 @@ def register_callbacks(app):
                 lb2_col = _first_match(dfl.columns, rf"^LB2\s*-\s*{gas}\s*\((ppm|%)\)$")
 
                 if lb1_col:
-                    fig_lb.add_trace(go.Scatter(
-                        x=dfl["Timestamp"],
-                        y=_to_float_safe(dfl[lb1_col]),
+                    fig_lb.add_trace(scatter(
+                        dfl,
+                        lb1_col,
                         name=f"LB1 - {gas}",
                         mode="lines+markers",
                         line_shape="spline"
                     ))
                 if lb2_col:
-                    fig_lb.add_trace(go.Scatter(
-                        x=dfl["Timestamp"],
-                        y=_to_float_safe(dfl[lb2_col]),
+                    fig_lb.add_trace(scatter(
+                        dfl,
+                        lb2_col,
                         name=f"LB2 - {gas}",
                         mode="lines+markers",
                         line_shape="spline"
                     ))
             fig_lb.update_layout(title="Libelium Gases (LB1 + LB2)",
                                  xaxis_title="Time", yaxis_title="Concentration",
-                                 height=500, hovermode="x unified")
+                                 height=500, hovermode="x unified", uirevision=revision)
+            return fig_lb
 
-        return fig_b1, fig_b1_raw, fig_b2, fig_b2_raw, fig_env_b1, fig_env_b2, fig_lb
+        builders = {
+            "b1-graph": lambda: create_fig(dfb, voltage_b1, ppm_b1, "B1 Voltage + Gas"),
+            "b1-raw-graph": lambda: create_raw_fig(dfb, raw_b1, ["TGS2600", "TGS2602", "TGS2603", "MQ2"], "B1 Raw Data"),
+            "b2-graph": lambda: create_fig(dfb, voltage_b2, ppm_b2, "B2 Voltage + Gas"),
+            "b2-raw-graph": lambda: create_raw_fig(dfb, raw_b2, ["TGS2610", "TGS2611", "TGS2612", "MQ9"], "B2 Raw Data"),
+            "env-b1-graph": lambda: create_env_fig(dfb, voltage_b1, "Environmental Sensors B1"),
+            "env-b2-graph": lambda: create_env_fig(dfb, voltage_b2, "Environmental Sensors B2"),
+            "lb-graph": create_lb_fig,
+        }
+        if zoomed:
+            return tuple(builders[g]() if g == zoomed else no_update for g in GRAPHS)
+        return tuple(builders[g]() for g in GRAPHS)
+
+
+def _point_budget(plot_width) -> int:
+    """Points per trace: POINTS_PER_PX per pixel of plot width (min/max needs two per bucket)."""
+    return max(downsample.MIN_BUDGET, int((plot_width or DEFAULT_PLOT_WIDTH) * POINTS_PER_PX))
+
+
+def _x_range(relayout):
+    """
+    x-axis window from a graph's relayoutData, as int64 ns:
+      (lo, hi)  zoomed or panned
+      ()        autorange (double-click): back to the whole session
+      None      not an x-axis change (initial autosize, y-only zoom)
+    """
+    if not relayout:
+        return None
+    if relayout.get("xaxis.autorange"):
+        return ()
+    lo, hi = relayout.get("xaxis.range[0]"), relayout.get("xaxis.range[1]")
+    if lo is None and isinstance(relayout.get("xaxis.range"), list):
+        lo, hi = relayout["xaxis.range"][:2]
+    if lo is None or hi is None:
+        return None
+    try:
+        return pd.Timestamp(lo).value, pd.Timestamp(hi).value
+    except (TypeError, ValueError):
+        return None
+
+
+def _downsampled(ts, y, budget, x_range=None, memo=None):
+    """
+    (x, y) of one trace, clipped to ``x_range`` and reduced to ``budget`` points.
+    With ``memo`` (session key, flow, column) the result is kept in a small LRU,
+    so redrawing an unchanged trace (e.g. after an env-sensor toggle) is free.
+    """
+    key = memo and (memo, budget, x_range)
+    if key:
+        with _CACHE_LOCK:
+            if key in _TRACES:
+                _TRACES.move_to_end(key)
+                return _TRACES[key]
+    x = ts.to_numpy(dtype="datetime64[ns]").view("int64")
+    yv = pd.to_numeric(y, errors="coerce").to_numpy(dtype=float)
+    sl = downsample.clip(x, x_range)
+    idx = downsample.select(x[sl], yv[sl], budget)
+    out = ts.iloc[sl].iloc[idx], yv[sl][idx]
+    if key:
+        with _CACHE_LOCK:
+            _TRACES[key] = out
+            while len(_TRACES) > TRACE_CACHE_SIZE:
+                _TRACES.popitem(last=False)
+    return out
 
 
 def _first_match(columns, pattern):
@@ -346,19 +579,26 @@ def _first_match(columns, pattern):
     return None
 
 
+UNIT_SAMPLE = 64   # cells inspected to tell plain-number columns from unit-suffixed ones
+_NUMBER_RE = re.compile(r"([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)")
+
+
 def _to_float_safe(series):
     """
-    Convert a series that might contain strings like '1.23 ppm' to float safely.
+    Convert a series that might contain strings like '35.78 °C' or '95131.39 Pa'
+    to float64 (NaN where a cell has no number).  A sample decides the path:
+    columns of plain numbers go straight to pd.to_numeric; anything else is
+    unit-stripped with one vectorized ``str.extract``.
     """
-    def _num(x):
-        if pd.isna(x):
-            return None
-        if isinstance(x, (int, float)):
-            return x
-        
-        s = re.sub(r"[^0-9\.\-]+", "", str(x))
-        try:
-            return float(s) if s not in ("", "-", ".", "-.") else None
-        except Exception:
-            return None
-    return series.apply(_num)
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype(float)
+    sample = series.dropna().head(UNIT_SAMPLE)
+    if pd.to_numeric(sample, errors="coerce").notna().all():
+        out = pd.to_numeric(series, errors="coerce")
+        todo = out.isna() & series.notna()
+        if not todo.any():
+            return out.astype(float)
+        series = series[todo]
+        out[todo] = pd.to_numeric(series.astype(str).str.extract(_NUMBER_RE, expand=False), errors="coerce")
+        return out.astype(float)
+    return pd.to_numeric(series.astype(str).str.extract(_NUMBER_RE, expand=False), errors="coerce").astype(float)
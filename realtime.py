@@ -1,30 +1,35 @@
 #realtime.py
 
 
-import os, re, json, threading, time
+import os, threading, time
 from datetime import datetime
-from typing import Dict, Optional, List, Tuple
+from typing import Dict, Optional, List
 
-import pandas as pd
-import serial
-from dash import dcc, html, Input, Output, State
+from dash import ctx, dcc, html, no_update, Input, Output, State
 from dash.dependencies import ALL
+from dash.exceptions import PreventUpdate
 import plotly.graph_objs as go
+from flask import Response
 
 import b_write
+import fakeboard
+import firebase_sink
+import ingest
 import lb_write
+import livebus
+from block_parser import clean_line, is_new_data, parse_pair
+from ringbuf import RingBuffer
 
 PREFIX_MAP = {"Testing": "T", "Experiment": "E", "Deployment": "D", "Baseline": "B"}
 BAUD_ARDUINO = 9600
+MAX_POINTS = int(os.getenv("LIVE_MAX_POINTS", "3600"))   # per trace, in the browser and on a rebuild
+STATUS_S = 0.75       # status check cadence while a capture runs (was the rt-tick interval)
+HEARTBEAT_S = 15.0    # keeps proxies from closing an idle stream and detects closed tabs
 
-_PREVIEW_THREADS: Dict[str, Tuple[threading.Thread, threading.Event]] = {}
-_LIVE_DATA: Dict[str, List[dict]] = {"B1": [], "B2": []}
-
-def _clean_text(s: str) -> str:
-    return re.sub(r"[^\x00-\x7F°]", "", s or "")
-
-def _extract_numeric(value: str) -> str:
-    return re.sub(r"[^\d\.]+", "", value or "")
+_PREVIEW_READERS: Dict[str, "_BPreviewReader"] = {}
+_LIVE_DATA: Dict[str, RingBuffer] = {"B1": RingBuffer(), "B2": RingBuffer()}
+_STATUS = {"last": None, "thread": None}     # last status pushed, and the pusher thread
+_STATUS_LOCK = threading.Lock()
 
 def _stage_letter(stage: str) -> str:
     return PREFIX_MAP.get(stage, "X")
@@ -34,106 +39,165 @@ def _make_test_id(stage: str, substance: Optional[str]) -> str:
     return f"{_stage_letter(stage)}_{sub}_{datetime.now().strftime('%H-%M-%S %d-%m-%Y')}"
 
 def _prime_firebase() -> str:
-    try:
-        import firebase_admin
-        from firebase_admin import credentials
-
-        if firebase_admin._apps:
-            return "online"
-
-        db_url = os.getenv("DATABASE_URL") or os.getenv("databaseURL")
-        if not db_url:
-            return "offline: no DATABASE_URL"
-
-        key_blob = os.getenv("FIREBASE_KEY")
-        if key_blob:
-            svc = json.loads(key_blob)
-            if "private_key" in svc and isinstance(svc["private_key"], str):
-
-                svc["private_key"] = svc["private_key"].replace("\\n", "\n")
-            cred = credentials.Certificate(svc)
-        else:
-            key_path = (
-                os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
-                or os.getenv("FIREBASE_CREDENTIALS_PATH")
-                or "serviceAccountKey.json"
-            )
-            cred = credentials.Certificate(key_path)
-
-        firebase_admin.initialize_app(cred, {"databaseURL": db_url})
-        print("[Firebase] Initialized (realtime)")
-        return "online"
-    except Exception as e:
-        print(f"[Firebase init error (realtime)] {e}")
-        return f"offline: {e}"
+    """Connect the shared sink (or retry after its backoff) and report its status."""
+    firebase_sink.SINK.init()
+    return firebase_sink.SINK.status_text()
+
+def _capturing() -> bool:
+    return b_write.BOARDS.run.active or lb_write.BOARDS.run.active
+
+def _status_view():
+    """Progress-bar style and board status text shown while a capture runs."""
+    b_snap = b_write.snapshot()
+    lb_snap = lb_write.snapshot()
+
+    pct = b_snap.get("pct", 0) or 0
+    style = {
+        "height": "22px",
+        "width": f"{pct}%",
+        "background": "#28a745",
+        "color": "white",
+        "textAlign": "center",
+        "fontSize": "12px",
+        "display": "block"
+    }
+    if b_snap.get("first_read_epoch") is None:
+        style["width"] = "0%"
+    lines: List[str] = []
+
+    fb = firebase_sink.SINK.status_text()
+    if fb:
+        lines.append(f"Firebase: {fb}")
+
+    if b_snap.get("first_read_epoch") is None:
+        lines.append("B-family: waiting for first reading...")
+    for ln in (b_snap.get("status_lines", []) + lb_snap.get("status_lines", [])):
+        if ln and ln not in lines:
+            lines.append(ln)
+
+    return style, "\n".join(lines)
+
+def _kick_status():
+    """Run the status pusher if it is not running (a stream opened or a capture started)."""
+    with _STATUS_LOCK:
+        t = _STATUS["thread"]
+        if t is None or not t.is_alive():
+            t = _STATUS["thread"] = threading.Thread(target=_push_status, name="live-status", daemon=True)
+            t.start()
+
+def _push_status():
+    """
+    One thread for every open stream: while a capture runs and a tab listens,
+    check the status every STATUS_S and publish it on livebus only when it
+    changed; the status after a capture stops is published once, then the
+    thread exits until the next _kick_status().
+    """
+    while True:
+        if _capturing() or _STATUS["last"] is not None:
+            status = _status_view()
+            if status != _STATUS["last"]:
+                _STATUS["last"] = status
+                livebus.BUS.publish("status", {"style": status[0], "text": status[1]})
+        with _STATUS_LOCK:
+            if not _capturing() or not livebus.BUS.subscribers:
+                _STATUS["thread"] = None
+                return
+        time.sleep(STATUS_S)
 
 #B1/B2 live preview
-def _b_preview_reader(board_id: str, com_port: str, stop_evt: threading.Event):
-    ser = None
-    try:
-        ser = serial.Serial(com_port, BAUD_ARDUINO, timeout=1)
-        time.sleep(1.5)
-        print(f"[Preview] {board_id} opened {com_port}")
-    except Exception as e:
-        print(f"[Preview ERROR] Could not open {com_port} for {board_id}: {e}")
-        return
-
-    current = {}
-    try:
-        while not stop_evt.is_set():
-            try:
-                raw = ser.readline().decode("utf-8", errors="ignore")
-            except Exception:
-                time.sleep(0.1); continue
-
-            line = _clean_text((raw or "").strip())
-            if not line:
-                continue
-
-            if line == "New Data":
-                if current:
-                    row = {"Timestamp": datetime.now()}
-                    row.update(current)
-                    _LIVE_DATA.setdefault(board_id, []).append(row)
-                current = {}
-                continue
-
-            parts = [p.strip() for p in line.split(":", maxsplit=1)]
-            if len(parts) != 2:
-                continue
-            key, val = parts
-            val_clean = val.strip()
-
-            m = re.search(r"([\d\.]+)\s*(ppm|ppb|%)", val_clean, re.IGNORECASE)
-            if m:
-                value = float(m.group(1)); unit = m.group(2).lower()
-                current[f"{board_id} - {key.strip()} ({unit})"] = value
-                continue
-
-            if re.match(r"^(TGS|MQ)", key.strip(), re.IGNORECASE):
-                try:
-                    value = float(_extract_numeric(val_clean))
-                    current[f"{board_id} - {key.strip()} (raw)"] = value
-                except Exception:
-                    pass
-                continue
-
-            if val_clean.endswith("V"):
-                try:
-                    v = float(val_clean[:-1].strip())
-                    current[f"{board_id} - {key.strip()} - V"] = v
-                    continue
-                except Exception:
-                    pass
-
-            current[f"{board_id} - {key.strip()}"] = val_clean
-    finally:
-        try:
-            if ser and ser.is_open:
-                ser.close()
-                print(f"[Preview] {board_id} closed {com_port}")
-        except Exception:
-            pass
+class _BPreviewReader:
+    """Feeds _LIVE_DATA (and the push stream) for one board; lines arrive from the shared ingest engine."""
+    def __init__(self, board_id: str, com_port, fake: bool = False):
+        self.board_id = board_id
+        self.com_port = com_port
+        self.key = f"preview:{board_id}"
+        self.current = {}
+        self._open = False
+        self._port = fakeboard.FakeSource() if fake else com_port
+
+    def start(self):
+        _LIVE_DATA[self.board_id] = RingBuffer()      # a new preview does not continue the last one's plot
+        ingest.ENGINE.add(self.key, self._port, BAUD_ARDUINO, self.feed_line,
+                          self._on_status, self._on_close)
+
+    def stop(self):
+        ingest.ENGINE.remove(self.key)
+
+    def join(self, timeout: Optional[float] = None):
+        ingest.ENGINE.wait_closed(self.key, timeout or 2.0)
+
+    def _on_status(self, status: str):
+        if status == "listening":
+            print(f"[Preview] {self.board_id} opened {self.com_port}")
+        elif status.startswith("error open"):
+            print(f"[Preview ERROR] Could not open {self.com_port} for {self.board_id}: {status[12:]}")
+        elif status.startswith("error"):
+            print(f"[Preview ERROR] {self.board_id}: {status}")
+
+    def _on_close(self):
+        print(f"[Preview] {self.board_id} closed {self.com_port}")
+
+    def feed_line(self, raw: bytes, arrived: float):
+        line = clean_line(raw)
+
+        # the empty line (or a legacy "*") closes a B block; emitting there rather than at the next "New Data" saves a board period
+        if not line or line[0] == "*":
+            if self._open and self.current: self._emit(arrived)
+            else: self.current = {}
+            self._open = False
+            return
+        # readings already collected are Board1's BME688 section, which belongs to this block
+        if is_new_data(line):
+            if self._open and self.current: self._emit(arrived)
+            self._open = True
+            return
+
+        tup = parse_pair(line)
+        if tup:
+            label, value, unit = tup
+            self.current[_preview_column(self.board_id, label, unit)] = value
+
+    def _emit(self, arrived: float):
+        _LIVE_DATA.setdefault(self.board_id, RingBuffer()).append(arrived, self.current)
+        if livebus.BUS.subscribers:
+            livebus.BUS.publish("reading", {"board": self.board_id, "t": arrived, "values": {
+                c: v for c, v in self.current.items() if _is_plotted(c)}})
+        self.current = {}
+
+
+def _preview_column(board_id: str, label: str, unit: Optional[str]) -> str:
+    u = (unit or "").lower()
+    if u in ("ppm", "ppb", "%"):
+        return f"{board_id} - {label} ({u})"
+    if label[:3].upper() == "TGS" or label[:2].upper() == "MQ":
+        return f"{board_id} - {label} (raw)"
+    if unit == "V":
+        return f"{board_id} - {label} - V"
+    return f"{board_id} - {label}"
+
+def _is_plotted(col: str) -> bool:
+    return any(tok in col.lower() for tok in ["ppm", "ppb", "(raw)", "- v"])
+
+def _json_floats(a) -> list:
+    return [None if v != v else v for v in a.tolist()]   # NaN -> null
+
+def _live_graph(col: str, x, y, t0: float):
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=_json_floats(x), y=_json_floats(y), mode="lines+markers", name="Live"))
+    if col.endswith("(raw)"):
+        fig.update_yaxes(range=[0, 1023])
+    if col.lower().endswith("- v"):
+        fig.update_yaxes(range=[0, 5])
+    fig.update_layout(
+        title=col,
+        xaxis_title="Elapsed time (s)",
+        yaxis_title="Value",
+        margin=dict(l=40, r=10, t=50, b=40),
+        height=350,
+        meta={"t0": t0, "max_points": MAX_POINTS}   # read by assets/live_stream.js
+    )
+    return html.Div([dcc.Graph(id={"type": "rt-graph", "index": col}, figure=fig)],
+                    style={"width": "48%", "display": "inline-block", "margin": "1%"})
 
 def _board_row(board_id: str, default_baud_label: str):
     return html.Div([
@@ -211,9 +275,12 @@ def layout(nav):
         html.H4("Realtime B1 / B2"),
         html.Div(id="rt-graphs", style={"marginTop": "10px"}),
 
-        dcc.Interval(id="rt-tick", interval=750, n_intervals=0),
-        dcc.Interval(id="rt-plot-tick", interval=2000, n_intervals=0),
+        # polling fallback only: assets/live_stream.js turns these on while /live/stream is down
+        dcc.Interval(id="rt-tick", interval=750, n_intervals=0, disabled=True),
+        dcc.Interval(id="rt-plot-tick", interval=2000, n_intervals=0, disabled=True),
         dcc.Store(id="rt-session"),
+        dcc.Store(id="rt-plot-cursor"),
+        dcc.Store(id="rt-plot-refresh"),
         dcc.Store(id="rt-preview-running")
     ])
 
@@ -236,6 +303,7 @@ def register_callbacks(app):
     @app.callback(
         Output("rt-status", "children"),
         Output("rt-preview-running", "data"),
+        Output("rt-plot-refresh", "data"),
         Input("rt-preview", "n_clicks"),
         State("rt-stage", "value"),
         State("rt-substance", "value"),
@@ -252,32 +320,30 @@ def register_callbacks(app):
         preview_ports = {b: com_map.get(b) for b in ("B1", "B2")
                          if enabled_map.get(b) and com_map.get(b)}
         if not preview_ports:
-            return "To preview graphs, enable B1/B2 and set their COM ports.", {}
+            return "To preview graphs, enable B1/B2 and set their COM ports.", {}, no_update
 
         for bid, port in preview_ports.items():
-            if bid not in _PREVIEW_THREADS:
-                stop_evt = threading.Event()
-                t = threading.Thread(target=_b_preview_reader, args=(bid, port, stop_evt), daemon=True)
-                _PREVIEW_THREADS[bid] = (t, stop_evt)
-                t.start()
+            if bid not in _PREVIEW_READERS:
+                r = _BPreviewReader(bid, port)
+                _PREVIEW_READERS[bid] = r
+                r.start()
 
         sub = "baseline" if stage == "Baseline" else (substance or "").title()
         return f"Preview running for {', '.join(preview_ports.keys())} — Stage: {stage}, Substance: {sub}", {
             "previewing": list(preview_ports.keys())
-        }
+        }, time.time()     # drop the graphs of the last preview
 
     def _stop_preview_for(b_boards: List[str]):
         for bid in b_boards:
-            tup = _PREVIEW_THREADS.get(bid)
-            if not tup:
+            r = _PREVIEW_READERS.get(bid)
+            if not r:
                 continue
-            t, stop_evt = tup
             try:
-                stop_evt.set()
-                t.join(timeout=2.0)
+                r.stop()
+                r.join(timeout=2.0)
             except Exception:
                 pass
-            _PREVIEW_THREADS.pop(bid, None)
+            _PREVIEW_READERS.pop(bid, None)
 
     @app.callback(
         Output("rt-status", "children", allow_duplicate=True),
@@ -335,6 +401,7 @@ def register_callbacks(app):
                                    flowrate=flow, interval=inter, ports=ports_lb,
                                    duration_sec=duration_sec)
 
+        _kick_status()
         extra = " (LB may take ~2–3 min to warm up)" if any(ports_lb.values()) else ""
         status = f"{fb_line}\nCapture started. test_id: {test_id}. " \
                  f"B: {', '.join([k for k,v in ports_b.items() if v]) or '-'}; " \
@@ -353,10 +420,10 @@ def register_callbacks(app):
     def _stop(_n):
         b_write.stop_capture()
         lb_write.stop_capture()
-        for bid in list(_PREVIEW_THREADS.keys()):
-            t, ev = _PREVIEW_THREADS.pop(bid)
+        for bid in list(_PREVIEW_READERS.keys()):
+            r = _PREVIEW_READERS.pop(bid)
             try:
-                ev.set(); t.join(timeout=2.0)
+                r.stop(); r.join(timeout=2.0)
             except Exception:
                 pass
         return "Stopped capture for B and LB."
@@ -371,77 +438,92 @@ def register_callbacks(app):
     def _tick(_n, sess):
         if not sess or not sess.get("running"):
             return {"display": "none"}, ""
-
-        b_snap = b_write.snapshot()
-        lb_snap = lb_write.snapshot()
-
-        pct = b_snap.get("pct", 0) or 0
-        style = {
-            "height": "22px",
-            "width": f"{pct}%",
-            "background": "#28a745",
-            "color": "white",
-            "textAlign": "center",
-            "fontSize": "12px",
-            "display": "block"
-        }
-        if b_snap.get("first_read_epoch") is None:
-            style["width"] = "0%"
-        lines: List[str] = []
-   
-        fb = _prime_firebase()
-        if fb:
-            lines.append(f"Firebase: {fb}")
-
-        if b_snap.get("first_read_epoch") is None:
-            lines.append("B-family: waiting for first reading...")
-        for ln in (b_snap.get("status_lines", []) + lb_snap.get("status_lines", [])):
-            if ln and ln not in lines:
-                lines.append(ln)
-
-        return style, "\n".join(lines)
+        # while any tab streams, the status pusher has already built it
+        with _STATUS_LOCK: pushing = _STATUS["thread"] is not None
+        if pushing and _STATUS["last"] is not None:
+            return _STATUS["last"]
+        return _status_view()
 
     @app.callback(
         Output("rt-graphs", "children"),
+        Output({"type": "rt-graph", "index": ALL}, "extendData"),
+        Output("rt-plot-cursor", "data"),
         Input("rt-plot-tick", "n_intervals"),
+        Input("rt-plot-refresh", "data"),
+        State("rt-plot-cursor", "data"),
+        State({"type": "rt-graph", "index": ALL}, "id"),
         prevent_initial_call=True
     )
-    def _update_graphs(_n):
-        graphs = []
-
-        for b in ("B1", "B2"):
-            if not _LIVE_DATA.get(b):
-                continue
-            df = pd.DataFrame(_LIVE_DATA[b])
-            if df.empty or "Timestamp" not in df.columns:
-                continue
-
-            df["Timestamp"] = pd.to_datetime(df["Timestamp"])
-            df = df.sort_values("Timestamp")
-            t0 = df["Timestamp"].min()
-
-            for col in df.columns:
-                if col == "Timestamp":
+    def _update_graphs(_n, _refresh, cursor, graph_ids):
+        """Append only the rows this client has not seen; rebuild only when the column set changes."""
+        if ctx.triggered_id == "rt-plot-refresh":
+            cursor = None      # the push stream found a column with no graph yet
+        cursor = cursor or {}
+        seen = cursor.get("boards", {})
+        series = [(b, col) for b in ("B1", "B2") if b in _LIVE_DATA
+                  for col in _LIVE_DATA[b].columns() if _is_plotted(col)]
+        rebuild = [list(s) for s in series] != cursor.get("series") or any(
+            seen.get(b, {}).get("count", 0) > _LIVE_DATA[b].count for b in seen if b in _LIVE_DATA)
+
+        if rebuild:
+            graphs, boards = [], {}
+            for b in ("B1", "B2"):
+                buf = _LIVE_DATA.get(b)
+                if buf is None or not len(buf):
                     continue
-                if not any(tok in col.lower() for tok in ["ppm", "ppb", "(raw)", "- v"]):
-                    continue
-
-                fig = go.Figure()
-                fig.add_trace(go.Scatter(
-                    x=(df["Timestamp"] - t0).dt.total_seconds(),
-                    y=df[col], mode="lines+markers", name="Live"
-                ))
-                if col.endswith("(raw)"):
-                    fig.update_yaxes(range=[0, 1023])
-                if col.lower().endswith("- v"):
-                    fig.update_yaxes(range=[0, 5])
-                fig.update_layout(
-                    title=col,
-                    xaxis_title="Elapsed time (s) — full session",
-                    yaxis_title="Value",
-                    margin=dict(l=40, r=10, t=50, b=40),
-                    height=350
-                )
-                graphs.append(html.Div([dcc.Graph(figure=fig)],
-                                       style={"width": "48%", "display": "inline-block", "margin": "1%"}))
-        return graphs
+                t, cols = buf.window(MAX_POINTS)
+                boards[b] = {"count": buf.count, "t0": float(t[0])}
+                for col in cols:
+                    if _is_plotted(col):
+                        graphs.append(_live_graph(col, t - t[0], cols[col], float(t[0])))
+            return graphs, [no_update] * len(graph_ids), {"series": [list(s) for s in series], "boards": boards}
+
+        extend, boards, new_rows = [], dict(seen), {}
+        for b, st in seen.items():
+            count, window = _LIVE_DATA[b].since(st["count"])
+            new_rows[b] = window
+            boards[b] = {"count": count, "t0": st["t0"]}
+        for gid in graph_ids:
+            col = gid["index"]
+            b = col.split(" - ", 1)[0]
+            t, cols = new_rows.get(b, (None, {}))
+            if t is None or not len(t) or col not in cols:
+                extend.append(no_update); continue
+            extend.append([{"x": [_json_floats(t - seen[b]["t0"])], "y": [_json_floats(cols[col])]}, [0], MAX_POINTS])
+        if all(e is no_update for e in extend):
+            raise PreventUpdate
+        return no_update, extend, {"series": cursor.get("series"), "boards": boards}
+
+    def _stream():
+        """Server-Sent Events: every preview block as it is parsed, plus capture status when it changes."""
+        sub = livebus.BUS.subscribe()
+        _kick_status()
+
+        def _events():
+            try:
+                yield "retry: 2000\n\n"
+                last = _STATUS["last"]
+                if last is not None and _capturing():
+                    yield livebus.sse("status", {"style": last[0], "text": last[1]})
+                while True:
+                    events = sub.get(HEARTBEAT_S)
+                    for ev, data in events:
+                        yield livebus.sse(ev, data)
+                    if not events:
+                        yield ": ping\n\n"
+            finally:
+                sub.close()
+
+        return Response(_events(), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    app.server.add_url_rule("/live/stream", "rt_live_stream", _stream)
+
+
+def start_fake_preview(boards: List[str] = ("B1", "B2")):
+    """Preview from fakeboard.FakeSource instead of COM ports, to exercise the live page without boards."""
+    for bid in boards:
+        if bid not in _PREVIEW_READERS:
+            r = _BPreviewReader(bid, "fake", fake=True)
+            _PREVIEW_READERS[bid] = r
+            r.start()
@@ -0,0 +1,95 @@
+#ringbuf.py
+"""
+Fixed-capacity columnar ring buffer for live previews.
+
+One RingBuffer per board holds arrival times (epoch seconds) and one float64
+column per registered series name, all preallocated, so memory stays constant
+however long a preview runs.  Every row is written twice, at ``i`` and
+``i + capacity``; the newest ``n`` rows are therefore always one contiguous
+slice and ``window()`` returns views, never copies.  Columns first seen
+mid-session read NaN for earlier rows.
+
+``count`` only ever grows (rows appended since creation/clear), so it doubles
+as a cursor: ``since(cursor)`` returns just the rows a reader has not seen.
+"""
+import os, threading
+from typing import Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+CAPACITY = int(os.getenv("LIVE_CAPACITY", "43200"))   # 12 h at one block per second
+
+Window = Tuple[np.ndarray, Dict[str, np.ndarray]]
+
+
+class RingBuffer:
+    def __init__(self, capacity: int = CAPACITY, n_cols: int = 16):
+        self.capacity = max(1, int(capacity))
+        self.count = 0
+        self._t = np.full(2 * self.capacity, np.nan)
+        self._data = np.full((max(1, n_cols), 2 * self.capacity), np.nan)
+        self._cols: Dict[str, int] = {}      # column registry: name -> row of _data
+        self._lock = threading.Lock()
+
+    # ----- writer side -----
+    def _column(self, name: str) -> int:
+        idx = self._cols.get(name)
+        if idx is None:
+            idx = len(self._cols)
+            if idx >= self._data.shape[0]:
+                grown = np.full((2 * self._data.shape[0], self._data.shape[1]), np.nan)
+                grown[:self._data.shape[0]] = self._data
+                self._data = grown
+            self._cols[name] = idx
+        return idx
+
+    def append(self, t: float, values: Mapping[str, float]):
+        with self._lock:
+            i = self.count % self.capacity
+            j = i + self.capacity
+            self._t[i] = self._t[j] = t
+            self._data[:, i] = self._data[:, j] = np.nan
+            for name, v in values.items():
+                c = self._column(name)
+                self._data[c, i] = self._data[c, j] = v
+            self.count += 1
+
+    def clear(self):
+        with self._lock:
+            self.count = 0
+            self._t.fill(np.nan); self._data.fill(np.nan)
+            self._cols.clear()
+
+    # ----- reader side -----
+    def __len__(self) -> int:
+        return min(self.count, self.capacity)
+
+    def columns(self) -> List[str]:
+        with self._lock:
+            return list(self._cols)
+
+    def _slice(self, n: int) -> slice:
+        end = (self.count - 1) % self.capacity + self.capacity + 1
+        return slice(end - n, end)
+
+    def window(self, n: Optional[int] = None) -> Window:
+        """Newest ``n`` rows (default: all retained) as zero-copy views, oldest first.
+
+        Views alias the buffer; copy them if they must outlive the next capacity appends.
+        """
+        with self._lock:
+            return self._window(len(self) if n is None else int(n))
+
+    def since(self, cursor: int) -> Tuple[int, Window]:
+        """Rows appended after ``cursor`` (a previous ``count``) still in the buffer, and the new cursor.
+
+        A cursor ahead of ``count`` (the buffer was cleared since) starts over from the oldest row.
+        """
+        with self._lock:
+            cursor = int(cursor)
+            return self.count, self._window(self.count - cursor if 0 <= cursor <= self.count else self.count)
+
+    def _window(self, n: int) -> Window:
+        n = max(0, min(n, len(self)))
+        s = self._slice(n) if n else slice(0, 0)
+        return self._t[s], {c: self._data[i, s] for c, i in self._cols.items()}
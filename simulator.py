@@ -0,0 +1,301 @@
+#simulator.py
+"""
+Pseudo-terminal board simulator (Linux) for load-testing the capture stack.
+
+Each simulated board is a pty pair: the capture code opens the slave path as
+if it were the board's serial port and the simulator writes to the master what
+the firmware prints each cycle,
+
+    Board1 (src/main.cpp)              Board2 (src/main.cpp)   Libelium_board_*.pde
+                                       New Data                ***************************************
+    ==== BME688 BSEC2 Sensor Data ==== TGS2610: 512            SO2: 0.12 ppm
+    IAQ Index:  25.00 (Accuracy: 3)    ...                     ...
+    ...                                Reading CO2...
+    New Data (synchronized)            CO2 Concentration: 420 ppm
+    TGS2600: 400
+    ...
+    temperature: 24.40 °C
+    <2 empty lines>                    <2 empty lines>
+
+with the firmware's labels, padding, units and decimals, CRLF line ends and
+UTF-8 "°", "Ω" and "₂".  Deliberate deviations:
+
+- boards start mid-stream: no setup banners ("Initiating ...", "BSEC library
+  version", "2 min sleep to heat sensors") and no error branches ("SGP30:
+  error reading IAQ values", "Sensor read failed.", BSEC warnings);
+- the cadence is ``--hz``, not the firmware's delays and BSEC sample rate;
+- ``--sensors n`` cuts the readings after "New Data" to ``n`` (or pads them
+  with AUX<i> channels) and drops Board1's BME688 section;
+- values are synthetic and the run-in/stabilisation status is always done.
+
+Writes never wait: like a UART, bytes the host has not read in time are lost
+and counted as overruns.
+
+    python simulator.py --b 2 --lb 2 --hz 5               # print ports, run until Ctrl-C
+    python simulator.py --sweep --b 2 --lb 2 --hz 1       # double Hz until rows are dropped
+"""
+import argparse, heapq, math, os, random, tempfile, threading, time, tty
+from typing import Dict, List, Optional, Tuple
+
+import firebase_sink
+import lb_write
+
+# (preamble printed before the group or None, [(label as printed, decimals, base, swing, unit suffix)])
+Group = Tuple[Optional[str], List[Tuple[str, int, float, float, str]]]
+
+B1_SENSORS: List[Group] = [
+    (None, [("TGS2600: ", 0, 400, 40, ""), ("TGS2602: ", 0, 431, 25, ""),
+            ("TGS2603: ", 0, 698, 30, ""), ("MQ2:     ", 0, 72, 10, "")]),
+    ("Reading Multichannel Gas Sensor...",
+     [("GM102B (NO2):    ", 2, 2.1, 0.3, " ppm"), ("GM302B (C2H5CH): ", 2, 2.9, 0.4, " ppm"),
+      ("GM502B (VOC):    ", 2, 0.7, 0.1, " ppm"), ("GM702B (CO):     ", 2, 1.2, 0.2, " ppm")]),
+    ("Reading SGP30...", [("tVOC:  ", 0, 3, 2, " ppb"), ("CO2eq: ", 0, 400, 15, " ppm")]),
+    ("Reading Formaldehyde...",
+     [("hcho:        ", 2, 11.8, 1.5, " ppb"), ("humidity:    ", 2, 24.6, 2.0, " %"),
+      ("temperature: ", 2, 24.4, 0.3, " °C")]),
+]
+# Board1's BSEC callback output, in the order the sketch subscribes to the outputs
+B1_BSEC: List[Tuple[str, int, float, float, str]] = [
+    ("IAQ Index:                  ", 2, 25, 5, " (Accuracy: 3)"),
+    ("Raw Temperature:            ", 2, 25.3, 0.3, " °C"),
+    ("Pressure:                   ", 2, 1013.2, 0.4, " hPa"),
+    ("Raw Humidity:               ", 2, 38.0, 2.0, " %"),
+    ("Raw Gas Resistance:         ", 2, 45.0, 5.0, " kΩ"),
+    ("Compensated Temperature:    ", 2, 24.9, 0.3, " °C"),
+    ("Compensated Humidity:       ", 2, 39.5, 2.0, " %"),
+    ("Static IAQ:                 ", 2, 27, 5, ""),
+    ("CO₂ Equivalent:             ", 2, 520, 30, " ppm"),
+    ("bVOC Equivalent:            ", 2, 0.6, 0.1, " ppm"),
+    ("Gas Percentage:             ", 2, 30, 5, " %"),
+    ("Compensated Gas Resistance: ", 2, 46.0, 5.0, " kΩ"),
+]
+B1_BSEC_STATUS = ["Run-In Status: Complete", "Stabilization Status: Stable"]
+B2_SENSORS: List[Group] = [
+    (None, [("TGS2610: ", 0, 512, 30, ""), ("TGS2611: ", 0, 455, 25, ""),
+            ("TGS2612: ", 0, 380, 20, ""), ("MQ9_b: ", 0, 140, 15, "")]),
+    ("Reading BME680...",
+     [("Temperature: ", 2, 24.1, 0.3, " °C "), ("Pressure: ", 2, 101325, 40, " Pa "),
+      ("Humidity: ", 2, 40.0, 2.0, " % "), ("Gas Resistance: ", 2, 12345, 800, " ohm "),
+      ("Gas Index: ", 0, 3, 1, "")]),
+    ("Reading SGP41...",
+     [("VOC Raw: ", 0, 30000, 400, ""), ("NOx Raw: ", 0, 15000, 200, ""),
+      ("VOC Index: ", 0, 100, 8, ""), ("NOx Index: ", 0, 1, 0, "")]),
+    ("Reading CO2...", [("CO2 Concentration: ", 0, 420, 12, " ppm")]),
+]
+LB_BASE = {"SO2": 0.12, "NO2": 0.05, "H2S": 0.08, "CH4": 1.9, "NO": 0.12, "CO": 1.03, "NH3": 2.1, "O2": 20.9}
+LB_RULE = "*" * 39      # the sketches print this before each reading, and nothing after it
+
+
+def _b_sensors(board_id: str, n: Optional[int]) -> List[Group]:
+    """The firmware's sensor groups, cut to ``n`` readings or padded with AUX<i> channels."""
+    groups = B2_SENSORS if board_id == "B2" else B1_SENSORS
+    total = sum(len(g) for _p, g in groups)
+    if n is None or n == total: return groups
+    out: List[Group] = []; left = n
+    for pre, g in groups:
+        if left <= 0: break
+        out.append((pre, g[:left])); left -= len(g)
+    if left > 0:
+        out.append((None, [(f"AUX{i}: ", 0, 500, 50, "") for i in range(left)]))
+    return out
+
+
+def _lb_sensors(board_id: str, n: Optional[int]) -> List[str]:
+    gases = lb_write.EXPECTED_SENSORS.get(board_id.upper(), lb_write.EXPECTED_SENSORS["LB2"])
+    if n is None: return list(gases)
+    return (list(gases) + [f"GAS{i}" for i in range(max(0, n - len(gases)))])[:n]
+
+
+class SimBoard:
+    def __init__(self, board_id: str, sensors: Optional[int] = None, hz: float = 1.0, seed: int = 0):
+        self.board_id = board_id
+        self.kind = "LB" if board_id.upper().startswith("LB") else "B"
+        self.period_s = 1.0 / hz
+        self.rng = random.Random(seed)
+        if self.kind == "B":
+            self.groups = _b_sensors(board_id, sensors)
+            self.bsec = board_id == "B1" and sensors is None
+            self.new_data = "New Data" if board_id == "B2" else "New Data (synchronized)"
+        else:
+            self.gases = _lb_sensors(board_id, sensors)
+        self.master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        os.set_blocking(self.master, False)
+        self.port = os.ttyname(self._slave)
+        self.sent = 0; self.bytes = 0; self.overruns = 0; self.lost_bytes = 0
+
+    def _value(self, n: int, base: float, swing: float, decimals: int) -> str:
+        v = base + swing * math.sin(n / 30.0 + self.rng.random() * 0.2)
+        return f"{v:.{decimals}f}"
+
+    def block(self, n: int) -> bytes:
+        lines: List[str] = []
+        if self.kind == "B":
+            if self.bsec:
+                lines += ["", "==== BME688 BSEC2 Sensor Data ===="]
+                lines += [f"{label}{self._value(n, b, s, d)}{unit}" for label, d, b, s, unit in B1_BSEC]
+                lines += B1_BSEC_STATUS
+            lines.append(self.new_data)
+            for pre, group in self.groups:
+                if pre: lines.append(pre)
+                lines += [f"{label}{self._value(n, b, s, d)}{unit}" for label, d, b, s, unit in group]
+            lines += ["", ""]
+        else:
+            lines.append(LB_RULE)
+            lines += [f"{g}: {self._value(n, LB_BASE.get(g, 1.0), LB_BASE.get(g, 1.0) * 0.1, 2)} ppm"
+                      for g in self.gases]
+        return ("\r\n".join(lines) + "\r\n").encode("utf-8")
+
+    def send(self, n: int):
+        data = self.block(n)
+        try:
+            k = os.write(self.master, data)
+        except BlockingIOError:
+            k = 0
+        except OSError:      # nobody has the port open
+            k = 0
+        if k < len(data):
+            self.overruns += 1; self.lost_bytes += len(data) - k
+        self.sent += 1; self.bytes += k
+
+    def close(self):
+        for fd in (self.master, self._slave):
+            try: os.close(fd)
+            except OSError: pass
+
+
+class Simulator:
+    """Boards B1..B<b> and LB1..LB<lb>, all driven by one scheduling thread."""
+    def __init__(self, b: int = 2, lb: int = 2, sensors: Optional[int] = None, hz: float = 1.0, seed: int = 0):
+        self.hz = hz
+        self.boards: Dict[str, SimBoard] = {}
+        for i, bid in enumerate([f"B{i + 1}" for i in range(b)] + [f"LB{i + 1}" for i in range(lb)]):
+            self.boards[bid] = SimBoard(bid, sensors, hz, seed + i)
+        self.lag_max_s = 0.0
+        self.late = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def ports(self, kind: str) -> Dict[str, str]:
+        return {bid: sb.port for bid, sb in self.boards.items() if sb.kind == kind}
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="board-sim", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread: self._thread.join(2.0)
+
+    def close(self):
+        self.stop()
+        for sb in self.boards.values(): sb.close()
+
+    def _run(self):
+        t0 = time.monotonic()
+        # stagger boards across one period, as independent boards would be
+        due = [(t0 + i * (1.0 / self.hz) / max(1, len(self.boards)), bid, 0)
+               for i, bid in enumerate(self.boards)]
+        heapq.heapify(due)
+        while not self._stop.is_set():
+            t, bid, n = heapq.heappop(due)
+            wait = t - time.monotonic()
+            if wait > 0 and self._stop.wait(wait): return
+            lag = time.monotonic() - t
+            self.lag_max_s = max(self.lag_max_s, lag)
+            sb = self.boards[bid]
+            if lag > sb.period_s: self.late += 1
+            sb.send(n)
+            heapq.heappush(due, (t + sb.period_s, bid, n + 1))
+
+    def stats(self) -> dict:
+        return {"sent": {bid: sb.sent for bid, sb in self.boards.items()},
+                "overruns": sum(sb.overruns for sb in self.boards.values()),
+                "bytes": sum(sb.bytes for sb in self.boards.values()),
+                "late": self.late, "lag_max_s": round(self.lag_max_s, 4)}
+
+
+# ===== load test against b_write / lb_write =====
+def run_capture(b: int, lb: int, sensors: Optional[int], hz: float, seconds: float, seed: int = 0) -> dict:
+    """
+    Drive one capture at ``hz`` for ``seconds`` and report what was sent, parsed
+    and written.  Readings go to an in-memory Firebase backend, never the network.
+    """
+    import b_write
+    sim = Simulator(b, lb, sensors, hz, seed)
+    test_id = f"sim_{b}B{lb}LB_{hz:g}Hz"
+    b_ports, lb_ports = sim.ports("B"), sim.ports("LB")
+    with firebase_sink.offline():
+        try:
+            if b_ports: b_write.start_capture("Testing", "Simulator", test_id, 1.0, 0, 0, b_ports)
+            if lb_ports: lb_write.start_capture("Testing", "Simulator", test_id, 1.0, 0, lb_ports)
+            readers = {**b_write._READERS, **lb_write._READERS}
+            time.sleep(0.5)                     # ports open on the engine thread
+            sim.start(); time.sleep(seconds); sim.stop()
+            time.sleep(min(2.0, max(0.5, 5.0 / hz)))   # let the last blocks drain
+            parsed = {bid: r.decimator.kept for bid, r in readers.items()}
+            ws = dict(b_write.BOARDS.run.writer_stats)
+        finally:
+            if b_ports: b_write.stop_capture()
+            if lb_ports: lb_write.stop_capture()
+            sim.close()
+    st = sim.stats()
+    # an LB block is only complete when the next one starts, so one may still be open
+    missed = {bid: st["sent"][bid] - parsed.get(bid, 0) - (1 if bid.startswith("LB") else 0)
+              for bid in st["sent"]}
+    # the simulator shares the GIL with the stack: a late block is still sent, but the
+    # run only counts if the boards actually reached the rate
+    achieved = min(st["sent"].values()) / seconds if st["sent"] else 0.0
+    ok = (st["overruns"] == 0 and not ws.get("queue_dropped") and achieved >= 0.95 * hz
+          and all(m <= 0 for m in missed.values()))
+    return {"boards": b + lb, "hz": hz, "achieved_hz": round(achieved, 2), "sensors": sensors, "seconds": seconds, **st,
+            "parsed": parsed, "missed": missed, "b_rows": ws.get("rows", 0),
+            "queue_dropped": ws.get("queue_dropped", 0), "sustained": ok}
+
+
+def sweep(b: int, lb: int, sensors: Optional[int], hz: float, seconds: float, max_hz: float) -> Optional[float]:
+    """Double the rate from ``hz`` until a run drops data; returns the highest sustained rate."""
+    best = None
+    while hz <= max_hz:
+        r = run_capture(b, lb, sensors, hz, seconds)
+        print(f"{r['boards']} boards @ {hz:g} Hz: sent {sum(r['sent'].values())}, "
+              f"parsed {sum(r['parsed'].values())}, B rows {r['b_rows']}, overruns {r['overruns']}, "
+              f"queue drops {r['queue_dropped']}, achieved {r['achieved_hz']:g} Hz, "
+              f"max lag {r['lag_max_s'] * 1000:.1f} ms "
+              f"-> {'ok' if r['sustained'] else 'DROPPING'}")
+        if not r["sustained"]: break
+        best = hz; hz *= 2
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulated B and LB boards on pseudo-terminals")
+    parser.add_argument("--b", type=int, default=2, help="B boards (the B writer records B1 and B2)")
+    parser.add_argument("--lb", type=int, default=2, help="Libelium boards")
+    parser.add_argument("--sensors", type=int, default=None, help="readings per block (default: as the firmware)")
+    parser.add_argument("--hz", type=float, default=1.0, help="blocks per second per board (start rate for --sweep)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sweep", action="store_true", help="run captures at doubling rates until rows drop")
+    parser.add_argument("--seconds", type=float, default=10.0, help="length of each --sweep run")
+    parser.add_argument("--max-hz", type=float, default=1024.0)
+    parser.add_argument("--workdir", default=None, help="where --sweep writes its CSVs (default: a temp dir)")
+    args = parser.parse_args()
+    if args.b > 2: parser.error("the B writer records at most two boards (B1, B2)")
+
+    if args.sweep:
+        os.chdir(args.workdir or tempfile.mkdtemp(prefix="enose-sim-"))
+        print(f"writing to {os.getcwd()}")
+        best = sweep(args.b, args.lb, args.sensors, args.hz, args.seconds, args.max_hz)
+        print(f"max sustained: {best:g} Hz x {args.b + args.lb} boards" if best else "not sustained at the start rate")
+    else:
+        sim = Simulator(args.b, args.lb, args.sensors, args.hz, args.seed)
+        for bid, sb in sim.boards.items(): print(f"{bid}: {sb.port}")
+        sim.start()
+        try:
+            while True:
+                time.sleep(5); print(sim.stats())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sim.close()
@@ -0,0 +1,80 @@
+import csv
+import time
+
+import pytest
+
+import b_write
+import catalog
+import firebase_sink
+import metrics
+from fakeboard import FakeSource
+
+
+def _block(i):
+    return f"New Data\r\nTGS2600: {400 + i}\r\n*\r\n".encode()
+
+
+@pytest.fixture
+def capture(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(catalog, "CATALOG", catalog.Catalog(str(tmp_path / "sessions.db")))
+    with firebase_sink.offline():
+        yield
+        b_write.stop_capture()
+
+
+def _rows():
+    path = b_write.snapshot()["paths"]["cumulative_csv"]
+    with open(path, newline="") as fh:
+        return list(csv.DictReader(fh))
+
+
+def _wait_emitted(src, n, timeout=10):
+    deadline = time.time() + timeout
+    while metrics.board("B:B1").blocks_emitted < n and time.time() < deadline: time.sleep(0.01)
+    assert src.in_waiting == 0
+
+
+def test_blocks_still_queued_at_stop_are_written(capture, monkeypatch):
+    flush = b_write.BCumulativeWriter._flush
+    monkeypatch.setattr(b_write.BCumulativeWriter, "_flush", lambda self: (time.sleep(0.002), flush(self)))
+    src = FakeSource(block_fn=None)
+    start = metrics.board("B:B1").blocks_emitted
+    b_write.start_capture("Testing", "Ethanol", "T1", 1.0, 0, 0, {"B1": src})
+    src.feed(b"".join(_block(i) for i in range(300)))
+    _wait_emitted(src, start + 300)
+    assert not b_write._BLOCK_QUEUE.empty()          # the writer is still behind when stop comes
+    b_write.stop_capture()
+    rows = _rows()
+    assert len(rows) == 300 and rows[-1]["B1 - TGS2600"] == "699.0"
+    assert b_write.BOARDS.run.writer_stats["queue_dropped"] == 0
+
+
+def test_an_overloaded_writer_drops_and_reports(capture, monkeypatch):
+    monkeypatch.setattr(b_write, "OVERLOAD_WAIT_S", 0.01)
+    monkeypatch.setattr(b_write, "_BLOCK_QUEUE", b_write.queue.Queue(maxsize=2))
+    b_write.BOARDS.reset({"B1": "idle"}, b_write.WRITER_STATS)
+    for i in range(5): b_write._push_block("B1", {"TGS2600": (float(i), None)})
+    assert b_write.BOARDS.run.writer_stats["queue_dropped"] == 3
+    assert b_write.BOARDS.get("Writer").status == "overloaded, 3 blocks dropped"
+
+
+BOARD1 = ("\r\n==== BME688 BSEC2 Sensor Data ====\r\n"
+          "IAQ Index:                  25.00 (Accuracy: 3)\r\n"
+          "CO₂ Equivalent:             520.00 ppm\r\n"
+          "Run-In Status: Complete\r\n"
+          "New Data (synchronized)\r\n"
+          "TGS2600: 400\r\n"
+          "temperature: 24.40 °C\r\n\r\n\r\n")
+
+
+def test_board1_blocks_end_at_the_empty_line_and_keep_their_bme688_section(monkeypatch):
+    r = b_write.BSerialReader("B1", "unused", 0)
+    blocks = []
+    monkeypatch.setattr(r, "_emit_block", lambda readings, t: blocks.append((readings, t)))
+    failures = r.counters.parse_failures
+    for n, ln in enumerate((BOARD1 * 2).encode().split(b"\n")): r.feed_line(ln, float(n))
+    assert len(blocks) == 2                          # neither waits for the next "New Data"
+    assert blocks[0] == ([("IAQ Index", 25.0, None), ("CO2 Equivalent", 520.0, "ppm"),
+                          ("TGS2600", 400.0, None), ("temperature", 24.4, "°C")], 5.0)
+    assert r.counters.parse_failures == failures
@@ -0,0 +1,31 @@
+import threading
+
+import boardstate
+
+
+def test_run_counts_from_several_threads_are_not_lost():
+    states = boardstate.BoardStates()
+    states.reset({"B1": "idle"}, ("rows", "queue_dropped"))
+    before = states.run
+    threads = [threading.Thread(target=lambda: [states.count(rows=1, queue_dropped=1) for _ in range(500)])
+               for _ in range(4)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert dict(states.run.writer_stats) == {"rows": 2000, "queue_dropped": 2000}
+    assert dict(before.writer_stats) == {"rows": 0, "queue_dropped": 0}    # a record read earlier never changes
+
+
+def test_first_read_keeps_the_first_time():
+    states = boardstate.BoardStates()
+    states.first_read(1000.0); states.first_read(1001.0)
+    assert states.run.first_read_epoch == 1000.0
+    states.reset({})
+    assert states.run.first_read_epoch is None
+
+
+def test_run_parameters_are_replaced_not_edited():
+    states = boardstate.BoardStates()
+    run = states.reset({"B1": "idle"}, ("rows",), active=True, stage="Testing", test_id="T1", duration_sec=60)
+    states.publish_run(active=False)
+    assert run.active and run.test_id == "T1"              # a reader holding the record sees one run
+    assert not states.run.active and states.run.duration_sec == 60 and states.run.stage == "Testing"
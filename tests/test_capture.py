@@ -0,0 +1,65 @@
+import threading
+import time
+
+import capture
+import ingest
+
+
+def _record(path, chunks):
+    rec = capture.Recorder(str(path), {"key": "B:B1", "port": "COM3", "baud": 9600, "started": 0})
+    for t, chunk in chunks: rec.write(t, chunk)
+    rec.close()
+
+
+def test_replay_is_dispatched_on_the_engine_thread_with_recorded_times(tmp_path):
+    cap = tmp_path / "B1.cap"
+    _record(cap, [(1000.0, b"New Data\r\nTGS26"), (1000.5, b"00: 401\r\n*\r\n"), (1001.0, b"tail")])
+    got, closed = [], threading.Event()
+    eng = ingest.IngestEngine()
+    t0 = time.monotonic()
+    eng.add("B:B1", capture.replay_url(str(cap), None, "original"), 9600,
+            lambda raw, t: got.append((raw, t, threading.current_thread().name)), on_close=closed.set)
+    assert capture.wait_replays([str(cap)], timeout=5, since=t0)
+    assert closed.wait(2)
+    assert [(raw, t) for raw, t, _ in got] == [(b"New Data\r", 1000.0), (b"TGS2600: 401\r", 1000.5),
+                                               (b"*\r", 1000.5), (b"tail", 1001.0)]
+    assert {name for *_, name in got} == {"serial-ingest"}
+
+
+def test_wait_replays_fails_fast(tmp_path):
+    t0 = time.monotonic()
+    assert not capture.wait_replays([str(tmp_path / "missing.cap")])
+
+    bogus = tmp_path / "bogus.cap"
+    bogus.write_bytes(b"not a capture\n")
+    statuses = []
+    ingest.IngestEngine().add("B:B1", capture.replay_url(str(bogus)), 9600, lambda raw, t: None, statuses.append)
+    assert not capture.wait_replays([str(bogus)], timeout=5, since=t0)
+    assert time.monotonic() - t0 < 2
+    assert any(s.startswith("error open") for s in statuses)
+
+
+def test_replay_closed_early_is_not_complete(tmp_path):
+    cap = tmp_path / "slow.cap"
+    _record(cap, [(1000.0 + i, b"line\n") for i in range(30)])
+    eng = ingest.IngestEngine()
+    t0 = time.monotonic()
+    eng.add("B:B1", capture.replay_url(str(cap), 1.0), 9600, lambda raw, t: None)
+    time.sleep(0.3)
+    eng.remove("B:B1")
+    assert not capture.wait_replays([str(cap)], timeout=5, since=t0)
+
+
+def test_replay_at_max_speed_writes_every_block(tmp_path, monkeypatch):
+    import argparse, b_write, catalog
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(catalog, "CATALOG", catalog.Catalog(str(tmp_path / "sessions.db")))
+    monkeypatch.setattr(b_write, "OVERLOAD_WAIT_S", 0.001)
+    monkeypatch.setattr(b_write, "_BLOCK_QUEUE", b_write.queue.Queue(maxsize=4))   # the writer falls behind at once
+    cap = tmp_path / "B1.cap"
+    _record(cap, [(1000.0 + i, f"New Data\r\nTGS2600: {i}\r\n*\r\n".encode()) for i in range(200)])
+    args = argparse.Namespace(boards=[f"B1={cap}"], stage="Testing", substance="Replay", test_id="replay",
+                              flowrate=1.0, interval=0.0, speed="max", clock="original", timeout=30)
+    result = capture._replay(args)
+    assert result == {"rows": 200, "complete": True}
+    assert b_write.BOARDS.run.writer_stats["queue_dropped"] == 0
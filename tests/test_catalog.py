@@ -0,0 +1,74 @@
+import os
+import threading
+import time
+
+import catalog
+import partition
+
+
+def _write_csv(path, n):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as fh:
+        fh.write("Timestamp,Flowrate (L/min)\n")
+        for i in range(n): fh.write(f"2026-01-01 12:00:{i:02d},1.0\n")
+
+
+def test_note_row_leaves_the_upsert_to_the_flusher_thread(tmp_path, monkeypatch):
+    cat = catalog.Catalog(str(tmp_path / "sessions.db"), flush_s=0.05)
+    threads = []
+    upsert = catalog.Catalog._upsert
+    monkeypatch.setattr(catalog.Catalog, "_upsert",
+                        staticmethod(lambda con, p: (threads.append(threading.current_thread().name), upsert(con, p))))
+    for i in range(3):
+        cat.note_row("Testing/Ethanol/T1/Ethanol_B_Readings.csv", "Testing", "Ethanol", "T1", "B", 1000.0 + i, 1.0)
+    assert threads == []
+    deadline = time.time() + 2
+    while not threads and time.time() < deadline: time.sleep(0.01)
+    assert threads == ["catalog-flush"]
+    [s] = cat.sessions("Testing", "Ethanol")
+    assert (s["rows"], s["flowrates"]) == (3, [1.0])
+
+
+def test_sessions_copied_in_later_are_indexed(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cat = catalog.Catalog(str(tmp_path / "sessions.db"))
+    _write_csv("Testing/Ethanol/T1/Ethanol_B_Readings.csv", 3)
+    cat.ensure_scanned(["Testing"])
+    assert [s["test_id"] for s in cat.sessions("Testing", "Ethanol")] == ["T1"]
+
+    _write_csv("Testing/Ethanol/T2/Ethanol_B_Readings.csv", 5)
+    os.utime("Testing/Ethanol", ns=(0, os.stat("Testing/Ethanol").st_mtime_ns + 10 ** 9))
+    cat.ensure_scanned(["Testing"])
+    assert sorted(s["test_id"] for s in cat.sessions("Testing", "Ethanol")) == ["T1", "T2"]
+    assert sum(s["rows"] for s in cat.sessions("Testing", "Ethanol")) == 8
+
+    fresh = catalog.Catalog(str(tmp_path / "sessions.db"))     # signature persisted: no rescan
+    monkeypatch.setattr(fresh, "scan", lambda roots: (_ for _ in ()).throw(AssertionError(roots)))
+    fresh.ensure_scanned(["Testing"])
+
+
+def test_rescan_matches_the_raw_test_id_the_writers_used(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cat = catalog.Catalog(str(tmp_path / "sessions.db"))
+    raw = "T_Ethanol_12-00-00 17-10-2026"
+    folder = partition.ensure_test_dir("Testing", "Ethanol", raw)
+    assert os.path.basename(folder) != raw and partition.read_test_id(folder) == raw
+    path = partition.path_for("Testing", "Ethanol", raw, "B")
+    _write_csv(path, 2)
+    _write_csv(partition.path_for("Testing", "Ethanol", raw, "LB1"), 2)   # not noted yet: found by the scan
+    for i in range(2): cat.note_row(path, "Testing", "Ethanol", raw, "B", 1000.0 + i, 1.0)
+    cat.flush()
+    cat.ensure_scanned(["Testing"])
+    [s] = cat.sessions("Testing", "Ethanol")
+    assert s["test_id"] == raw and sorted(s["files"]) == ["B", "LB1"]
+
+
+def test_an_update_without_timestamps_keeps_the_known_range(tmp_path):
+    cat = catalog.Catalog(str(tmp_path / "sessions.db"))
+    path = "Testing/Ethanol/T1/Ethanol_B_Readings.csv"
+    for t in (1000.0, 1005.0): cat.note_row(path, "Testing", "Ethanol", "T1", "B", t, 1.0)
+    cat.flush()
+    untimed = catalog._Pending("Testing", "Ethanol", "B")    # e.g. a rescan of a file with no parsable Timestamp
+    with cat._db() as con: catalog.Catalog._upsert(con, {(path, "T1"): untimed})
+    [s] = cat.sessions("Testing", "Ethanol")
+    assert (s["t_first"], s["t_last"]) == (1000.0, 1005.0)
@@ -0,0 +1,69 @@
+import time
+from datetime import datetime
+
+import colstore
+import read
+from csv_sink import CsvSink
+
+HEADER = ["Timestamp", "Flowrate (L/min)", "B1 - TGS2600 - V"]
+T0 = datetime(2026, 1, 1, 12).timestamp()
+
+
+def _csv_rows(sink, start, n):
+    for i in range(start, start + n):
+        sink.write([datetime.fromtimestamp(T0 + i).strftime("%Y-%m-%d %H:%M:%S"), 1.0, 0.5 + i])
+
+
+def _session(path, n, with_cols=True):
+    sink = CsvSink(str(path), HEADER)
+    cols = colstore.open_sink(str(path), HEADER[1:]) if with_cols else None
+    _csv_rows(sink, 0, n)
+    for i in range(n):
+        if cols: cols.write(T0 + i, [1.0, 0.5 + i])
+    sink.close()
+    if cols: cols.close()
+
+
+def test_rows_are_buffered_until_flush_rows(tmp_path):
+    cols = colstore.ColumnSink(str(tmp_path / "s.cols"), HEADER[1:], flush_rows=3, flush_s=60)
+    for i in range(2): cols.write(T0 + i, [1.0, float(i)])
+    assert colstore.Session(cols.dir).rows == 0
+    cols.write(T0 + 2, {"Flowrate (L/min)": 1.0, "B1 - TGS2600 - V": 2.0})
+    assert colstore.Session(cols.dir).rows == 3
+    cols.write(T0 + 3, [1.0, 3.0])
+    cols.add_columns(["B1 - MQ2 - raw"])                  # buffered rows go out at their own width
+    cols.close()
+    s = colstore.Session(cols.dir)
+    assert s.rows == 4 and list(s.columns["B1 - TGS2600 - V"]) == [0.0, 1.0, 2.0, 3.0]
+    assert all(v != v for v in s.columns["B1 - MQ2 - raw"])
+
+
+def test_idle_sink_flushes_on_time(tmp_path):
+    cols = colstore.ColumnSink(str(tmp_path / "s.cols"), HEADER[1:], flush_rows=100, flush_s=0.05)
+    cols.write(T0, [1.0, 1.0])
+    time.sleep(0.1)
+    cols.maybe_flush()
+    assert colstore.Session(cols.dir).rows == 1
+
+
+def test_copy_is_used_only_while_it_matches_the_csv(tmp_path):
+    path = tmp_path / "Ethanol_B_Readings.csv"
+    _session(path, 5)
+    assert colstore.current(str(path))
+    assert read._session_source(str(path)).endswith(colstore.TIME_FILE)
+
+    sink = CsvSink(str(path), HEADER)                      # resumed with COLSTORE=0
+    _csv_rows(sink, 5, 3)
+    sink.close()
+    assert not colstore.current(str(path))
+    assert read._session_source(str(path)) == str(path)
+    assert len(read._load_session(str(path))) == 8
+
+
+def test_open_sink_converts_rows_the_copy_lacks(tmp_path):
+    path = tmp_path / "Ethanol_B_Readings.csv"
+    _session(path, 4, with_cols=False)                     # CSV that predates its copy
+    _session(path, 2)                                      # appended with COLSTORE on
+    assert colstore.current(str(path))
+    s = colstore.Session(colstore.dir_for(str(path)))
+    assert s.rows == 6
@@ -0,0 +1,28 @@
+import json
+
+import colstore
+import csv_sink
+from csv_sink import CsvSink
+
+HEADER = ["Timestamp", "Flowrate (L/min)", "B1 - TGS2600 - V"]
+
+
+def test_rotating_twice_in_one_second_keeps_every_row(tmp_path):
+    path = str(tmp_path / "Ethanol_B_Readings.csv")
+    sink = CsvSink(path, HEADER, flush_rows=1, max_bytes=120)
+    for i in range(12): sink.write(["2026-01-01 12:00:00", 1.0, float(i)])
+    sink.close()
+    parts = csv_sink.segments(path)
+    assert len(parts) >= 3 and parts[0] == path
+    assert list(csv_sink.read_frame(path)["B1 - TGS2600 - V"]) == [float(i) for i in range(12)]
+    with open(csv_sink.schema_path(path)) as fh:
+        schema = [json.loads(line) for line in fh]
+    assert [s["segment"] for s in schema] == list(range(1, len(parts) + 1))
+    assert schema[1]["reason"].startswith("rotated at") and schema[1]["columns"] == HEADER
+    assert colstore.Session(colstore.convert_csv(path)).rows == 12     # the columnar copy sees rotated rows too
+
+
+def test_max_bytes_defaults_to_the_module_setting(tmp_path, monkeypatch):
+    monkeypatch.setattr(csv_sink, "MAX_BYTES", 1000)
+    assert CsvSink(str(tmp_path / "a.csv"), HEADER).max_bytes == 1000
+    assert CsvSink(str(tmp_path / "b.csv"), HEADER, max_bytes=0).max_bytes is None
@@ -0,0 +1,127 @@
+import json
+
+import firebase_sink
+from firebase_sink import FakeDb, Uploader
+
+
+def _uploader(db, path, **kw):
+    return Uploader(lambda: db, str(path), batch_s=0.05, **kw)
+
+
+def _readings(db):
+    return db.data.get("T", {}).get("readings", {})
+
+
+def test_nothing_is_read_until_open(tmp_path):
+    q = tmp_path / "q.jsonl"
+    q.write_text(json.dumps({"p": "T/readings/1", "v": 1}) + "\n")
+    up = _uploader(FakeDb(), q)
+    assert up.depth == 0
+    up.open()
+    assert up.depth == 1
+
+
+def test_outage_then_restart_replays_only_unacknowledged(tmp_path):
+    q = tmp_path / "q.jsonl"
+    db = FakeDb()
+    up = _uploader(db, q)
+    for n in range(1, 4): up.enqueue(f"T/readings/{n}", n)
+    assert up.flush(2.0)
+    db.fail_next = 1000
+    for n in range(4, 6): up.enqueue(f"T/readings/{n}", n)
+    up.stop(0.5)
+    size = q.stat().st_size
+    assert int((tmp_path / "q.jsonl.ack").read_text()) < size       # append-only: nothing rewritten
+
+    db.fail_next = 0
+    up2 = _uploader(db, q)
+    up2.open()
+    assert [p for p, _v, _end in up2._pending] == ["T/readings/4", "T/readings/5"]
+    assert up2.flush(2.0)
+    assert _readings(db) == {str(n): n for n in range(1, 6)}
+    up2.stop()
+
+
+def test_torn_tail_is_cut_off(tmp_path):
+    q = tmp_path / "q.jsonl"
+    q.write_bytes(json.dumps({"p": "T/readings/1", "v": 1}).encode() + b"\n" + b'{"p": "T/rea')
+    db = FakeDb()
+    up = _uploader(db, q)
+    up.open()
+    assert up.depth == 1
+    up.enqueue("T/readings/2", 2)            # must not be glued to the torn bytes
+    assert up.flush(2.0)
+    up.stop()
+    assert _readings(db) == {"1": 1, "2": 2}
+    assert all(json.loads(ln) for ln in q.read_text().splitlines())
+
+
+def test_file_is_truncated_once_everything_is_acknowledged(tmp_path, monkeypatch):
+    monkeypatch.setattr(firebase_sink, "COMPACT_BYTES", 200)
+    q = tmp_path / "q.jsonl"
+    up = _uploader(FakeDb(), q)
+    for n in range(20): up.enqueue(f"T/readings/{n}", {"x": n})
+    assert up.flush(2.0)
+    up.stop()
+    assert q.stat().st_size == 0
+    assert (tmp_path / "q.jsonl.ack").read_text() == "0"
+
+
+class _FlakyBackend:
+    def __init__(self, failures):
+        self.failures = failures
+        self.db = FakeDb()
+
+    def connect(self):
+        if self.failures:
+            self.failures -= 1
+            raise firebase_sink.BackendUnavailable("DATABASE_URL missing")
+        return self.db
+
+
+def test_failed_init_is_retried_after_backoff(tmp_path, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(firebase_sink.time, "monotonic", lambda: clock[0])
+    sink = firebase_sink.FirebaseSink(_FlakyBackend(2), str(tmp_path / "q.jsonl"))
+    assert not sink.init() and sink.disabled_reason == "DATABASE_URL missing"
+    assert not sink.init()                                  # still backing off: no attempt
+    assert sink.backend.failures == 1
+    clock[0] += firebase_sink.INIT_BACKOFF_S
+    assert not sink.init()                                  # second failure doubles the backoff
+    clock[0] += firebase_sink.INIT_BACKOFF_S
+    assert not sink.init() and sink.backend.failures == 0
+    clock[0] += firebase_sink.INIT_BACKOFF_S
+    assert sink.init() and sink.disabled_reason is None
+    sink.uploader.stop(0.5)
+
+
+def test_backend_is_read_from_env_at_init(monkeypatch):
+    monkeypatch.setenv("FIREBASE_BACKEND", "memory")
+    sink = firebase_sink.FirebaseSink(queue_path=None)
+    assert sink.backend is None
+    assert sink.init() and sink.backend.name == "memory"
+    sink.uploader.stop(0.5)
+
+
+def test_offline_swaps_the_shared_sink_in_place_and_restores_it(tmp_path):
+    sink = firebase_sink.FirebaseSink(_FlakyBackend(0), str(tmp_path / "q.jsonl"))
+    backend, uploader = sink.backend, sink.uploader
+    with firebase_sink.offline(sink) as db:
+        assert sink.init() and sink.backend.name == "memory" and sink.uploader.queue_path is None
+        sink.put_reading("Testing", "Ethanol", "T1", "B1", 1000.0, {"x": 1.0})
+        assert sink.uploader.flush(2.0)
+        assert list(db.data["Testing"]["Ethanol"]["T1"]["B1"]["readings"]) == ["1"]
+    assert sink.backend is backend and sink.uploader is not uploader and not sink.ready
+    assert sink.uploader.queue_path == str(tmp_path / "q.jsonl")
+
+
+def test_readings_taken_offline_are_queued_and_sent_once_connected(tmp_path, monkeypatch):
+    monkeypatch.setattr(firebase_sink, "INIT_BACKOFF_S", 0.05)
+    sink = firebase_sink.FirebaseSink(_FlakyBackend(1), str(tmp_path / "q.jsonl"))
+    assert not sink.init()
+    for n in range(3): sink.put_reading("Testing", "Ethanol", "T1", "B1", 1000.0 + n, {"x": float(n)})
+    assert sink.uploader.depth == 3 and len((tmp_path / "q.jsonl").read_text().splitlines()) == 3
+    assert sink.uploader.flush(5.0)                          # the uploader retried init() itself
+    assert sink.ready and sink.uploader.failures == 0
+    assert sorted(sink.backend.db.data["Testing"]["Ethanol"]["T1"]["B1"]["readings"]) == ["1", "2", "3"]
+    sink.uploader.stop(0.5)
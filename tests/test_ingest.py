@@ -0,0 +1,144 @@
+import threading
+
+import pytest
+import serial
+
+import ingest
+from fakeboard import FakeSource, fake_b_block
+
+
+class _Reader:
+    def __init__(self):
+        self.lines = []
+        self.threads = set()
+        self.statuses = []
+        self.closed = threading.Event()
+        self.got = threading.Condition()
+
+    def on_line(self, raw, t):
+        with self.got:
+            self.lines.append(raw); self.threads.add(threading.current_thread().name)
+            self.got.notify_all()
+
+    def wait_lines(self, n, timeout=2.0):
+        with self.got:
+            return self.got.wait_for(lambda: len(self.lines) >= n, timeout)
+
+
+@pytest.fixture
+def engine():
+    eng = ingest.IngestEngine()
+    yield eng
+    for key in eng.keys(): eng.remove(key)
+
+
+def _add(engine, key, src, r):
+    engine.add(key, src, 9600, r.on_line, r.statuses.append, r.closed.set)
+
+
+def test_lines_are_split_and_delivered_on_the_engine_thread(engine):
+    src, r = FakeSource(block_fn=None), _Reader()
+    _add(engine, "T1", src, r)
+    src.feed(b"New Data\r\nTGS2600: 4")
+    src.feed(b"01\r\n*\r\n")
+    assert r.wait_lines(3)
+    assert r.lines == [b"New Data\r", b"TGS2600: 401\r", b"*\r"]
+    assert r.threads == {"serial-ingest"}
+    assert "listening" in r.statuses
+
+
+def test_remove_flushes_the_partial_line_and_drops_the_handle(engine):
+    src, r = FakeSource(block_fn=None), _Reader()
+    _add(engine, "T1", src, r)
+    src.feed(b"a\nparti")
+    assert r.wait_lines(1)
+    engine.remove("T1")
+    assert engine.wait_closed("T1") and r.closed.wait(2.0)
+    assert r.lines == [b"a", b"parti"]
+    assert "T1" not in engine._handles and engine.keys() == []
+
+
+def test_generated_blocks_arrive_through_the_engine(engine):
+    src, r = FakeSource(period_s=0.01), _Reader()
+    _add(engine, "T1", src, r)
+    assert r.wait_lines(2 * len(fake_b_block(0)))
+    assert r.lines[0] == b"New Data\r" and r.threads == {"serial-ingest"}
+
+
+def test_bad_port_reports_error_open(engine):
+    r = _Reader()
+    _add(engine, "T1", "/dev/does-not-exist", r)
+    assert engine.wait_closed("T1")
+    assert any(s.startswith("error open") for s in r.statuses)
+    assert "T1" not in engine._handles
+
+
+def test_handler_exception_is_reported_and_reading_continues(engine):
+    src, r = FakeSource(block_fn=None), _Reader()
+    seen = []
+
+    def on_line(raw, t):
+        seen.append(raw)
+        if raw == b"boom": raise RuntimeError("bad line")
+        r.on_line(raw, t)
+
+    engine.add("T1", src, 9600, on_line, r.statuses.append)
+    src.feed(b"boom\nok\n")
+    assert r.wait_lines(1)
+    assert seen == [b"boom", b"ok"]
+    assert "error handler: bad line" in r.statuses
+
+
+def test_decimator_keeps_the_first_block_of_each_slot():
+    d = ingest.Decimator(1.0)
+    kept = [t for t in (0.0, 0.4, 0.95, 1.02, 1.9, 2.1, 4.5) if d.offer(t)]
+    assert kept == [0.0, 1.02, 2.1, 4.5]
+    assert (d.kept, d.dropped) == (4, 3)
+
+
+class _Glitchy(FakeSource):
+    """A source whose next read fails once, like a USB serial adapter dropping out."""
+    def __init__(self):
+        super().__init__(block_fn=None)
+        self.fail = False; self.closed_calls = 0
+
+    def read(self, n):
+        if self.fail:
+            self.fail = False; raise serial.SerialException("device reports readiness to read but returned no data")
+        return super().read(n)
+
+    def close(self):
+        self.closed_calls += 1
+
+
+def test_a_read_error_is_retried_after_a_backoff(engine, monkeypatch):
+    monkeypatch.setattr(ingest, "REOPEN_S", 0.01)
+    src, r = _Glitchy(), _Reader()
+    _add(engine, "T1", src, r)
+    src.feed(b"one\n")
+    assert r.wait_lines(1)
+    src.fail = True; src.feed(b"tw")
+    src.feed(b"o\nthree\n")
+    assert r.wait_lines(3)
+    assert r.lines == [b"one", b"two", b"three"] and engine.keys() == ["T1"] and not r.closed.is_set()
+    assert any(s.startswith("error read: device reports") and s.endswith("(retrying in 0.01 s)") for s in r.statuses)
+    assert r.statuses[-1] == "listening" and src.closed_calls == 0
+
+
+def test_a_serial_port_is_reopened_after_a_read_error(engine, monkeypatch):
+    monkeypatch.setattr(ingest, "REOPEN_S", 0.01)
+    opened = []
+
+    def open_port(port, baud, timeout):
+        src = _Glitchy()
+        if not opened: src.fail = True
+        src.feed(f"from {len(opened)}\n".encode())
+        opened.append(src)
+        return src
+
+    monkeypatch.setattr(ingest.serial, "Serial", open_port)
+    r = _Reader()
+    _add(engine, "T1", "/dev/ttyUSB9", r)
+    assert r.wait_lines(1)
+    assert r.lines == [b"from 1"] and len(opened) == 2 and opened[0].closed_calls == 1
+    assert any(s.startswith("error read:") for s in r.statuses) and not r.closed.is_set()
@@ -0,0 +1,65 @@
+import csv
+import threading
+import time
+
+import pytest
+
+import catalog
+import firebase_sink
+import lb_write
+import metrics
+from fakeboard import FakeSource
+
+
+def _block(i):
+    return f"New Data\r\nNO2: {i / 10} ppm\r\nO2: 20.9 %\r\n".encode()
+
+
+@pytest.fixture
+def capture(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(catalog, "CATALOG", catalog.Catalog(str(tmp_path / "sessions.db")))
+    with firebase_sink.offline():
+        yield
+        lb_write.stop_capture()
+
+
+def test_rows_are_written_off_the_engine_thread_and_drained_at_stop(capture, monkeypatch):
+    threads = set()
+    note = catalog.CATALOG.note_row
+    monkeypatch.setattr(catalog.CATALOG, "note_row",
+                        lambda *a, **kw: (threads.add(threading.current_thread().name), time.sleep(0.002), note(*a, **kw)))
+    src = FakeSource(block_fn=None)
+    start = metrics.board("LB:LB1").blocks_emitted
+    lb_write.start_capture("Testing", "Ethanol", "T1", 1.0, 0, {"LB1": src})
+    src.feed(b"".join(_block(i) for i in range(100)))
+    deadline = time.time() + 10
+    while metrics.board("LB:LB1").blocks_emitted < start + 99 and time.time() < deadline: time.sleep(0.01)
+    assert src.in_waiting == 0
+    lb_write.stop_capture()              # the last block is closed by the port closing
+    assert threads == {"LB-Writer"}
+    with open(lb_write.BOARDS.get("LB1").path, newline="") as fh:
+        rows = list(csv.DictReader(fh))
+    assert len(rows) == 100 and rows[-1]["LB1 - NO2 (ppm)"] == "9.9"
+
+
+def test_libelium_blocks_open_at_the_rule_line(monkeypatch):
+    r = lb_write.LBSerialReader("LB1", "unused", 0)
+    blocks = []
+    monkeypatch.setattr(r, "_emit_block", lambda gases, t, rec: blocks.append(gases))
+    for ln in ["*" * 39, "SO2: 0.12 ppm", "NO2: 0.05 ppm"] * 2: r.feed_line(ln.encode() + b"\r", 0.0)
+    r._on_close()
+    assert blocks == [{"SO2": (0.12, "ppm"), "NO2": (0.05, "ppm")}] * 2
+
+
+class _FullDisk:
+    def maybe_flush(self): raise OSError(28, "No space left on device")
+
+
+def test_a_failed_idle_flush_is_counted_and_shown_on_the_board():
+    w = lb_write.LBWriter()
+    w.sinks["LB1"] = _FullDisk()
+    failures = metrics.board("LB:LB1").write_failures
+    w._flush_idle()
+    assert metrics.board("LB:LB1").write_failures == failures + 1
+    assert lb_write.BOARDS.get("LB1").status == "flush failed: [Errno 28] No space left on device"
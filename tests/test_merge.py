@@ -0,0 +1,50 @@
+import csv
+
+import merge
+import partition
+
+KEY = ("Testing", "Ethanol", "T1")
+
+
+def _rows(path):
+    with open(path, newline="") as fh:
+        return list(csv.DictReader(fh))
+
+
+def _push(live, t0, n):
+    for i in range(n):
+        live.push("B1", t0 + i, {"B1 - TGS2600 - V": 1.0 + i})
+        live.push("LB1", t0 + i + 0.2, {"LB1 - NO2 (ppm)": 0.1 * i})
+
+
+def test_only_the_last_writer_to_stop_closes_the_aligned_csv(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    live = merge.LiveAligned(step_s=1.0, tolerance_s=2.0)
+    live.start("B", *KEY, 1.0)
+    live.start("LB", *KEY, 1.0)
+    run = live._run
+    _push(live, 1000.0, 10)
+    settled = run.aligner._next_t
+
+    live.stop("B")
+    assert live.active and not run.closed
+    assert run.aligner._next_t == settled              # B stopping did not flush LB's open grid times
+    _push(live, 1010.0, 5)
+
+    live.stop("LB")
+    assert not live.active and run.closed and run._sink.closed
+    rows = _rows(partition.path_for(*KEY, "Aligned", 1000.0))
+    assert len(rows) == 15 and rows[-1]["LB1 - NO2 (ppm)"] == "0.4"
+
+
+def test_rows_keep_their_run_key_after_a_new_test_starts(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    live = merge.LiveAligned(step_s=1.0, tolerance_s=2.0)
+    live.start("B", *KEY, 1.0)
+    old = live._run
+    _push(live, 1000.0, 5)
+    live.start("B", "Testing", "Ethanol", "T2", 2.0)   # new test: the old run is closed under its own key
+    assert old.closed and live._run.key[2] == "T2"
+    old.aligner.push("B1", 1010.0, {"B1 - TGS2600 - V": 9.0})   # late row for the closed run is dropped
+    assert len(_rows(partition.path_for(*KEY, "Aligned", 1000.0))) == 5
+    live.close()
@@ -0,0 +1,59 @@
+import pandas as pd
+import pytest
+
+import app as dash_app
+import catalog
+import read
+
+
+@pytest.fixture
+def client_app(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(catalog.CATALOG, "path", str(tmp_path / "sessions.db"))
+    monkeypatch.setattr(catalog.CATALOG, "_ready", False)
+    app = dash_app.create_app()
+    return app.server.test_client(), app
+
+
+def _session(tmp_path, n=120):
+    ts = pd.date_range("2026-01-01", periods=n, freq="s").strftime("%Y-%m-%d %H:%M:%S")
+    b = pd.DataFrame({"Timestamp": ts, "Flowrate (L/min)": 1.0,
+                      "B1 - TGS2600 - V": 1.5, "B1 - TGS2600 (ppm)": 12.0, "B1 - MQ2 - raw": 300.0,
+                      "B1 - temperature (°C)": 24.0, "B2 - TGS2600 - V": 2.5})
+    lb = pd.DataFrame({"Timestamp": ts, "Flowrate (L/min)": 1.0, "LB1 - NO2 (ppm)": 0.2})
+    d = tmp_path / "Testing" / "Ethanol"
+    d.mkdir(parents=True)
+    b.to_csv(d / "Ethanol_B_Readings.csv", index=False)
+    lb.to_csv(d / "Ethanol_LB1_Readings.csv", index=False)
+    return {"b_csvs": [str(d / "Ethanol_B_Readings.csv")], "lb_csvs": [str(d / "Ethanol_LB1_Readings.csv")],
+            "t_lo": None, "t_hi": None}
+
+
+def _post(client, app, values, changed):
+    """One plot_all call through /_dash-update-component, built the way the browser builds it."""
+    key = next(k for k in app.callback_map if "b1-graph.figure" in k)
+    spec = app.callback_map[key]
+    ref = lambda it, v=True: {"id": it["id"], "property": it["property"],
+                              **({"value": values.get(f"{it['id']}.{it['property']}")} if v else {})}
+    body = {"output": key, "outputs": [ref({"id": o.component_id, "property": o.component_property}, False)
+                                       for o in spec["output"]],
+            "inputs": [ref(i) for i in spec["inputs"]], "state": [ref(s) for s in spec["state"]],
+            "changedPropIds": [changed]}
+    return client.post("/_dash-update-component", json=body)
+
+
+def test_plot_all_callback_accepts_every_relayout_input(client_app, tmp_path):
+    client, app = client_app
+    values = {"r-flow.value": 1.0, "r-stage.value": "Testing", "r-substance.value": "Ethanol",
+              "r-file-paths.data": _session(tmp_path), "r-plot-width.data": 1000,
+              "env-sensor-select.value": ["temp"]}
+    resp = _post(client, app, values, "r-file-paths.data")
+    assert resp.status_code == 200, resp.get_data(as_text=True)[:300]
+    figures = resp.get_json()["response"]
+    assert set(figures) == set(read.GRAPHS)
+    assert any(tr["name"] == "B1 - TGS2600 - V" for tr in figures["b1-graph"]["figure"]["data"])
+
+    values["b1-graph.relayoutData"] = {"xaxis.range[0]": "2026-01-01 00:00:30",
+                                       "xaxis.range[1]": "2026-01-01 00:01:00"}
+    resp = _post(client, app, values, "b1-graph.relayoutData")
+    assert resp.status_code == 200, resp.get_data(as_text=True)[:300]